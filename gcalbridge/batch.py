@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+"""
+Batch write actions across every calendar that shares a domain.
+"""
+
+import json
+import logging
+import time
+
+from .metrics import registry as metrics
+
+MAX_ACTIONS_PER_BATCH = 950
+MIN_ACTIONS_PER_BATCH = 10
+INITIAL_ACTIONS_PER_BATCH = 200
+
+# Sub-request errors that mean we're sending too much, too fast.
+THROTTLE_REASONS = ["rateLimitExceeded", "userRateLimitExceeded",
+                    "quotaExceeded", "backendError"]
+
+
+def error_reasons(exception):
+    """
+    The reasons given in an API error response.
+    """
+    try:
+        errors = json.loads(exception.content)['error'].get('errors', [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return []
+    return [e.get('reason') for e in errors]
+
+
+def is_throttle_error(exception):
+    """
+    Does `exception` (from a batch callback) indicate we're being throttled?
+    """
+    resp = getattr(exception, 'resp', None)
+    if resp is None:
+        return False
+    if resp.status == 429 or resp.status >= 500:
+        return True
+    if resp.status != 403:
+        return False
+    return any(r in THROTTLE_REASONS for r in error_reasons(exception))
+
+
+class BatchSizeController:
+    """
+    Chooses how many actions go into a batch, AIMD-style: grow the size by a
+    fixed step after every healthy batch, and cut it by a factor whenever a
+    batch is slow or too many of its sub-requests were throttled.
+    """
+
+    def __init__(self, name=None, min_size=MIN_ACTIONS_PER_BATCH,
+                 max_size=MAX_ACTIONS_PER_BATCH, initial=None, step=25,
+                 backoff=0.5, target_latency=10.0, max_error_rate=0.02):
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.step = step
+        self.backoff = backoff
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        if initial is None:
+            initial = INITIAL_ACTIONS_PER_BATCH
+        self.size = self._clamp(initial)
+        metrics.gauge("batch_size", self.size, domain=self.name)
+
+    @classmethod
+    def from_config(cls, name, config):
+        """
+        Build a controller from a domain config, which may set
+        `min_batch_size`, `max_batch_size` and `initial_batch_size`.
+        """
+        return cls(name,
+                   min_size=config.get('min_batch_size',
+                                       MIN_ACTIONS_PER_BATCH),
+                   max_size=config.get('max_batch_size',
+                                       MAX_ACTIONS_PER_BATCH),
+                   initial=config.get('initial_batch_size'))
+
+    def _clamp(self, size):
+        return int(max(self.min_size, min(self.max_size, size)))
+
+    def observe(self, actions, latency, errors):
+        """
+        Adjust the batch size given a batch of `actions` sub-requests that
+        took `latency` seconds and came back with `errors` throttling errors.
+        """
+        error_rate = errors / float(actions) if actions else 0
+        if latency > self.target_latency or error_rate > self.max_error_rate:
+            size = self._clamp(self.size * self.backoff)
+            if size != self.size:
+                logging.info("Domain %s shrinking batches to %d "
+                             "(%.1fs, %d/%d throttled)", self.name, size,
+                             latency, errors, actions)
+        else:
+            size = self._clamp(self.size + self.step)
+        self.size = size
+        metrics.gauge("batch_size", self.size, domain=self.name)
+        metrics.gauge("batch_latency", latency, domain=self.name)
+        metrics.incr("batch_throttled", errors, domain=self.name)
+        return self.size
+
+
+class BatchCoordinator:
+    """
+    Collects write actions from all the Calendars belonging to one Domain
+    (and therefore one set of credentials) and packs them into as few
+    multipart batch requests as possible.
+
+    Calendars open and close their participation with `begin` and `commit`;
+    the pending actions are sent once no participant has an open batch, or
+    as soon as a batch reaches the size chosen by our BatchSizeController.
+    Every action keeps the callback supplied by the calendar that queued it,
+    so responses are routed back to the right calendar. A callback that
+    raises doesn't keep the rest of the batch from being delivered; what it
+    raised is kept for its calendar to pick up with `failures`.
+    """
+
+    def __init__(self, name=None, controller=None):
+        self.name = name
+        if controller is None:
+            controller = BatchSizeController(name)
+        self.controller = controller
+        self.open = set()
+        self.actions = []
+        self.batches_sent = 0
+        self.actions_sent = 0
+        # When the batch being executed was sent, for tracing.
+        self.sent_at = None
+        self.sleep = time.sleep
+        # Our domain's QuotaAccountant, if any.
+        self.quota = None
+        # Calendar -> what its callbacks raised.
+        self.failed = {}
+
+    def begin(self, calendar):
+        """
+        Register `calendar` as having an open batch.
+        """
+        self.open.add(calendar)
+
+    def add(self, calendar, action, callback):
+        """
+        Queue `action` on behalf of `calendar`. `callback` is called with the
+        usual (request_id, response, exception) arguments when the batch
+        containing the action is executed.
+        """
+        self.actions.append((calendar, action, callback))
+        if len(self.actions) >= self.controller.size:
+            self.flush()
+
+    def commit(self, calendar):
+        """
+        Close `calendar`'s batch. If no other calendar in the domain still
+        has an open batch, send everything that's pending.
+        """
+        self.open.discard(calendar)
+        if not self.open:
+            self.flush()
+
+    def discard(self, calendar):
+        """
+        Drop `calendar`'s batch and the actions it queued without sending
+        them. Returns the callbacks of the dropped actions.
+        """
+        self.open.discard(calendar)
+        self.failed.pop(calendar, None)
+        dropped = [a[2] for a in self.actions if a[0] is calendar]
+        self.actions = [a for a in self.actions if a[0] is not calendar]
+        return dropped
+
+    def failures(self, calendar):
+        """
+        The exceptions raised by `calendar`'s callbacks since we were last
+        asked, for actions that failed.
+        """
+        return self.failed.pop(calendar, [])
+
+    def flush(self):
+        """
+        Send all pending actions as a single batch request. Returns the number
+        of actions sent.
+        """
+        if not self.actions:
+            return 0
+        size = self.controller.size
+        actions, self.actions = self.actions[:size], self.actions[size:]
+        batch = actions[0][0].service.new_batch_http_request()
+        throttled = [0]
+        failed = [0]
+        delay = 0
+        calendars = set()
+
+        def counted(calendar, callback):
+            def wrapper(request_id, response, exception):
+                if exception is not None:
+                    failed[0] += 1
+                    if is_throttle_error(exception):
+                        throttled[0] += 1
+                try:
+                    callback(request_id, response, exception)
+                except Exception as e:
+                    # Raising here would leave the rest of the batch
+                    # undelivered.
+                    self.failed.setdefault(calendar, []).append(e)
+            return wrapper
+
+        for calendar, action, callback in actions:
+            batch.add(action, callback=counted(calendar, callback))
+            if calendar not in calendars:
+                calendars.add(calendar)
+                delay += calendar.ratelimit
+                calendar.ratelimit = 0
+        logging.debug("Domain %s sending batch of %d actions for %d calendars",
+                      self.name, len(actions), len(calendars))
+        if delay:
+            self.sleep(delay / 1000.0)
+        for journal in set(c.journal for c in calendars
+                           if getattr(c, 'journal', None) is not None):
+            # Our intents have to be on disk before the writes go out.
+            journal.sync()
+        start = self.sent_at = time.time()
+        if self.quota is not None:
+            # Every part of a batch counts against the quota.
+            self.quota.spend(len(actions), "write")
+        try:
+            batch.execute()
+        except Exception as e:
+            # The request as a whole failed.
+            if is_throttle_error(e):
+                throttled[0] = len(actions)
+            # Let whoever catches this know which domain failed.
+            e.domain = self.name
+            raise
+        finally:
+            self.controller.observe(len(actions), time.time() - start,
+                                    throttled[0])
+        if failed[0]:
+            metrics.incr("batch_failed", failed[0], domain=self.name)
+        self.batches_sent += 1
+        self.actions_sent += len(actions)
+        if self.actions:
+            return len(actions) + self.flush()
+        return len(actions)
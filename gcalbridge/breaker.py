@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+Circuit breakers that keep a failing domain from holding up the others.
+
+Each Domain has a CircuitBreaker. While it's closed, the domain's calendars
+sync normally. After `threshold` consecutive failures (revoked credentials,
+exhausted quota, server errors) it opens: the domain's calendars are
+quarantined and left out of syncs, while calendars in healthy domains carry
+on. Once `timeout` seconds have passed the breaker is half-open, and a
+cheap probe request decides whether to close it again or to stay open for
+twice as long. Only requests failing as a whole count: a write refused in
+a batch that otherwise went through is about one event, and stays with the
+calendar that made it.
+"""
+
+import logging
+import socket
+import time
+
+import httplib2
+
+from .batch import error_reasons
+from .metrics import registry as metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+DEFAULT_THRESHOLD = 3
+DEFAULT_TIMEOUT = 60
+DEFAULT_MAX_TIMEOUT = 3600
+
+# Reasons a request is forbidden that say something is wrong with the
+# domain as a whole (its credentials or its daily quota) rather than with
+# the event it was about.
+DOMAIN_FAILURE_REASONS = ["authError", "accessNotConfigured", "domainPolicy",
+                          "insufficientPermissions", "dailyLimitExceeded",
+                          "quotaExceeded"]
+
+
+def is_domain_failure(exception):
+    """
+    Whether `exception`, raised by a request as a whole (not a single part
+    of a batch, which is about one event), should count against the
+    breaker of the domain that made it.
+    """
+    if isinstance(exception, (socket.error, httplib2.HttpLib2Error)):
+        return True
+    resp = getattr(exception, 'resp', None)
+    status = getattr(resp, 'status', None)
+    if status is None:
+        return False
+    if status == 403:
+        return any(r in DOMAIN_FAILURE_REASONS
+                   for r in error_reasons(exception))
+    return status == 401 or status >= 500
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of a single domain.
+    """
+
+    def __init__(self, name=None, threshold=DEFAULT_THRESHOLD,
+                 timeout=DEFAULT_TIMEOUT, max_timeout=DEFAULT_MAX_TIMEOUT,
+                 clock=time.time):
+        self.name = name
+        self.threshold = threshold
+        self.base_timeout = timeout
+        self.timeout = timeout
+        self.max_timeout = max_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = None
+        self.last_error = None
+
+    @classmethod
+    def from_config(cls, name, config):
+        """
+        Build a breaker from a domain's config, which may set
+        `breaker_threshold`, `breaker_timeout` and `breaker_max_timeout`.
+        """
+        return cls(name,
+                   threshold=config.get('breaker_threshold',
+                                        DEFAULT_THRESHOLD),
+                   timeout=config.get('breaker_timeout', DEFAULT_TIMEOUT),
+                   max_timeout=config.get('breaker_max_timeout',
+                                          DEFAULT_MAX_TIMEOUT))
+
+    def _set_state(self, state):
+        if state != self.state:
+            logging.warn("Circuit breaker for %s is now %s", self.name, state)
+            self.state = state
+            metrics.gauge("breaker_open", int(state != CLOSED),
+                          domain=self.name)
+
+    def allow(self):
+        """
+        Whether the domain may be used. An open breaker turns half-open
+        once its timeout has passed; the caller should then `probe`.
+        """
+        if self.state == OPEN and \
+                self.clock() - self.opened >= self.timeout:
+            self._set_state(HALF_OPEN)
+        return self.state == CLOSED
+
+    def success(self):
+        self.failures = 0
+        if self.state != CLOSED:
+            self.timeout = self.base_timeout
+            self._set_state(CLOSED)
+
+    def failure(self, exception=None):
+        self.failures += 1
+        self.last_error = repr(exception) if exception else None
+        if self.state == HALF_OPEN:
+            self.timeout = min(self.timeout * 2, self.max_timeout)
+            self._open()
+        elif self.state == CLOSED and self.failures >= self.threshold:
+            self._open()
+
+    def _open(self):
+        self.opened = self.clock()
+        metrics.incr("breaker_opened", domain=self.name)
+        self._set_state(OPEN)
+
+    def probe(self, request):
+        """
+        If we're half-open, call `request` to find out whether the domain
+        has recovered. Returns whether the domain may be used.
+        """
+        if self.allow():
+            return True
+        if self.state != HALF_OPEN:
+            return False
+        try:
+            request()
+        except Exception as e:
+            logging.info("Probe of %s failed: %r", self.name, e)
+            self.failure(e)
+            return False
+        self.success()
+        return True
+
+    def status(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in": (max(0, self.opened + self.timeout - self.clock())
+                         if self.state == OPEN else None),
+            "last_error": self.last_error,
+        }
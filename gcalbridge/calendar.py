@@ -8,10 +8,23 @@ from pprint import pformat
 from collections import defaultdict
 from apiclient.errors import HttpError
 from errors import BadConfigError
+from .store import EventStore, SqliteEventStore, DEFAULT_CACHE_SIZE
+from .tracing import PropagationTracer, DEFAULT_SLOW_PROPAGATION
+from .recovery import is_sync_token_expired
+from .breaker import is_domain_failure
+from .batch import is_throttle_error
+from .seed import Seeder, DEFAULT_SEED_WORKERS
+from .writequeue import WriteQueue, INSERT, UPDATE, PATCH, priority
+from .quota import DEFAULT_QUOTA_HORIZON
+from .mergeindex import MergeIndex
+from .conflicts import ConflictIndex, RESOURCE_SUFFIX, load_hook
+from .streaming import stream
+from .metrics import registry as metrics
+from .profile import default_profile, group_profile
+from .logs import lazy
 from copy import deepcopy
 import time
 
-MAX_ACTIONS_PER_BATCH = 950
 ITERATION_LIMIT = 100
 
 
@@ -34,6 +47,9 @@ class Event(dict):
         "reminders",
         "transparency",
         "visibility",
+        "recurrence",
+        "recurringEventId",
+        "originalStartTime",
     ]
 
     special_props = [
@@ -42,11 +58,19 @@ class Event(dict):
 
     def __init__(self, args, **kwargs):
         self.dirty = False
+        # ehash() is cached until we're modified.
+        self._ehash = None
         super(Event, self).__init__(args, **kwargs)
 
     def active(self):
         return self['status'] != 'cancelled'
 
+    def master_id(self):
+        """
+        For an exception to a recurring event, the ID of the series master.
+        """
+        return self.get('recurringEventId')
+
     def __cmp__(self, obj):
         """
         Compare two events. If there's no meaningful difference, they're
@@ -58,6 +82,8 @@ class Event(dict):
         elif self.ehash() == obj.ehash():
             return 0
         else:
+            if not logging.getLogger().isEnabledFor(logging.DEBUG):
+                return cmp(self['updated'], obj['updated'])
             for p in self.props:
                 if p in self and p in obj:
                     if self[p] != obj[p]:
@@ -66,9 +92,27 @@ class Event(dict):
 
     def __setitem__(self, k, v):
         self.dirty = True
+        self._ehash = None
         dict.__setitem__(self, k, v)
 
+    def __delitem__(self, k):
+        self._ehash = None
+        dict.__delitem__(self, k)
+
+    def update(self, *args, **kwargs):
+        self._ehash = None
+        dict.update(self, *args, **kwargs)
+
+    def pop(self, *args):
+        self._ehash = None
+        return dict.pop(self, *args)
+
     def ehash(self):
+        if self._ehash is None:
+            self._ehash = self._compute_ehash()
+        return self._ehash
+
+    def _compute_ehash(self):
         d = {}
         for p in self.props:
             d[p] = self.get(p, None)
@@ -84,24 +128,58 @@ class Calendar:
     edit it.
     """
 
-    def __init__(self, config, domains=None, service=None):
+    def __init__(self, config, domains=None, service=None, profile=None):
 
+        self.config = config
         self.domain_id = config['domain']
         self.url = config['url']
         self.name = self.url
+        # Records say which calendar they're about; see logs.py.
+        self.log = logging.LoggerAdapter(logging.getLogger(),
+                                         {"calendar": self.url})
         self.sync_token = ""
-        self.events = {}
+        # Which fields we keep in sync; see profile.py.
+        self.profile = profile or default_profile()
+        self.events = EventStore()
         self.batch = None
         self.batch_count = 0
+        # Writes made while a batch is open, until it's committed.
+        self.queue = WriteQueue()
+        # IDs of events whose insert hasn't been acknowledged yet.
+        self.inserting = set()
         self.read_only = False
         self.calendar_metadata = None
         self.ratelimit = 0
+        # Set when our sync token expired and we still owe a full relist.
+        self.needs_relist = False
+        # For status reporting.
+        self.last_update = None
+        self.sync_token_time = None
+        self.pending_writes = 0
+        # Set by the SyncedCalendar we belong to.
+        self.tracer = None
+        # Our writes are recorded here, if set; see journal.py.
+        self.journal = None
 
         if 'read_only' in config:
             self.read_only = config['read_only']
 
-        logging.info("Creating new calendar at %s with url %s" % (self.
-            domain_id, self.url))
+        # A new member of its group, to be filled with events.import.
+        self.seed = config.get('seed', False)
+        self.seed_workers = config.get('seed_workers', DEFAULT_SEED_WORKERS)
+        self.seed_checkpoint = config.get('seed_checkpoint',
+                                          "seed_" + self.url + ".checkpoint")
+        # Events per listing page; Google's default if None.
+        self.page_size = config.get('page_size')
+
+        if 'event_store' in config:
+            # Keep events on disk rather than in memory.
+            self.events = SqliteEventStore(config['event_store'],
+                cache_size=config.get('event_cache_size', DEFAULT_CACHE_SIZE),
+                event_class=self.profile.event_class)
+
+        self.log.info("Creating new calendar at %s with url %s",
+                      self.domain_id, self.url)
 
         if domains is not None:
             if not self.domain_id in domains:
@@ -154,28 +232,43 @@ class Calendar:
     def active_events(self):
         return {k:v for k,v in self.events.iteritems() if v.active()}
 
-    def update_events_from_result(self, result, exception=None):
+    def update_events_from_result(self, result, exception=None, fetched=None,
+                                  listed=None):
         """
-        Given an Events resource result, update our local events.
+        Given an Events resource result (or a single Event, as returned by
+        writes), update our local events. `fetched` is when the request for a
+        listing was started, for tracing changes made elsewhere. The IDs of
+        the events listed are added to `listed`, if given.
         """
         if exception is not None:
-            logging.warn("Callback indicated failure -- exception: %s",
+            self.log.warning("Callback indicated failure -- exception: %s",
                 exception)
-            logging.debug(pformat(result))
-            logging.debug(pformat(exception))
+            self.log.debug("%s", lazy(pformat, result))
+            self.log.debug("%s", lazy(pformat, exception))
             raise exception
             # return 0
         updated = 0
-        for event in result.get("items", []):
+        items = result.get("items")
+        if items is None:
+            items = [result] if 'id' in result else []
+        for event in items:
             id = event['id']
-            new_event = Event(event)
+            if listed is not None:
+                listed.add(id)
+            if type(event) is self.profile.event_class:
+                # Already parsed into one; see streaming.py.
+                new_event = event
+            else:
+                new_event = self.profile.event(event)
             old_event = self.events.get(id, None)
             if new_event != old_event:  # see Event.__cmp__; not that simple!
                 if not (old_event and not old_event.active()):
                     updated += 1
-                self.events[id] = Event(event)
+                self.events[id] = new_event
+                if self.tracer and fetched is not None:
+                    self.tracer.seen(self, new_event, fetched)
         if updated:
-            logging.info("Updated %d events" % updated)
+            self.log.info("Updated %d events", updated)
         return updated
 
     def update_events(self):
@@ -183,79 +276,267 @@ class Calendar:
         Get events from Google and update our local events using
         update_events_from_result.
 
-        Uses syncToken to optimize result retrieval.
+        Uses syncToken to optimize result retrieval. If the sync token has
+        expired, relists the calendar instead (see `relist_events`).
         """
-        request = self.service.events().list(calendarId=self.url,
-                                          syncToken=self.sync_token,
-                                          showDeleted=True)
+        if self.needs_relist:
+            return self.relist_events()
+        request = stream(self.service.events().list(
+            calendarId=self.url, syncToken=self.sync_token, showDeleted=True,
+            maxResults=self.page_size, fields=self.profile.list_fields),
+            self.profile.event)
         updated = 0
+        # Only changes since our last listing are worth tracing; a first
+        # listing would trace every event there is.
+        fetched = time.time() if self.sync_token else None
+        try:
+            while request is not None:
+                self.domain.quota.spend(1, "list")
+                result = request.execute()
+                updated += self.update_events_from_result(result,
+                                                          fetched=fetched)
+                request = self.service.events().list_next(request, result)
+        except HttpError as e:
+            if not (self.sync_token and is_sync_token_expired(e)):
+                raise
+            logging.warn("Sync token for %s expired", self.name)
+            self.needs_relist = True
+            return updated + self.relist_events()
+        self._set_sync_token(result.get("nextSyncToken", ""))
+        return updated
+
+    def relist_events(self):
+        """
+        List every event of this calendar again, a page at a time, and
+        reconcile the result with the events we already have: events that
+        are no longer listed at all have been deleted, and are cancelled.
+
+        Relists are throttled per domain, and put off while its quota is
+        tight; if ours has to wait, this returns 0 and we keep our events
+        until a later sync gets to run it.
+        """
+        if self.domain.quota.tight():
+            self.log.info("Quota is tight, putting off relisting %s",
+                          self.name)
+            metrics.incr("quota_deferred_relists", domain=self.domain_id)
+            return 0
+        recoveries = self.domain.recoveries
+        if not recoveries.acquire(self):
+            return 0
+        logging.info("Relisting %s", self.name)
+        request = stream(self.service.events().list(
+            calendarId=self.url, showDeleted=True,
+            maxResults=recoveries.page_size, fields=self.profile.list_fields),
+            self.profile.event)
+        updated = 0
+        listed = set()
         while request is not None:
+            self.domain.quota.spend(1, "list")
             result = request.execute()
-            updated += self.update_events_from_result(result)
+            # Not traced: we can't tell what's new from what's old.
+            updated += self.update_events_from_result(result, listed=listed)
             request = self.service.events().list_next(request, result)
-        self.sync_token = result.get("nextSyncToken", "")
-        # logging.info("Got %d events. syncToken is now %s" % (updated,
-        # self.sync_token))
+            if request is not None:
+                recoveries.pause()
+        for id in set(self.events.keys()) - listed:
+            event = self.events[id]
+            if event.active():
+                self.log.debug("%s vanished from %s", id, self.name)
+                self.events[id] = self.profile.event(
+                    dict(event, status='cancelled'))
+                updated += 1
+        self.needs_relist = False
+        self._set_sync_token(result.get("nextSyncToken", ""))
+        logging.info("Relisted %d events of %s, %d changed", len(listed),
+                     self.name, updated)
         return updated
 
+    def _set_sync_token(self, sync_token):
+        self.last_update = time.time()
+        if sync_token != self.sync_token:
+            self.sync_token = sync_token
+            self.sync_token_time = self.last_update
+
     def begin_batch(self):
         """
-        Start a new batch of actions.
+        Start a new batch of actions. Actions are handed to our domain's
+        BatchCoordinator, which packs them together with those of every other
+        calendar in the same domain.
         """
-        logging.debug("Calendar %s starting new batch" % self.url)
+        self.log.debug("Calendar %s starting new batch", self.url)
         if self.batch:
             logging.warn(
                 "begin_batch called with active batch! Trying to commit")
             self.commit_batch()
-        self.batch = self.service.new_batch_http_request()
+        self.batch = self.domain.batcher
+        self.batch.begin(self)
 
     def commit_batch(self):
         """
-        Execute the currently active batch.
+        Close the currently active batch. The coordinator sends it once no
+        other calendar in the domain has a batch open.
         """
         if not self.batch:
             logging.warn("commit_batch called but no batch was started!")
             return
-        if self.batch_count:
-            # Only commit a batch when necessary, to save on HTTP requests.
-            logging.debug("Calendar %s committing batch of %d" % (self.url,
-                self.batch_count))
-            if self.ratelimit:
-                time.sleep(self.ratelimit / 1000.0)
-                self.ratelimit = 0
-            result = self.batch.execute()
-            #self.update_events_from_result(result)
-            # logging.debug(pformat(result))
+        for write in self.queue.drain():
+            self._action_to_batch(self._action(write.kind, write.event_id,
+                                               write.body), write.event_id,
+                                  insert=write.kind == INSERT,
+                                  queued=write.queued,
+                                  seq=self._intend(write.kind, write.event_id,
+                                                   write.body))
+        self.log.debug("Calendar %s committing batch of %d", self.url,
+                       self.batch_count)
+        batch, self.batch = self.batch, None
+        self.batch_count = 0
+        batch.commit(self)
+
+    def abort_batch(self):
+        """
+        Throw away whatever we queued that hasn't been sent yet. Events we
+        stored in anticipation of inserting them are forgotten again, so
+        that the next merge inserts them.
+        """
+        for write in self.queue.clear():
+            if write.kind == INSERT:
+                self.events.discard(write.event_id)
+        for callback in self.domain.batcher.discard(self):
+            if getattr(callback, 'insert', False):
+                self.events.discard(callback.event_id)
+            if getattr(callback, 'seq', None) is not None:
+                # Never sent.
+                self.journal.done(callback.seq)
+        self.inserting.clear()
         self.batch = None
         self.batch_count = 0
+        self.pending_writes = 0
 
-    def _action_to_batch(self, action):
+    def _action_to_batch(self, action, event_id=None, insert=False,
+                         queued=None, seq=None):
         """
-        Add an action to the currently active batch. If the batch contains more
-        than MAX_ACTIONS_PER_BATCH actions, commit it and start a new one.
+        Add an action to the currently active batch. The coordinator commits
+        the batch by itself once it's full. `seq` is the action's intent in
+        our journal, marked done when the response comes back.
         """
         if self.batch:
-            self.batch.add(action, callback=lambda request_id, response,
-                exception: self.update_events_from_result(response,
-                exception=exception))
             self.batch_count += 1
+            self.pending_writes += 1
             self.ratelimit += 2
-            if self.batch_count > MAX_ACTIONS_PER_BATCH:
-                self.commit_batch()
-                self.begin_batch()
+            if queued is None:
+                queued = time.time()
+
+            def callback(request_id, response, exception):
+                if insert:
+                    self.inserting.discard(event_id)
+                    if exception is not None:
+                        # Not there after all; the next merge inserts it.
+                        self.events.discard(event_id)
+                if exception is not None:
+                    exception.event_id = event_id
+                if seq is not None:
+                    self.journal.done(seq)
+                if self.tracer:
+                    if exception is None:
+                        self.tracer.acked(self, event_id, queued,
+                                          self.domain.batcher.sent_at)
+                    else:
+                        self.tracer.failed(event_id)
+                return self._batch_callback(request_id, response, exception)
+
+            callback.event_id = event_id
+            callback.insert = insert
+            callback.seq = seq
+            self.batch.add(self, action, callback=callback)
         else:
             logging.critical(
                 "Tried to add a batch action but no batch was active!")
             raise RuntimeError
 
+    def _intend(self, kind, event_id, body):
+        """
+        Record a write in our journal, if we have one. Returns the intent's
+        sequence number.
+        """
+        if self.journal is None:
+            return None
+        return self.journal.intend(self.url, event_id, kind,
+                                   self.profile.event(body).ehash())
+
+    def verify_journal(self):
+        """
+        Fetch the events of writes the journal has left unfinished, which we
+        may or may not have made before we last stopped, and store them, so
+        that what landed isn't written again. Returns the number fetched.
+        """
+        if self.journal is None:
+            return 0
+        unfinished = self.journal.unfinished(self.url)
+        for intent in unfinished:
+            self.domain.quota.spend(1, "verify")
+            try:
+                result = self.service.events().get(
+                    calendarId=self.url, eventId=intent["id"]).execute()
+            except HttpError as e:
+                if e.resp.status not in (404, 410):
+                    raise
+                outcome = "missing"
+            else:
+                event = self.profile.event(result)
+                outcome = "landed" if event.ehash() == intent["hash"] \
+                    else "differs"
+                self.update_events_from_result(event)
+            logging.info("Unfinished %s of %s in %s: %s", intent["op"],
+                         intent["id"], self.name, outcome)
+            metrics.incr("journal_verified", outcome=outcome)
+            self.journal.done(intent["seq"])
+        return len(unfinished)
+
+    def _batch_callback(self, request_id, response, exception):
+        self.pending_writes = max(0, self.pending_writes - 1)
+        return self.update_events_from_result(response, exception=exception)
+
+    def status(self):
+        """
+        A summary of this calendar's sync state, for status reporting.
+        """
+        now = time.time()
+        return {
+            "name": self.name,
+            "url": self.url,
+            "domain": self.domain_id,
+            "read_only": self.read_only,
+            "last_update": self.last_update,
+            "sync_token_age": (now - self.sync_token_time
+                               if self.sync_token_time else None),
+            "pending_writes": self.pending_writes,
+            "queued_writes": len(self.queue),
+            "needs_relist": self.needs_relist,
+            "breaker": self.domain.breaker.status(),
+            "quota": self.domain.quota.status(),
+        }
+
+    def has_master(self, master_id):
+        """
+        Whether the series master `master_id` exists here, so that its
+        instances can be written.
+        """
+        return master_id in self.events and master_id not in self.inserting
+
     def sync_event(self, event):
         """
         If `event` doesn't exist, create it with `add_event`; otherwise,
         if `event` is newer than our version, patch it with our version.
 
+        Exceptions to recurring events are never inserted: their instance
+        already exists wherever the series master does, so we update it.
+
         Idempotent if `event` is already the latest version.
         """
         eid = event['id']
+        if event.master_id() and eid not in self.events:
+            self.events[eid] = event
+            return self.update_event(eid, event)
         if eid in self.events:
             my_event = self.events[eid]
             if (my_event['status'] == 'cancelled' and event['status'] ==
@@ -276,16 +557,50 @@ class Calendar:
             return self.add_event(event)
             # return self.import_event(event)
 
-    def _process_action(self, action):
+    def _action(self, kind, event_id, body):
+        """
+        The API request for a write.
+        """
+        events = self.service.events()
+        if kind == INSERT:
+            return events.insert(calendarId=self.url, body=body)
+        elif kind == PATCH:
+            return events.patch(calendarId=self.url, eventId=event_id,
+                                body=body)
+        return events.update(calendarId=self.url, eventId=event_id,
+                             body=body)
+
+    def _process_action(self, kind, event_id, body):
         """
-        If we're running in batch mode, add the action to a batch.
-        Otherwise, execute the action immediately and update.
+        If we're running in batch mode, queue the write until the batch is
+        committed, folding it into any write already queued for the same
+        event. Otherwise, execute it immediately and update.
         """
+        if self.profile.partial:
+            # Leave fields outside our profile alone.
+            body = self.profile.payload(body)
+            if kind == UPDATE:
+                kind = PATCH
         if self.batch:
-            return self._action_to_batch(action)
+            if kind == INSERT:
+                self.inserting.add(event_id)
+            if self.queue.put(kind, event_id, body) and self.tracer:
+                self.tracer.queued(event_id)
+            return None
         else:
-            result = action.execute()
+            if self.tracer:
+                self.tracer.queued(event_id)
+            seq = self._intend(kind, event_id, body)
+            if seq is not None:
+                self.journal.sync()
+            sent = time.time()
+            self.domain.quota.spend(1, "write")
+            result = self._action(kind, event_id, body).execute()
+            if seq is not None:
+                self.journal.done(seq)
             # logging.debug(pformat(result))
+            if self.tracer:
+                self.tracer.acked(self, event_id, sent, sent)
             self.update_events_from_result(result)
             return result
 
@@ -294,10 +609,9 @@ class Calendar:
         Add an event, then update our events with the result.
         """
         if self.read_only:
-            logging.debug("RO: %s +> %s" % (event['id'], self.name))
+            self.log.debug("RO: %s +> %s", event['id'], self.name)
             return None
-        action = self.service.events().insert(calendarId=self.url, body=event)
-        return self._process_action(action)
+        return self._process_action(INSERT, event.get('id'), event)
 
     def patch_event(self, event_id, new_event):
         """
@@ -305,12 +619,9 @@ class Calendar:
         data in `event`.
         """
         if self.read_only:
-            logging.debug("RO: %s => %s" % (new_event['id'], self.name))
+            self.log.debug("RO: %s => %s", new_event['id'], self.name)
             return None
-        action = self.service.events().patch(calendarId=self.url,
-                                             eventId=event_id,
-                                             body=new_event)
-        return self._process_action(action)
+        return self._process_action(PATCH, event_id, new_event)
 
     def update_event(self, event_id, new_event):
         """
@@ -318,13 +629,10 @@ class Calendar:
         data in `event`.
         """
         if self.read_only:
-            logging.debug("RO: %s ~> %s" % (new_event['id'], self.name))
+            self.log.debug("RO: %s ~> %s", new_event['id'], self.name)
             return None
         # new_event['sequence'] += 1
-        action = self.service.events().update(calendarId=self.url,
-                                             eventId=event_id,
-                                             body=new_event)
-        return self._process_action(action)
+        return self._process_action(UPDATE, event_id, new_event)
 
     def push_events(self, batch=False):
         """
@@ -333,12 +641,11 @@ class Calendar:
         """
         if batch: self.begin_batch()
         updates = 0
-        for eid, e in self.events.iteritems():
-            if e.dirty:
-                logging.debug("Pushing dirty event %s", eid)
-                self.update_event(eid, e)
-                e.dirty = False
-                updates += 1
+        for eid, e in self.events.dirty_items():
+            self.log.debug("Pushing dirty event %s", eid)
+            self.update_event(eid, e)
+            e.dirty = False
+            updates += 1
             # if updates > MAX_ACTIONS_PER_BATCH:
             #     if batch:
             #         self.commit_batch()
@@ -352,22 +659,114 @@ class SyncedCalendar:
     A collection of Calendars to be synced.
     """
 
-    def __init__(self, name, config, domains=None):
+    def __init__(self, name, config, domains=None, profiles=None,
+                 previous=None, feed=None):
+        """
+        If `previous` is the SyncedCalendar we're replacing (see
+        Config.reload), its Calendars are reused, events and sync tokens
+        included, wherever their configuration didn't change. Merged changes
+        are written to `feed`, a ChangeFeed, if given.
+        """
         self.name = name
+        self.config = config
+        self.profile = group_profile(name, config, profiles)
+        reusable = {}
+        if previous is not None and previous.profile.same_fields(self.profile):
+            reusable = dict(((c.url, c.domain_id), c)
+                            for c in previous.calendars)
         self.calendars = []
         for cal_config in config['calendars']:
-            cal = Calendar(cal_config, domains=domains)
+            cal = reusable.get((cal_config['url'], cal_config['domain']))
+            if cal is None or cal.config != cal_config or \
+                    domains is None or cal.domain is not domains.get(
+                        cal.domain_id):
+                cal = Calendar(cal_config, domains=domains,
+                               profile=self.profile)
             self.calendars.append(cal)
-        self.event_set = set()
+        # The store cycle of each calendar through which its changes have
+        # been merged.
+        self.merged = {}
+        if previous is not None and \
+                set(self.calendars) <= set(previous.calendars):
+            # Nobody new who'd need everything merged again.
+            self.merged = dict((c, previous.merged[c]) for c in self.calendars
+                               if c in previous.merged)
+        # Calendars left out of syncs because their domain is failing.
+        self.quarantined = set()
+        # Exceptions to recurring events waiting for their series master to
+        # be created somewhere.
+        self.deferred = set(previous.deferred) if self.merged else set()
+        # Events whose merge was put off to save quota (or whose write
+        # failed), and how far ahead (or back) an event has to be for that.
+        self.postponed = set(previous.postponed) if self.merged else set()
+        self.quota_horizon = config.get('quota_horizon',
+                                        DEFAULT_QUOTA_HORIZON)
+        self.feed = feed
+        self.tracer = PropagationTracer(name, slow=config.get(
+            'slow_propagation', DEFAULT_SLOW_PROPAGATION))
+        for cal in self.calendars:
+            cal.tracer = self.tracer
+        # Double bookings; rooms are checked by default.
+        self.conflicts = None
+        if config.get('detect_conflicts', any(
+                c.url.endswith(RESOURCE_SUFFIX) for c in self.calendars)):
+            hook = None
+            if config.get('conflict_hook'):
+                try:
+                    hook = load_hook(config['conflict_hook'])
+                except (ImportError, AttributeError) as e:
+                    raise BadConfigError("Bad conflict_hook for %s: %r" %
+                                         (name, e))
+            self.conflicts = ConflictIndex(name, hook)
+        # Not for events on disk; see mergeindex.py.
+        self.index = None
+        if not [c for c in self.calendars if hasattr(c.events, 'flush')]:
+            self.index = MergeIndex(self.calendars, listener=self._merged
+                                    if self.conflicts else None)
+        # For status reporting.
+        self.backoff = 0
+        self.iterations = 0
+        self.cycle_start = None
+        self.cycle_duration = None
+        self.last_converged = None
+        self.publish()
+
+    def _merged(self, id, entry):
+        """
+        Keep the ConflictIndex up to date with the MergeIndex.
+        """
+        if entry is None or entry.cancelled:
+            self.conflicts.update(id, None)
+        else:
+            self.conflicts.update(id, entry.source.events.get(id))
 
     def sync_event(self, id):
         """
         Find the most up-to-date version of a given event, and sync changes
         that need to be made.
         """
+        entry = self.index.get(id) if self.index is not None else None
+        if entry is not None and not entry.stale and not entry.master and \
+                id not in self.deferred:
+            # Already the same everywhere, typically our own write coming
+            # back; nothing to compare or write.
+            self.tracer.settle(id)
+            if self.feed:
+                self.feed.emit(self.name, entry.source.events[id],
+                               entry.source.url)
+            return 0
         events = [c.events[id] for c in self.calendars if id in c.events]
         if not [e for e in events if e.active()]:
-            # All events cancelled. We don't care.
+            # All events cancelled. We don't care, unless it's an occurrence
+            # of a series, which is still there wherever it wasn't cancelled.
+            if events and max(events).master_id():
+                return self.cancel_occurrence(max(events))
+            self.tracer.settle(id)
+            self.deferred.discard(id)
+            if self.conflicts and self.index is None:
+                self.conflicts.update(id, None)
+            if self.feed and events:
+                self.feed.emit(self.name, max(events))
             return 0
         elif [e for e in events if not e.active()]:
             # One or more events cancelled. All events should be cancelled.
@@ -379,10 +778,180 @@ class SyncedCalendar:
             # you get an update! you get an update! everyone gets an update!
             event['sequence'] = sequence + 1
             logging.debug("increasing SN of %.5s to %d", id, event['sequence'])
-        return sum([c.sync_event(event) is not None for c in self.calendars])
+        source = [c for c in self.calendars if c.events.get(id) is event]
+        self.tracer.merged(id, source[0] if source else None)
+        if self.feed:
+            self.feed.emit(self.name, event, source[0].url if source else None)
+        targets = [c for c in self.calendars if c not in self.quarantined]
+        master_id = event.master_id()
+        if master_id:
+            targets = self.exception_targets(event, targets)
+        writes = sum([c.sync_event(event) is not None for c in targets])
+        if self.index is not None:
+            # Versions may have been changed in place above.
+            self.index.refresh(id)
+        elif self.conflicts:
+            self.conflicts.update(id, event)
+        self.tracer.settle(id)
+        return writes + (id in self.deferred)
+
+    def cancel_occurrence(self, event):
+        """
+        Cancel the occurrence of a series that `event` cancelled wherever it
+        hasn't been yet.
+        """
+        id = event['id']
+        self.tracer.merged(id, None)
+        if self.feed:
+            self.feed.emit(self.name, event)
+        targets = self.exception_targets(event, [
+            c for c in self.calendars
+            if c not in self.quarantined and id not in c.events])
+        writes = sum([c.sync_event(event) is not None for c in targets])
+        if self.index is not None:
+            self.index.refresh(id)
+        elif self.conflicts:
+            self.conflicts.update(id, None)
+        self.tracer.settle(id)
+        return writes + (id in self.deferred)
+
+    def exception_targets(self, event, targets):
+        """
+        The calendars among `targets` an exception to a recurring event can
+        be written to. Exceptions to a series that's cancelled (or unknown)
+        aren't written anywhere, as there's nothing for them to modify;
+        calendars still waiting for the series master to be created get the
+        exception in a later iteration.
+        """
+        master_id = event.master_id()
+        masters = [c.events[master_id] for c in self.calendars
+                   if master_id in c.events]
+        if not masters or [m for m in masters if not m.active()]:
+            logging.debug("Skipping exception %s to series %s", event['id'],
+                          "cancelled" if masters else "unknown")
+            metrics.incr("recurrence_skipped")
+            self.deferred.discard(event['id'])
+            return []
+        ready = [c for c in targets if c.has_master(master_id)]
+        if len(ready) < len(targets):
+            self.deferred.add(event['id'])
+            metrics.incr("recurrence_deferred")
+        else:
+            self.deferred.discard(event['id'])
+        return ready
+
+    def postpone(self, pending):
+        """
+        If the quota of any of our domains is running tight, take the events
+        that can wait (those starting beyond our horizon, or long over) out
+        of `pending` until a later sync. Returns what's left.
+        """
+        tight = [c for c in self.calendars if c not in self.quarantined and
+                 c.domain.quota.tight()]
+        if not tight:
+            return pending
+        now = time.time()
+        later = set()
+        for id in pending:
+            events = [c.events[id] for c in self.calendars if id in c.events]
+            if events and priority(max(events), now)[0] > self.quota_horizon:
+                later.add(id)
+        if later:
+            logging.info("Quota of %s running tight: postponing %d of %d "
+                         "events in %s", tight[0].domain_id, len(later),
+                         len(pending), self.name)
+            metrics.incr("quota_postponed", len(later), group=self.name)
+            self.postponed.update(later)
+        return pending - later
+
+    def is_exception(self, id):
+        """
+        Whether event `id` is an exception to a recurring event.
+        """
+        for c in self.calendars:
+            if id in c.events:
+                return bool(c.events[id].master_id())
+        return False
+
+    def changed_events(self):
+        """
+        IDs of events that changed in any calendar since they were last
+        merged.
+        """
+        ids = set()
+        for cal in self.calendars:
+            ids.update(cal.events.changed_since(self.merged.get(cal, 0)))
+        return ids
+
+    def update_quarantine(self):
+        """
+        Quarantine the calendars of domains whose circuit breaker is open,
+        and release those whose domain recovered.
+        """
+        quarantined = set(c for c in self.calendars
+                          if not c.domain.available())
+        if self.quarantined - quarantined:
+            # Calendars coming back missed whatever changed meanwhile, so
+            # merge everything again.
+            self.merged.clear()
+        self.quarantined = quarantined
+
+    def quarantine(self, exception):
+        """
+        If `exception` means the domain that raised it is failing, count it
+        against the domain's breaker and leave its calendars out for the rest
+        of this sync. Returns whether the exception was handled that way.
+        """
+        domain = getattr(exception, 'domain', None)
+        calendars = [c for c in self.calendars if c.domain_id == domain]
+        if not calendars or not is_domain_failure(exception):
+            return False
+        logging.warn("Quarantining calendars of %s in %s: %r", domain,
+                     self.name, exception)
+        calendars[0].domain.breaker.failure(exception)
+        self.quarantined.update(calendars)
+        return True
+
+    def write_failed(self, cal, exception):
+        """
+        Deal with a write of `cal`'s that failed in a batch. Errors that may
+        go away are raised, so that we back off and try again; any other
+        concerns only that event in that calendar, which is left for the
+        next sync.
+        """
+        if not isinstance(exception, HttpError) or \
+                exception.resp.status == 401 or is_throttle_error(exception):
+            raise exception
+        cal.log.warning("Writing %s failed, trying again next sync: %s",
+                        exception.event_id, exception)
+        metrics.incr("write_failed", group=self.name)
+        self.postponed.add(exception.event_id)
+
+    def seed_calendars(self, calendars):
+        """
+        Seed the calendars among `calendars` that are new to the group with
+        the events of the others. Returns the number of events imported.
+        """
+        seeding = [c for c in calendars if c.seed and not c.read_only]
+        sources = [c for c in calendars if not c.seed]
+        imported = 0
+        for cal in seeding:
+            if cal.domain.quota.tight():
+                logging.info("Quota of %s running tight: not seeding %s yet",
+                             cal.domain_id, cal.name)
+                continue
+            seeder = Seeder(cal, sources, workers=cal.seed_workers,
+                            checkpoint=cal.seed_checkpoint)
+            imported += seeder.run()
+            if not seeder.failed:
+                cal.seed = False
+        return imported
 
     def print_debug_events(self):
-        for e in self.event_set:
+        event_set = set()
+        for c in self.calendars:
+            event_set.update(c.events.keys())
+        for e in event_set:
             print(("%.5s" % e), end=' ')
             for c in self.calendars:
                 if e in c.events:
@@ -402,35 +971,110 @@ class SyncedCalendar:
         changes = 0
         total_changes = 0
         iterations = 0
+        self.cycle_start = time.time()
+        self.update_quarantine()
 
-        while changes or (iterations == 0):
+        retry = False
+
+        while changes or retry or (iterations == 0):
             try:
                 total_changes += changes
                 changes = 0
-                for cal in self.calendars:
-                    logging.info("Updating calendar: %s" % cal.url)
+                retry = False
+                active = [c for c in self.calendars
+                          if c not in self.quarantined]
+                for cal in active:
+                    cal.log.info("Updating calendar: %s", cal.url)
                     # First, get the latest set of events from Google.
-                    changes += cal.update_events()
+                    try:
+                        if iterations == 0:
+                            cal.verify_journal()
+                        changes += cal.update_events()
+                    except HttpError as e:
+                        e.domain = cal.domain_id
+                        raise
+                    cal.domain.breaker.success()
                     # Start a batch on this calendar.
                     cal.begin_batch()
-                    # Update our set of event IDs.
-                    self.event_set.update(cal.events.keys())
 
-                changes += sum([self.sync_event(eid) for eid in self.event_set])
+                if iterations == 0:
+                    self.seed_calendars(active)
 
-                for cal in self.calendars:
+                # Only events that changed somewhere need merging. Anything
+                # stored from here on belongs to the next cycle.
+                pending = self.changed_events() | self.deferred
+                if iterations == 0:
+                    pending |= self.postponed
+                    self.postponed = set()
+                pending = self.postpone(pending)
+                cycles = dict((cal, cal.events.new_cycle())
+                              for cal in self.calendars)
+
+                # Series masters go before their exceptions.
+                changes += sum([self.sync_event(eid)
+                                for eid in sorted(pending,
+                                                  key=self.is_exception)])
+
+                for cal in active:
                     changes += cal.push_events()
                     cal.commit_batch()
+                for cal in active:
+                    for e in cal.domain.batcher.failures(cal):
+                        self.write_failed(cal, e)
+                self.merged.update(cycles)
                 iterations += 1
                 if iterations > ITERATION_LIMIT:
                     raise RuntimeError("Bug: exceeded iteration limit.")
                 logging.debug("sync() iteration %d: %d changes, %d total", iterations, changes, total_changes)
+                self.publish()
             except HttpError as e:
                 iterations += 1
-                time.sleep(2 ** (iterations))
+                for cal in self.calendars:
+                    cal.abort_batch()
+                self.tracer.reset()
+                if self.quarantine(e):
+                    # The other domains carry on without waiting.
+                    retry = True
+                    continue
+                self.backoff = 2 ** iterations
+                self.publish()
+                time.sleep(self.backoff)
                 for cal in self.calendars:
                     cal.ratelimit += 1000 * (2 ** iterations)
         for cal in self.calendars:
             cal.ratelimit = False
 
+        self.backoff = 0
+        self.iterations = iterations
+        self.last_converged = time.time()
+        self.cycle_duration = self.last_converged - self.cycle_start
+        self.publish()
         return total_changes
+
+    def publish(self):
+        """
+        Take a summary of our sync state for status() to report. The status
+        endpoint runs in a thread of its own, so rather than look at our
+        sets and indexes while a sync changes them, it gets the summary we
+        took between two iterations.
+        """
+        self.published = {
+            "as_of": time.time(),
+            "name": self.name,
+            "last_converged": self.last_converged,
+            "cycle_duration": self.cycle_duration,
+            "iterations": self.iterations,
+            "backoff": self.backoff,
+            "profile": self.profile.name,
+            "quarantined": sorted(c.name for c in self.quarantined),
+            "postponed": len(self.postponed),
+            "conflicts": self.conflicts.open() if self.conflicts else None,
+            "calendars": [c.status() for c in self.calendars],
+        }
+
+    def status(self):
+        """
+        A summary of this group's sync state, as of the last iteration of
+        a sync.
+        """
+        return self.published
@@ -7,10 +7,18 @@ Manage configuration.
 import json
 import os.path
 import logging
+from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 from pprint import pformat
 
 from .domain import Domain
 from .calendar import SyncedCalendar
+from .profile import profiles_from_config, group_profile
+from .quota import QuotaAccountant, DEFAULT_DAILY_QUOTA
+from .metrics import Timeline
+from .feed import ChangeFeed
+from .journal import Journal
+from .health import DEFAULT_ADDRESS
 from .errors import BadConfigError
 
 
@@ -31,10 +39,33 @@ class Config:
         "Time to wait while polling", "max_exceptions":
         "Number of exceptions to encounter before exiting"}
 
+    # Settings that may be left out, and their defaults.
+    optional = {
+        "api_root": None,
+        "health_port": None,
+        "health_address": DEFAULT_ADDRESS,
+        "health_slo": 600,
+        "profiles": {},
+        "ha": None,
+        "quota": {},
+        "startup_workers": 8,
+        "feed": None,
+        "journal": None,
+        "logging": None,
+    }
+
     def __init__(self, filename="config.json"):
 
         if not os.path.isfile(filename):
             raise RuntimeError("Config file %s not found." % filename)
+        self.filename = filename
+        self.mtime = os.path.getmtime(filename)
+        # What setup() built, for reloading.
+        self.running_domains = {}
+        self.running_groups = {}
+        self.project_quota = None
+        self.change_feed = None
+        self.write_journal = None
         with open(filename, 'r') as f:
             self.__dict__.update(json.loads(f.read()))
 
@@ -46,6 +77,12 @@ class Config:
                     "Config file %s missing needed config entry: %s [%s]" % \
                     (filename, k, self.config_needed[k]))
 
+        for k, v in self.optional.items():
+            if not hasattr(self, k):
+                setattr(self, k, deepcopy(v))
+
+        self.check_layout()
+
         # Ensure our Client ID file exists, is readable, is valid JSON
 
         if not os.path.isfile(self.client_id_file):
@@ -59,23 +96,196 @@ class Config:
             raise RuntimeError("Client ID file %s is not valid JSON! %s" %
                 repr(e))
 
-    def setup(self):
+    def check_layout(self):
+        """
+        Make sure domains, groups and their calendars have what setup()
+        needs, so that a broken file is refused before anything is built.
+        """
+        domains = getattr(self, 'domains', {})
+        if not isinstance(domains, dict):
+            raise BadConfigError("%s: domains must be an object" %
+                                 self.filename)
+        for name, domain in domains.items():
+            if not isinstance(domain, dict) or 'account' not in domain:
+                raise BadConfigError("%s: domain %s needs an account" %
+                                     (self.filename, name))
+        groups = getattr(self, 'calendars', {})
+        if not isinstance(groups, dict):
+            if not groups:
+                # As in our defaults.
+                return
+            raise BadConfigError("%s: calendars must be an object" %
+                                 self.filename)
+        for name, group in groups.items():
+            if not isinstance(group, dict) or \
+                    not isinstance(group.get('calendars'), list):
+                raise BadConfigError("%s: group %s needs a list of calendars"
+                                     % (self.filename, name))
+            for cal in group['calendars']:
+                if not isinstance(cal, dict) or 'url' not in cal or \
+                        'domain' not in cal:
+                    raise BadConfigError("%s: calendars of group %s need a "
+                                         "url and a domain" %
+                                         (self.filename, name))
+                if cal['domain'] not in domains:
+                    raise BadConfigError("%s: group %s uses undefined domain "
+                                         "%s" % (self.filename, name,
+                                                 cal['domain']))
+
+    def domain_config(self, domain):
+        domain_config = self.domains[domain]
+        if self.api_root:
+            domain_config = dict(domain_config)
+            domain_config.setdefault('api_root', self.api_root)
+        return domain_config
+
+    def setup(self, previous=None):
         """
         Given a config, perform setup of sync system.
+
+        If `previous` (a Config that was set up before) is given, its
+        Domains, Calendars and SyncedCalendars are reused, state and all,
+        wherever their configuration didn't change.
         """
 
         domains = {}
         calendars = {}
+        old_domains = previous.running_domains if previous else {}
+        old_groups = previous.running_groups if previous else {}
+        self.timeline = Timeline("reload" if previous else "startup")
+
+        # The previous feed and journal stay open until reload() is done
+        # with them.
+        if previous and previous.feed == self.feed:
+            self.change_feed = previous.change_feed
+        else:
+            self.change_feed = ChangeFeed.from_config(self.feed)
+
+        if previous and previous.journal == self.journal:
+            self.write_journal = previous.write_journal
+        else:
+            self.write_journal = Journal.from_config(self.journal)
+
+        if previous and previous.quota == self.quota:
+            self.project_quota = previous.project_quota
+        else:
+            self.project_quota = QuotaAccountant.from_config(
+                "project", self.quota, daily=DEFAULT_DAILY_QUOTA)
 
         for domain in self.domains:
-            domains[domain] = Domain(domain,
-                                     self.domains[domain])
+            domain_config = self.domain_config(domain)
+            old = old_domains.get(domain)
+            if old is not None and old.domain_config == domain_config and \
+                    old.quota.parent is self.project_quota:
+                # New calendars may have been shared with it since.
+                old.calendar_metadata = None
+                domains[domain] = old
+            else:
+                domains[domain] = Domain(domain, domain_config,
+                                         authorize=False,
+                                         project_quota=self.project_quota)
+        new = [d for d in domains.values() if d is not old_domains.get(
+            d.domain)]
+
+        pool = ThreadPool(self.startup_workers)
+        try:
+            with self.timeline.phase("credentials"):
+                # Prompting for codes has to be done one at a time.
+                for d in new:
+                    if d.needs_code():
+                        d.authorize()
+                pool.map(lambda d: d.authorize(),
+                         [d for d in new if d.credentials is None])
+            with self.timeline.phase("calendar_lists"):
+                used = set(c['domain'] for g in self.calendars.values()
+                           for c in g['calendars'] if c['domain'] in domains)
+                pool.map(lambda d: d.get_calendars(),
+                         [domains[d] for d in used])
+        finally:
+            pool.close()
+            pool.join()
 
         logging.debug(pformat(domains))
+        profiles = profiles_from_config(self.profiles)
 
-        for cal in self.calendars:
-            calendars[cal] = SyncedCalendar(cal,
-                                            self.calendars[cal],
-                                            domains=domains)
+        with self.timeline.phase("groups"):
+            for cal in self.calendars:
+                old = old_groups.get(cal)
+                if old is not None and old.config == self.calendars[cal] and \
+                        old.profile.same_fields(group_profile(
+                            cal, self.calendars[cal], profiles)) and \
+                        all(c.domain is domains.get(c.domain_id)
+                            for c in old.calendars):
+                    calendars[cal] = old
+                    continue
+                calendars[cal] = SyncedCalendar(cal,
+                                                self.calendars[cal],
+                                                domains=domains,
+                                                profiles=profiles,
+                                                previous=old,
+                                                feed=self.change_feed)
         logging.debug(pformat(calendars))
+        # Only now that nothing can fail any more, as groups we reuse are
+        # still the running ones until then.
+        for group in calendars.values():
+            group.feed = self.change_feed
+            for cal in group.calendars:
+                cal.journal = self.write_journal
+
+        if previous:
+            kept = set(c for g in calendars.values() for c in g.calendars)
+            dropped = set(c for g in old_groups.values() for c in g.calendars
+                          if c not in kept)
+            for c in dropped:
+                c.events.close()
+            logging.info("Reloaded %s: %d of %d groups and %d domains "
+                         "unchanged, %d calendars dropped", self.filename,
+                         len([g for g in calendars
+                              if calendars[g] is old_groups.get(g)]),
+                         len(calendars),
+                         len([d for d in domains
+                              if domains[d] is old_domains.get(d)]),
+                         len(dropped))
+
+        self.timeline.report()
+        self.running_domains = domains
+        self.running_groups = calendars
         return calendars
+
+    def changed(self):
+        """
+        Whether our file changed since we read it.
+        """
+        try:
+            return os.path.getmtime(self.filename) != self.mtime
+        except OSError:
+            return False
+
+    def reload(self):
+        """
+        Read our file again and bring what setup() built in line with it.
+        Returns the new set of SyncedCalendars. If the file is invalid, the
+        exception is raised and everything stays as it was.
+        """
+        # Don't retry a broken file until it changes again.
+        self.mtime = os.path.getmtime(self.filename)
+        feed, journal = self.change_feed, self.write_journal
+        new = Config(self.filename)
+        try:
+            groups = new.setup(previous=self)
+        except Exception:
+            # Our groups still use ours.
+            self._close_unused(new.change_feed, new.write_journal)
+            raise
+        self.__dict__.update(new.__dict__)
+        self._close_unused(feed, journal)
+        return groups
+
+    def _close_unused(self, feed, journal):
+        """
+        Close `feed` and `journal` unless we're using them.
+        """
+        if feed is not None and feed is not self.change_feed:
+            feed.close()
+        if journal is not None and journal is not self.write_journal:
+            journal.close()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+"""
+Double bookings of rooms.
+
+A room mirrored across domains can be booked for the same slot on both
+sides between two polls; we then copy both bookings across and the room is
+double-booked everywhere. A ConflictIndex keeps the interval booked by the
+merged version of each of a group's events in an interval tree, updated as
+events are merged, so each change is checked against the bookings it
+overlaps in O(log n) rather than by going through every event.
+
+Conflicts are counted in the `room_conflicts` metric (and the number
+outstanding in the `room_conflicts_open` gauge), logged, and handed to a
+hook if the group names one:
+
+    "conflict_hook": "mypackage.rooms:on_conflict"
+
+which is called with the group's name, the ID of the event that changed
+and the IDs of the events it overlaps.
+
+Free (transparent) events don't book anything. Recurring series are checked
+by their first occurrence only, and their exceptions as events of their
+own.
+"""
+
+import importlib
+import logging
+import random
+
+from .timeutil import event_time
+from .metrics import registry as metrics
+
+RESOURCE_SUFFIX = "@resource.calendar.google.com"
+
+
+class _Node:
+
+    def __init__(self, key, end, priority):
+        # (start, event ID)
+        self.key = key
+        self.end = end
+        # The latest end in this subtree.
+        self.max_end = end
+        self.priority = priority
+        self.left = None
+        self.right = None
+
+
+def _fix(node):
+    node.max_end = node.end
+    if node.left is not None and node.left.max_end > node.max_end:
+        node.max_end = node.left.max_end
+    if node.right is not None and node.right.max_end > node.max_end:
+        node.max_end = node.right.max_end
+
+
+def _split(node, key):
+    """
+    Split the tree at `node` into the keys below `key` and the rest.
+    """
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        _fix(node)
+        return node, right
+    left, node.left = _split(node.left, key)
+    _fix(node)
+    return left, node
+
+
+def _merge(left, right):
+    """
+    Join two trees, every key in `left` being below those in `right`.
+    """
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _fix(left)
+        return left
+    right.left = _merge(left, right.left)
+    _fix(right)
+    return right
+
+
+def _delete(node, key):
+    if node is None:
+        return None
+    if key == node.key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _delete(node.left, key)
+    else:
+        node.right = _delete(node.right, key)
+    _fix(node)
+    return node
+
+
+def _overlapping(node, start, end, found):
+    if node is None or node.max_end <= start:
+        # Everything here is over before `start`.
+        return
+    _overlapping(node.left, start, end, found)
+    if node.key[0] < end:
+        if node.end > start:
+            found.append(node.key[1])
+        _overlapping(node.right, start, end, found)
+
+
+class IntervalIndex:
+    """
+    Intervals by ID, in a treap ordered by start and keeping the latest end
+    of every subtree, so the intervals overlapping a given one can be found
+    without looking at the others.
+    """
+
+    def __init__(self, seed=0):
+        self.root = None
+        self.intervals = {}
+        self.random = random.Random(seed)
+
+    def add(self, id, start, end):
+        self.remove(id)
+        self.intervals[id] = (start, end)
+        key = (start, id)
+        left, right = _split(self.root, key)
+        node = _Node(key, end, self.random.random())
+        self.root = _merge(_merge(left, node), right)
+
+    def remove(self, id):
+        interval = self.intervals.pop(id, None)
+        if interval is not None:
+            self.root = _delete(self.root, (interval[0], id))
+
+    def overlapping(self, start, end):
+        """
+        IDs of the intervals overlapping [start, end), in order of start.
+        """
+        found = []
+        _overlapping(self.root, start, end, found)
+        return found
+
+    def __contains__(self, id):
+        return id in self.intervals
+
+    def __len__(self):
+        return len(self.intervals)
+
+
+def load_hook(name):
+    """
+    The function named by "module:function".
+    """
+    module, _, function = name.partition(":")
+    return getattr(importlib.import_module(module), function)
+
+
+class ConflictIndex:
+    """
+    The bookings of group `name`, and which of them overlap. `hook`, if
+    given, is called with (name, event ID, IDs it overlaps) for every change
+    that makes an event overlap others.
+    """
+
+    def __init__(self, name, hook=None):
+        self.name = name
+        self.hook = hook
+        self.intervals = IntervalIndex()
+        # Event ID -> IDs of the events it overlaps.
+        self.conflicts = {}
+
+    def _interval(self, event):
+        """
+        The interval booked by the merged version of an event, if any.
+        """
+        if event is None or not event.active() or \
+                event.get('transparency') == 'transparent':
+            return None
+        start = event_time(event.get('start'))
+        end = event_time(event.get('end'))
+        if start is None or end is None or end <= start:
+            return None
+        return start, end
+
+    def _clear(self, id):
+        for other in self.conflicts.pop(id, ()):
+            others = self.conflicts.get(other)
+            if others is not None:
+                others.discard(id)
+                if not others:
+                    del self.conflicts[other]
+
+    def update(self, id, event):
+        """
+        Note that event `id` merges to `event` now, None if it's gone.
+        """
+        interval = self._interval(event)
+        if interval is None:
+            if id in self.intervals or id in self.conflicts:
+                self.intervals.remove(id)
+                self._clear(id)
+                metrics.gauge("room_conflicts_open", self.open(),
+                              group=self.name)
+            return
+        if self.intervals.intervals.get(id) == interval:
+            return
+        self.intervals.remove(id)
+        overlapping = set(self.intervals.overlapping(*interval))
+        self.intervals.add(id, *interval)
+        old = self.conflicts.get(id, set())
+        if overlapping == old:
+            return
+        self._clear(id)
+        for other in overlapping:
+            self.conflicts.setdefault(other, set()).add(id)
+        if overlapping:
+            self.conflicts[id] = overlapping
+        metrics.gauge("room_conflicts_open", self.open(), group=self.name)
+        new = overlapping - old
+        if not new:
+            return
+        metrics.incr("room_conflicts", len(new), group=self.name)
+        logging.warn("Double booking in %s: %s overlaps %s", self.name, id,
+                     ", ".join(sorted(new)))
+        if self.hook is not None:
+            try:
+                self.hook(self.name, id, sorted(new))
+            except Exception:
+                logging.exception("Conflict hook for %s failed", self.name)
+
+    def open(self):
+        """
+        The number of overlapping pairs of events.
+        """
+        return sum(len(o) for o in self.conflicts.values()) // 2
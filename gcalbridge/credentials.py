@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+OAuth credentials shared by everything that works on one Domain.
+
+Several threads (seeding workers, say) use the same credentials. When the
+access token expires they'd all find out at once, and each would refresh it
+and write the credentials file. A CredentialManager refreshes the token a
+little before it expires, and lets only one refresh run at a time: whoever
+needs a refresh while one is under way waits for it and uses its token.
+AtomicStorage writes the credentials file atomically, so a crash halfway
+through never leaves it corrupt.
+"""
+
+import datetime
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import httplib2
+import oauth2client.file
+from oauth2client import transport
+
+from .metrics import registry as metrics
+
+# Refresh tokens this many seconds before they expire.
+DEFAULT_REFRESH_MARGIN = 300
+# A 401 this soon after a refresh is taken to be from a request that was
+# sent before it, rather than a reason to refresh again.
+MIN_REFRESH_INTERVAL = 10
+
+
+class AtomicStorage(oauth2client.file.Storage):
+    """
+    oauth2client's file Storage, writing to a temporary file that replaces
+    the credentials file once it's complete.
+    """
+
+    def locked_put(self, credentials):
+        self._validate_file()
+        directory = os.path.dirname(os.path.abspath(self._filename))
+        # mkstemp creates the file readable by us only.
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(credentials.to_json())
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self._filename)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+
+class CredentialManager:
+    """
+    Stands in for oauth2client `credentials` wherever those are used to
+    authorize requests, refreshing them proactively and one at a time.
+    """
+
+    def __init__(self, name, credentials, margin=DEFAULT_REFRESH_MARGIN,
+                 clock=time.time, utcnow=datetime.datetime.utcnow):
+        self.name = name
+        self.credentials = credentials
+        self.margin = margin
+        self.clock = clock
+        self.utcnow = utcnow
+        self.lock = threading.Lock()
+        # The token each thread last sent.
+        self.local = threading.local()
+        self.refreshed = None
+        self.refreshes = 0
+
+    @property
+    def access_token(self):
+        return self.credentials.access_token
+
+    @property
+    def user_agent(self):
+        return getattr(self.credentials, 'user_agent', None)
+
+    def expiring(self):
+        """
+        Whether the access token expires within our margin.
+        """
+        expiry = getattr(self.credentials, 'token_expiry', None)
+        if expiry is None:
+            return False
+        return expiry - self.utcnow() < datetime.timedelta(
+            seconds=self.margin)
+
+    def _do_refresh(self, http_request):
+        logging.info("Refreshing access token for %s", self.name)
+        self.credentials._refresh(http_request or httplib2.Http().request)
+        self.refreshed = self.clock()
+        self.refreshes += 1
+        metrics.incr("token_refreshes", domain=self.name)
+
+    def fresh(self, http_request=None):
+        """
+        Refresh the token if it's about to expire, unless another thread
+        does so first.
+        """
+        if not self.expiring():
+            return
+        with self.lock:
+            if self.expiring():
+                self._do_refresh(http_request)
+
+    def apply(self, headers):
+        self.fresh()
+        token = self.credentials.access_token
+        self.local.sent = token
+        headers['Authorization'] = 'Bearer ' + token
+
+    def _refresh(self, http_request):
+        """
+        Refresh the token after it was refused, unless it's been refreshed
+        since this thread sent it.
+        """
+        sent = getattr(self.local, 'sent', None)
+        with self.lock:
+            current = self.credentials.access_token
+            if current and not self.expiring():
+                if sent is not None and sent != current:
+                    metrics.incr("token_refreshes_shared", domain=self.name)
+                    return
+                if sent is None and self.refreshed is not None and \
+                        self.clock() - self.refreshed < MIN_REFRESH_INTERVAL:
+                    metrics.incr("token_refreshes_shared", domain=self.name)
+                    return
+            self._do_refresh(http_request)
+
+    def refresh(self, http):
+        self._refresh(http.request)
+
+    def authorize(self, http):
+        """
+        Make `http` send our token with every request, like
+        credentials.authorize does.
+        """
+        transport.wrap_http_for_auth(self, http)
+        return http
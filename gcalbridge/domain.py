@@ -5,10 +5,22 @@ import apiclient.discovery
 import oauth2client
 import json
 import os
+import threading
 
 import logging
 
 from errors import BadConfigError
+from .batch import BatchCoordinator, BatchSizeController
+from .recovery import RecoveryThrottle
+from .breaker import CircuitBreaker
+from .quota import QuotaAccountant
+from .credentials import AtomicStorage, CredentialManager, \
+    DEFAULT_REFRESH_MARGIN
+
+# Discovery documents by API root, fetched once for every Domain's services.
+# apiclient's own discovery cache isn't safe to use from several threads.
+discovery_documents = {}
+discovery_lock = threading.Lock()
 
 
 class Domain:
@@ -18,25 +30,57 @@ class Domain:
     """
 
     def __init__(self, domain, domain_config, authorize=True, code=None,
-        http=None):
+        http=None, project_quota=None):
         self.domain = domain
         self.domain_config = domain_config
         self.http = http
         self.calendar_metadata = None
+        self.credentials = None
+        self.batcher = BatchCoordinator(
+            domain, BatchSizeController.from_config(domain, domain_config))
+        self.recoveries = RecoveryThrottle.from_config(domain, domain_config)
+        self.breaker = CircuitBreaker.from_config(domain, domain_config)
+        # Counts against our own quota and our project's.
+        self.quota = QuotaAccountant.from_config(domain, domain_config,
+                                                 parent=project_quota)
+        self.batcher.quota = self.quota
 
         if not "account" in domain_config:
             raise BadConfigError("Domain %s doesn't have 'account' value set!")
 
         self.account = self.domain_config['account']
+        self.api_root = self.domain_config.get('api_root')
 
         if authorize:
+            self.authorize(code=code)
+
+    def authorize(self, code=None):
+        """
+        Load our credentials, or obtain them interactively if we have none
+        yet (see `needs_code`).
+        """
+        if self.api_root:
+            # A stand-in API (see fakeapi.py) just wants to know who we are.
+            credentials = oauth2client.client.AccessTokenCredentials(
+                "fake:" + self.account, "gcal-bridge")
+        else:
             try:
-                self.credentials = self.obtain_credentials(code=code)
+                credentials = self.obtain_credentials(code=code)
             except Exception as e:
                 logging.critical(
                     "Failed to obtain credentials for account %s [%s]", self.
                     account, repr(e))
                 raise e
+        # Shared by all our services and threads; see credentials.py.
+        self.credentials = credentials and CredentialManager(
+            self.domain, credentials, margin=self.domain_config.get(
+                'token_refresh_margin', DEFAULT_REFRESH_MARGIN))
+
+    def needs_code(self):
+        """
+        Whether authorizing will prompt for an authorization code.
+        """
+        return not self.api_root and not os.path.isfile(self.get_file_path())
 
     def get_file_path(self):
         if 'credfile' in self.domain_config:
@@ -65,9 +109,8 @@ class Domain:
             logging.info("%s exists, attempting to retrieve credentials", self
                 .get_file_path())
             try:
-                credentials = (oauth2client.file.Storage(self.get_file_path()).
-                    get())
-                return self.check_credentials(credentials)
+                # Not checked until they're first used, by get_calendars.
+                return AtomicStorage(self.get_file_path()).get()
             except Exception as e:
                 logging.error(repr(e))
                 raise e
@@ -87,8 +130,10 @@ class Domain:
             try:
                 credentials = flow.step2_exchange(code)
                 if self.check_credentials(credentials):
-                    oauth2client.file.Storage(self.get_file_path()).put(
-                        credentials)
+                    storage = AtomicStorage(self.get_file_path())
+                    storage.put(credentials)
+                    # So that refreshed tokens are saved too.
+                    credentials.set_store(storage)
                     return credentials
             except Exception as e:
                 logging.error(repr(e))
@@ -96,17 +141,40 @@ class Domain:
             return None
 
     def get_service(self, credentials=None):
+        kwargs = {}
+        if self.api_root:
+            kwargs['discoveryServiceUrl'] = (self.api_root.rstrip("/") +
+                "/discovery/v1/apis/{api}/{apiVersion}/rest")
         if self.http:
             # For testing purposes.
-            return apiclient.discovery.build('calendar', 'v3', http=self.http)
+            kwargs['http'] = self.http
         else:
-            if not credentials:
-                credentials = self.credentials
-            return apiclient.discovery.build('calendar', 'v3',
-                credentials=credentials)
+            kwargs['credentials'] = credentials or self.credentials
+        with discovery_lock:
+            if self.api_root not in discovery_documents:
+                service = apiclient.discovery.build('calendar', 'v3',
+                    **kwargs)
+                discovery_documents[self.api_root] = service._rootDesc
+                return service
+        kwargs.pop('discoveryServiceUrl', None)
+        return apiclient.discovery.build_from_document(
+            discovery_documents[self.api_root], **kwargs)
 
     def get_calendars(self):
         if self.calendar_metadata is None:
+            self.quota.spend(1, "list")
             self.calendar_metadata = (self.get_service().calendarList().list().
                 execute())
         return self.calendar_metadata
+
+    def available(self):
+        """
+        Whether our calendars may be synced, according to our circuit
+        breaker. If it's half-open, a cheap request probes whether we've
+        recovered.
+        """
+        def request():
+            self.quota.spend(1, "probe")
+            return self.get_service().calendarList().list(maxResults=1).\
+                execute()
+        return self.breaker.probe(request)
@@ -6,3 +6,7 @@
 
 class BadConfigError(RuntimeError):
     pass
+
+
+class ReplayError(RuntimeError):
+    pass
@@ -0,0 +1,564 @@
+#!/usr/bin/env python
+
+"""
+A local stand-in for the parts of the Google Calendar v3 API the bridge uses:
+calendarList, events list/get/insert/import/update/patch/watch with sync
+tokens, and batch requests. It can inject per-user quota errors, latency, sync
+token expiry (410) and server errors, so the whole daemon can be soak-tested
+on a laptop.
+
+    python -m gcalbridge.fakeapi --config config.json --port 8080 \\
+        --latency 0.05 --error-rate 0.01 --quota 1000 --events 50
+
+Point a domain at it by adding `"api_root": "http://localhost:8080/"` to the
+domain's config (or at the top level of config.json for every domain).
+
+FakeCalendarAPI holds the model and can also be used in-process through
+FakeHttp, without any sockets.
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import logging
+import random
+import re
+import string
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from collections import defaultdict, deque
+from email.parser import Parser
+from urllib import unquote
+from urlparse import urlparse, parse_qs
+
+import httplib2
+
+DISCOVERY_URI = ("https://www.googleapis.com/discovery/v1/apis/calendar/v3/"
+                 "rest")
+DISCOVERY_PATH = "/discovery/v1/apis/calendar/v3/rest"
+SERVICE_PATH = "/calendar/v3"
+BATCH_PATHS = ["/batch", "/batch/calendar/v3"]
+DEFAULT_PAGE_SIZE = 250
+MAX_PAGE_SIZE = 2500
+QUOTA_WINDOW = 100.0
+ID_CHARS = "abcdefghijklmnopqrstuv0123456789"
+ITEMS_FIELDS_RE = re.compile(r"items\(([^)]*)\)")
+
+STATUS_REASONS = {
+    200: "OK", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+    403: "Forbidden", 404: "Not Found", 409: "Conflict", 410: "Gone",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+def load_discovery(path=None):
+    """
+    The Calendar v3 discovery document, from `path`, apiclient's discovery
+    cache, or Google.
+    """
+    if path:
+        with open(path) as f:
+            return f.read()
+    from googleapiclient import discovery_cache
+    cache = discovery_cache.autodetect()
+    if cache:
+        content = cache.get(DISCOVERY_URI)
+        if content:
+            return content
+    resp, content = httplib2.Http().request(DISCOVERY_URI)
+    if resp.status != 200:
+        raise RuntimeError("Couldn't fetch discovery document: %s" %
+                           resp.status)
+    return content
+
+
+def error_body(code, reason, message):
+    return {"error": {"errors": [{"domain": "global", "reason": reason,
+                                  "message": message}],
+                      "code": code, "message": message}}
+
+
+class APIError(Exception):
+    def __init__(self, code, reason, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.body = error_body(code, reason, message)
+
+
+def project(items, fields):
+    """
+    Apply the `items(...)` part of a `fields` parameter to a list of
+    resources.
+    """
+    m = ITEMS_FIELDS_RE.search(fields or "")
+    if not m:
+        return items
+    keep = set(f.strip() for f in m.group(1).split(","))
+    return [dict((k, v) for k, v in item.iteritems() if k in keep)
+            for item in items]
+
+
+class FakeCalendar:
+    """
+    One calendar in the model. Every change bumps `version`; events remember
+    the version that last changed them, which is what sync tokens refer to.
+    """
+
+    def __init__(self, id, owner, summary=None, access_role="owner",
+                 time_zone="UTC"):
+        self.id = id
+        self.owner = owner
+        self.summary = summary or id
+        self.access_role = access_role
+        self.time_zone = time_zone
+        self.events = {}
+        self.versions = {}
+        self.version = 0
+
+    def store(self, event):
+        self.version += 1
+        self.events[event['id']] = event
+        self.versions[event['id']] = self.version
+
+    def list_entry(self):
+        return {"kind": "calendar#calendarListEntry", "id": self.id,
+                "summary": self.summary, "accessRole": self.access_role,
+                "timeZone": self.time_zone}
+
+
+class FakeCalendarAPI:
+    """
+    The in-memory model, and the logic that serves API requests against it.
+    """
+
+    def __init__(self, latency=0, error_rate=0, quota=None, token_ttl=None,
+                 expire_rate=0, strict_sequence=True, seed=None,
+                 clock=time.time, sleep=time.sleep, discovery=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota = quota
+        self.token_ttl = token_ttl
+        self.expire_rate = expire_rate
+        self.strict_sequence = strict_sequence
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.sleep = sleep
+        self.discovery = discovery
+        self.calendars = {}
+        self.usage = defaultdict(deque)
+        self.requests = defaultdict(int)
+        self.lock = threading.RLock()
+        self._last_updated = 0
+
+    # Model
+
+    def add_calendar(self, id, owner, **kwargs):
+        with self.lock:
+            self.calendars[id] = FakeCalendar(id, owner, **kwargs)
+            return self.calendars[id]
+
+    def new_id(self):
+        return "".join(self.random.choice(ID_CHARS) for i in range(26))
+
+    def timestamp(self):
+        """
+        An RFC 3339 `updated` timestamp, strictly increasing so that later
+        changes always compare newer.
+        """
+        now = max(int(self.clock() * 1000), self._last_updated + 1)
+        self._last_updated = now
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now / 1000)) + \
+            ".%03dZ" % (now % 1000)
+
+    def random_event(self, days=30):
+        start = int(self.clock()) + self.random.randint(1, days * 24) * 3600
+        return {
+            "summary": "Meeting %s" % "".join(
+                self.random.choice(string.ascii_lowercase) for i in range(6)),
+            "start": {"dateTime": time.strftime(
+                "%Y-%m-%dT%H:00:00Z", time.gmtime(start))},
+            "end": {"dateTime": time.strftime(
+                "%Y-%m-%dT%H:00:00Z", time.gmtime(start + 3600))},
+        }
+
+    def _calendar(self, user, id):
+        cal = self.calendars.get(id)
+        if cal is None or (user is not None and cal.owner != user):
+            raise APIError(404, "notFound", "Not Found")
+        return cal
+
+    def _event(self, cal, id):
+        if id not in cal.events:
+            # Instances of a recurring event exist as soon as their series
+            # does, as `<master id>_<start>`.
+            master = cal.events.get(id.rpartition("_")[0])
+            if master and master.get('recurrence') and \
+                    master['status'] != 'cancelled':
+                return {"id": id, "recurringEventId": master['id'],
+                        "status": "confirmed",
+                        "sequence": master['sequence'],
+                        "iCalUID": master['iCalUID'],
+                        "created": master['created']}
+            raise APIError(404, "notFound", "Not Found")
+        return cal.events[id]
+
+    def _finish(self, cal, event, previous=None):
+        event['kind'] = "calendar#event"
+        event['updated'] = self.timestamp()
+        event['etag'] = '"%d"' % self._last_updated
+        event.setdefault('status', 'confirmed')
+        event.setdefault('sequence', 0)
+        event.setdefault('iCalUID', event['id'] + "@google.com")
+        if previous is not None:
+            event['created'] = previous.get('created', event['updated'])
+        else:
+            event.setdefault('created', event['updated'])
+        cal.store(event)
+        return event
+
+    def _sync_token(self, cal):
+        raw = "%d:%f" % (cal.version, self.clock())
+        return base64.urlsafe_b64encode(raw)
+
+    def _check_sync_token(self, token):
+        try:
+            version, issued = base64.urlsafe_b64decode(
+                token.encode('ascii')).split(":")
+            version, issued = int(version), float(issued)
+        except (ValueError, TypeError):
+            raise APIError(400, "invalid", "Invalid sync token value.")
+        expired = self.token_ttl is not None and \
+            self.clock() - issued > self.token_ttl
+        if expired or (self.expire_rate and
+                       self.random.random() < self.expire_rate):
+            raise APIError(410, "fullSyncRequired",
+                           "Sync token is no longer valid, a full sync is "
+                           "required.")
+        return version
+
+    # Operations
+
+    def calendar_list(self, user, params):
+        items = [c.list_entry() for c in sorted(self.calendars.values(),
+                                                key=lambda c: c.id)
+                 if user is None or c.owner == user]
+        return {"kind": "calendar#calendarList", "items": items}
+
+    def list_events(self, cal, params):
+        since = -1
+        if params.get('syncToken'):
+            since = self._check_sync_token(params['syncToken'])
+        offset = 0
+        if params.get('pageToken'):
+            offset, since = [int(x) for x in base64.urlsafe_b64decode(
+                params['pageToken'].encode('ascii')).split(":")]
+        show_deleted = params.get('showDeleted') == 'true' or since >= 0
+        size = min(int(params.get('maxResults', DEFAULT_PAGE_SIZE)),
+                   MAX_PAGE_SIZE)
+        ids = sorted(i for i, v in cal.versions.iteritems() if v > since)
+        items = [cal.events[i] for i in ids
+                 if show_deleted or cal.events[i]['status'] != 'cancelled']
+        result = {"kind": "calendar#events", "summary": cal.summary,
+                  "items": project(items[offset:offset + size],
+                                   params.get('fields'))}
+        if offset + size < len(items):
+            result['nextPageToken'] = base64.urlsafe_b64encode(
+                "%d:%d" % (offset + size, since))
+        else:
+            result['nextSyncToken'] = self._sync_token(cal)
+        return result
+
+    def insert_event(self, cal, body, params):
+        event = dict(body)
+        event.setdefault('id', self.new_id())
+        if event['id'] in cal.events:
+            raise APIError(409, "duplicate", "The requested identifier "
+                           "already exists.")
+        return self._finish(cal, event)
+
+    def import_event(self, cal, body, params):
+        if not body.get('iCalUID'):
+            raise APIError(400, "required", "Missing iCalUID.")
+        event = dict(body)
+        event.setdefault('id', self.new_id())
+        return self._finish(cal, event, previous=cal.events.get(event['id']))
+
+    def update_event(self, cal, id, body, params):
+        old = self._event(cal, id)
+        if self.strict_sequence and \
+                body.get('sequence', old['sequence']) < old['sequence']:
+            raise APIError(400, "invalid", "Invalid sequence value. The "
+                           "specified sequence number is below the current "
+                           "sequence number of the resource.")
+        event = dict(body)
+        event['id'] = id
+        event.setdefault('sequence', old['sequence'])
+        return self._finish(cal, event, previous=old)
+
+    def patch_event(self, cal, id, body, params):
+        event = dict(self._event(cal, id))
+        event.update(body)
+        return self.update_event(cal, id, event, params)
+
+    def watch_events(self, cal, body, params):
+        return {"kind": "api#channel", "id": body.get('id', self.new_id()),
+                "resourceId": self.new_id(), "resourceUri": cal.id,
+                "expiration": str(int((self.clock() + 3600) * 1000))}
+
+    # Request handling
+
+    def _consume_quota(self, user):
+        if not self.quota:
+            return
+        now = self.clock()
+        usage = self.usage[user]
+        while usage and usage[0] <= now - QUOTA_WINDOW:
+            usage.popleft()
+        if len(usage) >= self.quota:
+            raise APIError(403, "userRateLimitExceeded",
+                           "User Rate Limit Exceeded")
+        usage.append(now)
+
+    def _route(self, user, method, path, params, body):
+        if path == SERVICE_PATH + "/users/me/calendarList" and method == "GET":
+            return self.calendar_list(user, params)
+        parts = path[len(SERVICE_PATH) + 1:].split("/") \
+            if path.startswith(SERVICE_PATH + "/") else []
+        if len(parts) < 3 or parts[0] != "calendars" or parts[2] != "events":
+            raise APIError(404, "notFound", "Not Found")
+        cal = self._calendar(user, unquote(parts[1]))
+        rest = parts[3:]
+        if not rest:
+            if method == "GET":
+                return self.list_events(cal, params)
+            if method == "POST":
+                return self.insert_event(cal, body, params)
+        elif rest == ["import"] and method == "POST":
+            return self.import_event(cal, body, params)
+        elif rest == ["watch"] and method == "POST":
+            return self.watch_events(cal, body, params)
+        elif len(rest) == 1:
+            id = unquote(rest[0])
+            if method == "GET":
+                return self._event(cal, id)
+            if method == "PUT":
+                return self.update_event(cal, id, body, params)
+            if method == "PATCH":
+                return self.patch_event(cal, id, body, params)
+        raise APIError(404, "notFound", "Not Found")
+
+    def call(self, user, method, path, params, body):
+        """
+        Serve one (non-batch) API request. Returns (status, response dict).
+        """
+        try:
+            with self.lock:
+                self.requests[user] += 1
+                self._consume_quota(user)
+                if self.error_rate and self.random.random() < self.error_rate:
+                    raise APIError(503, "backendError", "Backend Error")
+                if body:
+                    try:
+                        body = json.loads(body)
+                    except ValueError:
+                        raise APIError(400, "parseError", "Parse Error")
+                return 200, self._route(user, method, path, params, body)
+        except APIError as e:
+            return e.code, e.body
+
+    def batch(self, user, body, content_type):
+        """
+        Serve a multipart batch request. Returns (status, content type,
+        content).
+        """
+        message = Parser().parsestr("Content-Type: %s\r\n\r\n%s" % (
+            content_type, body))
+        if not message.is_multipart():
+            return 400, "application/json", json.dumps(error_body(
+                400, "badRequest", "Batch request is not multipart"))
+        boundary = "batch_" + self.new_id()
+        parts = []
+        for part in message.get_payload():
+            request = part.get_payload().replace("\r\n", "\n")
+            request_line, _, rest = request.partition("\n")
+            headers, _, sub_body = rest.partition("\n\n")
+            method, uri = request_line.split(" ")[:2]
+            parsed = urlparse(uri)
+            params = dict((k, v[-1]) for k, v in
+                          parse_qs(parsed.query).iteritems())
+            status, result = self.call(user, method, parsed.path, params,
+                                       sub_body.strip())
+            cid = part['Content-ID'] or "<%d>" % len(parts)
+            parts.append(
+                "--%s\r\nContent-Type: application/http\r\n"
+                "Content-ID: <response-%s>\r\n\r\n"
+                "HTTP/1.1 %d %s\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                "%s\r\n" % (boundary, cid.strip("<>"), status,
+                            STATUS_REASONS.get(status, ""),
+                            json.dumps(result)))
+        content = "".join(parts) + "--%s--\r\n" % boundary
+        return 200, "multipart/mixed; boundary=%s" % boundary, content
+
+    def handle(self, method, uri, headers, body, root=None):
+        """
+        Serve any request. `headers` are matched case-insensitively; the
+        bearer token (minus any `fake:` prefix) identifies the user for
+        quota accounting. Returns (status, content type, content).
+        """
+        if self.latency:
+            self.sleep(self.latency)
+        headers = dict((k.lower(), v) for k, v in (headers or {}).items())
+        parsed = urlparse(uri)
+        if parsed.path == DISCOVERY_PATH and method == "GET":
+            doc = json.loads(self.discovery or load_discovery())
+            doc['rootUrl'] = root or "%s://%s/" % (parsed.scheme,
+                                                   parsed.netloc)
+            doc['batchPath'] = "batch"
+            return 200, "application/json", json.dumps(doc)
+        user = None
+        auth = headers.get('authorization', '')
+        if auth.startswith("Bearer "):
+            user = auth[len("Bearer "):]
+            if user.startswith("fake:"):
+                user = user[len("fake:"):]
+        if parsed.path in BATCH_PATHS and method == "POST":
+            return self.batch(user, body, headers.get('content-type', ''))
+        params = dict((k, v[-1]) for k, v in parse_qs(parsed.query).iteritems())
+        status, result = self.call(user, method, parsed.path, params, body)
+        return status, "application/json; charset=UTF-8", json.dumps(result)
+
+    def seed(self, config, events=0):
+        """
+        Create the calendars named in a gcalbridge config, each owned by
+        its domain's account and holding `events` random events.
+        """
+        for group, group_config in config.calendars.iteritems():
+            for c in group_config['calendars']:
+                owner = config.domains[c['domain']]['account']
+                cal = self.add_calendar(c['url'], owner, summary=group)
+                for i in range(events):
+                    event = self.random_event()
+                    event['id'] = self.new_id()
+                    self._finish(cal, event)
+
+
+class FakeHttp:
+    """
+    An httplib2.Http-like object that serves requests from a
+    FakeCalendarAPI in-process. Requests are made as `user`.
+    """
+
+    def __init__(self, api, user=None, root="http://fakeapi/"):
+        self.api = api
+        self.user = user
+        self.root = root
+
+    def request(self, uri, method="GET", body=None, headers=None, *args,
+                **kwargs):
+        headers = dict(headers or {})
+        if self.user is not None:
+            headers['authorization'] = "Bearer fake:%s" % self.user
+        status, content_type, content = self.api.handle(method, uri, headers,
+                                                        body, root=self.root)
+        resp = httplib2.Response({"status": status,
+                                  "content-type": content_type})
+        return resp, content
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _serve(self):
+        length = int(self.headers.get('content-length', 0) or 0)
+        body = self.rfile.read(length) if length else None
+        status, content_type, content = self.server.api.handle(
+            self.command, self.path, dict(self.headers.items()), body,
+            root="http://%s/" % self.headers.get(
+                'host', "%s:%d" % self.server.server_address))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _serve
+
+    def log_message(self, format, *args):
+        logging.debug("fakeapi: " + format, *args)
+
+
+class FakeAPIServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves a FakeCalendarAPI over HTTP.
+    """
+    daemon_threads = True
+
+    def __init__(self, api, address=("127.0.0.1", 8080)):
+        HTTPServer.__init__(self, address, FakeAPIHandler)
+        self.api = api
+
+    def start(self):
+        """
+        Serve from a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    @property
+    def root(self):
+        return "http://%s:%d/" % self.server_address
+
+
+def main(argv=None):
+    from .config import Config
+
+    parser = argparse.ArgumentParser(
+        description="Serve a fake Google Calendar API for load testing.")
+    parser.add_argument("--config", help="Create the calendars in this "
+                        "gcalbridge config file.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--events", type=int, default=0,
+                        help="Random events to create in each calendar.")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Seconds added to every request.")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Fraction of requests failing with a 503.")
+    parser.add_argument("--quota", type=int, default=None,
+                        help="Requests allowed per user per 100 seconds.")
+    parser.add_argument("--token-ttl", type=float, default=None,
+                        help="Seconds before a sync token expires (410).")
+    parser.add_argument("--expire-rate", type=float, default=0,
+                        help="Fraction of sync tokens expiring early.")
+    parser.add_argument("--discovery", help="Calendar v3 discovery document "
+                        "to serve (fetched from Google by default).")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    api = FakeCalendarAPI(latency=args.latency, error_rate=args.error_rate,
+                          quota=args.quota, token_ttl=args.token_ttl,
+                          expire_rate=args.expire_rate, seed=args.seed,
+                          discovery=load_discovery(args.discovery))
+    if args.config:
+        api.seed(Config(args.config), events=args.events)
+    server = FakeAPIServer(api, (args.host, args.port))
+    logging.info("Serving %d calendars at %s", len(api.calendars),
+                 server.root)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
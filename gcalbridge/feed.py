@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+A feed of merged event changes, for whoever else wants to know.
+
+Room displays and occupancy analytics would otherwise poll Google for the
+same events we already fetch. With a feed configured, every change a group
+merges is written as one line of JSON to a file, a named pipe or a Unix
+socket:
+
+    "feed": {"path": "unix:/var/run/gcal-bridge.sock", "buffer": 1000,
+             "on_full": "block"}
+
+Records are handed to a writer thread through a bounded buffer. When the
+buffer is full (the reader can't keep up, or isn't there), syncing waits
+for room for up to `block_timeout` seconds before dropping the record, or
+drops it right away with "on_full": "drop". A sink that still fails after
+a few attempts is given up on for the records in hand, and until it works
+again the feed drops rather than waits. Dropped records are counted in the
+`feed_dropped` metric.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from Queue import Queue, Full, Empty
+
+from .metrics import registry as metrics
+
+DEFAULT_FEED_BUFFER = 1000
+DEFAULT_BLOCK_TIMEOUT = 5
+# How long to wait before reopening a sink that failed.
+RETRY_INTERVAL = 1
+# Attempts at writing records before they're dropped.
+WRITE_ATTEMPTS = 3
+# How long close() waits for the writer to finish.
+CLOSE_TIMEOUT = 5
+# Events whose last record we remember, to skip repeats.
+DEFAULT_SENT_SIZE = 100000
+UNIX_PREFIX = "unix:"
+BLOCK = "block"
+DROP = "drop"
+
+# Event fields included in records, when present.
+RECORD_FIELDS = ["status", "start", "end", "summary", "location",
+                 "recurringEventId", "updated", "sequence"]
+
+
+def record(group, event, source=None, now=None):
+    """
+    The feed record for `event`, as merged by `group` from `source`.
+    """
+    r = {"time": now or time.time(), "group": group, "id": event['id']}
+    for f in RECORD_FIELDS:
+        if event.get(f) is not None:
+            r[f] = event[f]
+    if source is not None:
+        r["source"] = source
+    return r
+
+
+class ChangeFeed:
+    """
+    Writes records to `path` (a file or named pipe, or "unix:" followed by
+    the path of a socket) from a background thread.
+    """
+
+    def __init__(self, path, buffer=DEFAULT_FEED_BUFFER, on_full=BLOCK,
+                 block_timeout=DEFAULT_BLOCK_TIMEOUT):
+        self.path = path
+        self.on_full = on_full
+        self.block_timeout = block_timeout
+        self.queue = Queue(buffer)
+        self.sink = None
+        self.sleep = time.sleep
+        # What we last sent for the most recent (group, ID)s, to skip
+        # repeats.
+        self.sent = OrderedDict()
+        self.sent_size = DEFAULT_SENT_SIZE
+        self.emitted = 0
+        self.dropped = 0
+        # Set while the sink is failing.
+        self.down = False
+        self.closing = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a feed from the top-level "feed" setting; None if there isn't
+        one.
+        """
+        if not config:
+            return None
+        return cls(config['path'],
+                   buffer=config.get('buffer', DEFAULT_FEED_BUFFER),
+                   on_full=config.get('on_full', BLOCK),
+                   block_timeout=config.get('block_timeout',
+                                            DEFAULT_BLOCK_TIMEOUT))
+
+    def emit(self, group, event, source=None):
+        """
+        Queue a record of `event`, unless it's what we last sent for it.
+        Returns whether a record was queued.
+        """
+        key = (group, event['id'])
+        fingerprint = (event.ehash(), event.get('status'))
+        if self.sent.get(key) == fingerprint:
+            return False
+        line = json.dumps(record(group, event, source),
+                          separators=(",", ":"), sort_keys=True) + "\n"
+        try:
+            if self.on_full == DROP or self.down:
+                self.queue.put_nowait(line)
+            else:
+                self.queue.put(line, timeout=self.block_timeout)
+        except Full:
+            self.dropped += 1
+            metrics.incr("feed_dropped")
+            return False
+        self.sent.pop(key, None)
+        self.sent[key] = fingerprint
+        if len(self.sent) > self.sent_size:
+            self.sent.popitem(last=False)
+        self.emitted += 1
+        metrics.incr("feed_records")
+        metrics.gauge("feed_buffered", self.queue.qsize())
+        return True
+
+    def _open(self):
+        if self.path.startswith(UNIX_PREFIX):
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                s.connect(self.path[len(UNIX_PREFIX):])
+            except Exception:
+                s.close()
+                raise
+            return s.makefile("w")
+        # Without O_NONBLOCK, opening a named pipe blocks until there's a
+        # reader; with it, we get ENXIO instead.
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT |
+                     os.O_NONBLOCK, 0o644)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+        return os.fdopen(fd, "a")
+
+    def _close(self):
+        if self.sink is not None:
+            try:
+                self.sink.close()
+            except (IOError, OSError, socket.error):
+                pass
+            self.sink = None
+
+    def _write(self, lines):
+        # Once down, one attempt per batch until the sink is back.
+        attempts = 1 if self.down else WRITE_ATTEMPTS
+        for i in range(attempts):
+            try:
+                if self.sink is None:
+                    self.sink = self._open()
+                self.sink.write("".join(lines))
+                self.sink.flush()
+                if self.down:
+                    logging.info("Change feed %s is back", self.path)
+                    self.down = False
+                return
+            except (IOError, OSError, socket.error) as e:
+                if not self.down:
+                    logging.warn("Change feed %s failed: %r", self.path, e)
+                self._close()
+                if self.closing:
+                    break
+                self.sleep(RETRY_INTERVAL)
+        self.down = True
+        self.dropped += len(lines)
+        metrics.incr("feed_dropped", len(lines))
+
+    def run(self):
+        while True:
+            try:
+                lines = [self.queue.get(timeout=RETRY_INTERVAL)]
+            except Empty:
+                if self.closing:
+                    break
+                continue
+            # Write whatever else is waiting along with it.
+            try:
+                while lines[-1] is not None:
+                    lines.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            done = lines[-1] is None
+            lines = [l for l in lines if l is not None]
+            if lines:
+                self._write(lines)
+            for i in range(len(lines) + done):
+                self.queue.task_done()
+            if done:
+                break
+        self._close()
+
+    def flush(self):
+        """
+        Wait until everything queued has been written.
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+        Write what's queued and stop, waiting no longer than CLOSE_TIMEOUT
+        seconds.
+        """
+        self.closing = True
+        try:
+            self.queue.put_nowait(None)
+        except Full:
+            # The writer stops once it's done with the queue.
+            pass
+        self.thread.join(CLOSE_TIMEOUT)
+        if self.thread.is_alive():
+            logging.warn("Change feed %s didn't finish writing", self.path)
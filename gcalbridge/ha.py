@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+
+"""
+Active/standby operation.
+
+Several bridge processes can share a lease file; whichever holds an
+exclusive lock on it is active and syncs, the others wait on standby. The
+active process checkpoints every group after each sync: its calendars' sync
+tokens and events, in a snapshot per group and a log of what changed since
+(see Checkpointer). A standby has already authenticated and built its
+services, and keeps loading the latest checkpoints while it waits, so when
+the active process dies (and the operating system releases its lock) the
+standby carries on from the last converged state instead of listing
+everything again, and doesn't repeat writes that were already made.
+
+Configure it in config.json:
+
+    "ha": {
+        "lease": "/var/run/gcal-bridge.lease",
+        "checkpoint_dir": "/var/lib/gcal-bridge",
+        "standby_poll": 5
+    }
+"""
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import time
+
+CHECKPOINT_VERSION = 1
+DEFAULT_LEASE = "gcal-bridge.lease"
+DEFAULT_CHECKPOINT_DIR = "checkpoints"
+DEFAULT_STANDBY_POLL = 5
+
+
+class Lease:
+    """
+    An exclusive lock on a file, held for as long as we live.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def acquire(self):
+        """
+        Try to take the lease without waiting. Returns whether we hold it.
+        """
+        if self.f is not None:
+            return True
+        f = open(self.path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            f.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps({"pid": os.getpid(), "host": socket.gethostname(),
+                            "since": time.time()}))
+        f.flush()
+        self.f = f
+        return True
+
+    def holder(self):
+        """
+        Who holds the lease, as they recorded it.
+        """
+        try:
+            with open(self.path) as f:
+                return json.loads(f.read() or "null")
+        except (IOError, ValueError):
+            return None
+
+    def release(self):
+        if self.f is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+            self.f.close()
+            self.f = None
+
+
+def checkpoint_name(group):
+    return re.sub(r"[^\w.-]", "_", group) + ".json"
+
+
+def log_name(group, seq):
+    return "%s.%d.log" % (checkpoint_name(group), seq)
+
+
+class Checkpointer:
+    """
+    Saves and loads the state of SyncedCalendars.
+
+    Each group has a snapshot, written atomically, and a log of what changed
+    since, one JSON object a line. A save appends the events stored and
+    discarded since the last one, and the sync tokens if they moved, so it
+    costs what changed rather than every event of the group; once the log
+    has grown as big as the snapshot, the next save writes a new snapshot
+    and starts a new log.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        # Group name -> what we last saved.
+        self.saved = {}
+        # Group name -> (snapshot file, its seq, log offset) loaded.
+        self.loaded = {}
+        self.seq = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, group):
+        return os.path.join(self.directory, checkpoint_name(group.name))
+
+    def log_path(self, group, seq=None):
+        if seq is None:
+            seq = self.saved[group.name]["seq"]
+        return os.path.join(self.directory, log_name(group.name, seq))
+
+    def _state(self, cal, cycle):
+        """
+        `cal`'s events stored and discarded since `cycle` (all of them if
+        None), and the cycle to look from next time.
+        """
+        state = {"sync_token": cal.sync_token}
+        if hasattr(cal.events, 'flush'):
+            # Events on disk are already there for whoever comes next.
+            cal.events.flush()
+            return state, None
+        if cycle is None:
+            state["events"] = dict((k, dict(v)) for k, v in
+                                   cal.events.iteritems())
+        else:
+            changed = cal.events.changed_since(cycle)
+            if changed:
+                state["events"] = dict((k, dict(cal.events[k]))
+                                       for k in changed)
+            discarded = cal.events.discarded_since(cycle)
+            if discarded:
+                state["discarded"] = sorted(discarded)
+        # Anything stored or discarded from now on goes in the next save.
+        cycle = cal.events.new_cycle()
+        cal.events.keep_discarded(cycle)
+        return state, cycle
+
+    def save(self, group):
+        """
+        Write what changed in `group` since the last save.
+        """
+        saved = self.saved.get(group.name)
+        urls = set(cal.url for cal in group.calendars)
+        if saved is None or saved["logged"] >= saved["size"] or \
+                set(saved["cycles"]) != urls:
+            self._snapshot(group)
+            return
+        calendars = {}
+        logged = 0
+        for cal in group.calendars:
+            state, saved["cycles"][cal.url] = self._state(
+                cal, saved["cycles"][cal.url])
+            if state["sync_token"] == saved["tokens"][cal.url]:
+                del state["sync_token"]
+            if state:
+                calendars[cal.url] = state
+                logged += 1 + len(state.get("events", ())) + \
+                    len(state.get("discarded", ()))
+            saved["tokens"][cal.url] = cal.sync_token
+        deferred, postponed = sorted(group.deferred), sorted(group.postponed)
+        if not calendars and deferred == saved["deferred"] and \
+                postponed == saved["postponed"]:
+            return
+        entry = {"time": time.time(), "calendars": calendars,
+                 "deferred": deferred, "postponed": postponed}
+        with open(self.log_path(group), "a") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        saved.update(logged=saved["logged"] + logged, deferred=deferred,
+                     postponed=postponed)
+
+    def _snapshot(self, group):
+        """
+        Atomically write all of `group`'s state, and start a new log.
+        """
+        self.seq = max(self.seq, self.loaded.get(group.name, (0, 0, 0))[1])
+        self.seq += 1
+        calendars = {}
+        cycles = {}
+        size = 0
+        for cal in group.calendars:
+            calendars[cal.url], cycles[cal.url] = self._state(cal, None)
+            size += 1 + len(calendars[cal.url].get("events", ()))
+        checkpoint = {"version": CHECKPOINT_VERSION, "time": time.time(),
+                      "group": group.name, "seq": self.seq,
+                      "calendars": calendars,
+                      "deferred": sorted(group.deferred),
+                      "postponed": sorted(group.postponed)}
+        # The log has to be there, and empty, before the snapshot is.
+        open(self.log_path(group, self.seq), "w").close()
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(checkpoint, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path(group))
+        except Exception:
+            os.remove(tmp)
+            raise
+        old = re.compile(re.escape(checkpoint_name(group.name)) +
+                         r"\.(\d+)\.log$")
+        for name in os.listdir(self.directory):
+            m = old.match(name)
+            if m and int(m.group(1)) != self.seq:
+                os.remove(os.path.join(self.directory, name))
+        self.saved[group.name] = {
+            "seq": self.seq, "size": size, "logged": 0, "cycles": cycles,
+            "tokens": dict((cal.url, cal.sync_token)
+                           for cal in group.calendars),
+            "deferred": checkpoint["deferred"],
+            "postponed": checkpoint["postponed"]}
+
+    def _apply(self, group, checkpoint):
+        for cal in group.calendars:
+            state = checkpoint["calendars"].get(cal.url)
+            if state is None:
+                continue
+            if "sync_token" in state:
+                cal.sync_token = state["sync_token"]
+            for k, v in state.get("events", {}).iteritems():
+                cal.events[k] = cal.profile.event(v)
+            for k in state.get("discarded", ()):
+                cal.events.discard(k)
+            # Everything checkpointed had been merged.
+            group.merged[cal] = cal.events.new_cycle()
+        group.deferred = set(checkpoint.get("deferred", []))
+        group.postponed = set(checkpoint.get("postponed", []))
+
+    def load(self, group):
+        """
+        Restore `group` from its checkpoint, as far as we haven't yet.
+        Returns whether anything was loaded.
+        """
+        path = self.path(group)
+        try:
+            f = open(path)
+        except IOError:
+            return False
+        with f:
+            st = os.fstat(f.fileno())
+            snapshot = (st.st_ino, st.st_mtime)
+            loaded = self.loaded.get(group.name)
+            changed = loaded is None or loaded[0] != snapshot
+            if changed:
+                checkpoint = json.load(f)
+                if checkpoint.get("version") != CHECKPOINT_VERSION:
+                    logging.warn("Ignoring checkpoint %s of unknown version",
+                                 path)
+                    return False
+                self._apply(group, checkpoint)
+                loaded = (snapshot, checkpoint["seq"], 0)
+                logging.debug("Loaded checkpoint of %s from %s", group.name,
+                              time.ctime(checkpoint["time"]))
+        snapshot, seq, offset = loaded
+        try:
+            with open(self.log_path(group, seq)) as f:
+                f.seek(offset)
+                data = f.read()
+        except IOError:
+            # Replaced by a newer snapshot, which we'll read next time.
+            data = ""
+        # The last line may still be being written.
+        data = data[:data.rfind("\n") + 1]
+        for line in data.splitlines():
+            self._apply(group, json.loads(line))
+            changed = True
+        self.loaded[group.name] = (snapshot, seq, offset + len(data))
+        return changed
+
+
+class HighAvailability:
+    """
+    Leader election and state handoff for a set of SyncedCalendars.
+    `groups` is a dict of name -> SyncedCalendar.
+    """
+
+    def __init__(self, config, groups, sleep=time.sleep):
+        self.lease = Lease(config.get('lease', DEFAULT_LEASE))
+        self.checkpointer = Checkpointer(config.get('checkpoint_dir',
+                                                    DEFAULT_CHECKPOINT_DIR))
+        self.poll = config.get('standby_poll', DEFAULT_STANDBY_POLL)
+        self.groups = groups
+        self.sleep = sleep
+
+    @property
+    def active(self):
+        return self.lease.f is not None
+
+    def tail(self):
+        """
+        Load whatever checkpoints changed since we last looked.
+        """
+        return sum(self.checkpointer.load(g) for g in self.groups.values())
+
+    def become_active(self):
+        """
+        Wait on standby, following the active process's checkpoints, until
+        we hold the lease.
+        """
+        if self.active:
+            return
+        logging.info("Standing by for lease %s (held by %s)", self.lease.path,
+                     self.lease.holder())
+        while True:
+            self.tail()
+            if self.lease.acquire():
+                break
+            self.sleep(self.poll)
+        # Whatever was checkpointed just before the lease was released.
+        self.tail()
+        logging.info("Took over lease %s", self.lease.path)
+
+    def checkpoint(self, group=None):
+        """
+        Save the state of `group`, or of every group.
+        """
+        groups = [group] if group else self.groups.values()
+        for g in groups:
+            self.checkpointer.save(g)
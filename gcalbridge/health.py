@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+An embedded HTTP endpoint reporting how well the bridge is keeping up.
+
+    GET /status   per-group and per-calendar sync state, as JSON
+    GET /ready    200 if every group converged within the SLO, 503 otherwise
+    GET /metrics  counters, gauges and histograms, as JSON
+    GET /healthz  200 while the process is serving
+
+The endpoint runs in its own thread and only reads the summaries the sync
+loop publishes after every iteration (see SyncedCalendar.publish), so it
+never waits on (or slows down) a sync, nor sees its state half-changed.
+"""
+
+import json
+import logging
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from .metrics import registry as metrics
+
+DEFAULT_SLO = 600
+# Status shows calendars and errors; not for everyone on the network.
+DEFAULT_ADDRESS = "127.0.0.1"
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+
+    def _reply(self, code, body):
+        content = json.dumps(body, indent=2, sort_keys=True)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/status":
+            self._reply(200, self.server.status())
+        elif path == "/ready":
+            ready, lagging = self.server.ready()
+            self._reply(200 if ready else 503, {"ready": ready,
+                                                "lagging": lagging})
+        elif path == "/metrics":
+            self._reply(200, metrics.snapshot())
+        elif path == "/healthz":
+            self._reply(200, {"ok": True})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        logging.debug("health: " + format, *args)
+
+
+class HealthServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves the status of a set of SyncedCalendars. `groups` is either a dict
+    of name -> SyncedCalendar or a callable returning one, so the set can
+    change while we're running.
+    """
+    daemon_threads = True
+
+    def __init__(self, groups, address=(DEFAULT_ADDRESS, 8081),
+                 slo=DEFAULT_SLO):
+        HTTPServer.__init__(self, address, HealthHandler)
+        self.groups = groups
+        self.slo = slo
+        self.started = time.time()
+
+    def _groups(self):
+        groups = self.groups() if callable(self.groups) else self.groups
+        return dict(groups)
+
+    def ready(self):
+        """
+        Returns (ready, names of groups that haven't converged within the
+        SLO).
+        """
+        now = time.time()
+        lagging = sorted(name for name, group in self._groups().items()
+                         if group.last_converged is None or
+                         now - group.last_converged > self.slo)
+        return not lagging, lagging
+
+    def status(self):
+        ready, lagging = self.ready()
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "ready": ready,
+            "slo": self.slo,
+            "groups": dict((name, group.status())
+                           for name, group in self._groups().items()),
+        }
+
+    def start(self):
+        """
+        Serve from a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logging.info("Serving status on port %d", self.server_address[1])
+        return thread
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+A write-ahead journal of the writes we send.
+
+If we die after deciding to write an event but before the write's response
+comes back, we can't tell on restart whether it landed. With a journal
+configured,
+
+    "journal": "/var/lib/gcal-bridge/journal"
+
+every write is recorded (calendar, event ID, fingerprint and operation) and
+the journal synced to disk before the batch carrying it is sent; its
+response marks it done. On the next sync, each calendar fetches the events
+of the writes it has left unfinished and stores them, so the merge sees
+what actually landed instead of writing it again. Nothing else is looked
+at.
+
+The journal is an append-only file of JSON lines: intents, and the
+sequence numbers of intents that are done. Once it holds enough finished
+intents it's rewritten with only the unfinished ones.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+from .metrics import registry as metrics
+
+# Rewrite the journal once it holds this many finished intents.
+COMPACT_THRESHOLD = 10000
+
+
+class Journal:
+    """
+    The journal kept in `path`.
+    """
+
+    def __init__(self, path, compact_threshold=COMPACT_THRESHOLD):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        # Sequence number -> intent, for unfinished intents.
+        self.pending = {}
+        self.seq = 0
+        # Lines in the file, and whether any were written since sync().
+        self.lines = 0
+        self.unsynced = False
+        self.load()
+        self.file = open(self.path, "a")
+        if self.lines > len(self.pending):
+            self.compact()
+
+    @classmethod
+    def from_config(cls, path):
+        """
+        The journal for the top-level "journal" setting; None if there isn't
+        one.
+        """
+        if not path:
+            return None
+        return cls(path)
+
+    def load(self):
+        """
+        Read the unfinished intents from our file.
+        """
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                self.lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn by a crash halfway through writing it.
+                    logging.warn("Ignoring damaged line %d of journal %s",
+                                 self.lines, self.path)
+                    continue
+                if "done" in record:
+                    self.pending.pop(record["done"], None)
+                else:
+                    self.pending[record["seq"]] = record
+                    self.seq = max(self.seq, record["seq"])
+        if self.pending:
+            logging.info("Journal %s has %d unfinished writes", self.path,
+                         len(self.pending))
+
+    def _append(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":"),
+                                   sort_keys=True) + "\n")
+        self.lines += 1
+
+    def intend(self, calendar, event_id, op, fingerprint):
+        """
+        Record that we're about to write event `event_id` of `calendar` (a
+        URL). Returns the intent's sequence number.
+        """
+        self.seq += 1
+        record = {"seq": self.seq, "cal": calendar, "id": event_id, "op": op,
+                  "hash": fingerprint}
+        self._append(record)
+        self.pending[self.seq] = record
+        self.unsynced = True
+        metrics.gauge("journal_pending", len(self.pending))
+        return self.seq
+
+    def sync(self):
+        """
+        Make sure every intent recorded so far is on disk. Called before
+        sending the writes.
+        """
+        if not self.unsynced:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = False
+
+    def done(self, seq):
+        """
+        Mark intent `seq` finished: its response came back, or it was never
+        sent.
+        """
+        if self.pending.pop(seq, None) is None:
+            return
+        # Not synced: losing it only costs looking the event up again.
+        self._append({"done": seq})
+        metrics.gauge("journal_pending", len(self.pending))
+        if self.lines - len(self.pending) >= self.compact_threshold:
+            self.compact()
+
+    def unfinished(self, calendar):
+        """
+        The unfinished intents for `calendar`, oldest first.
+        """
+        return sorted((r for r in self.pending.values()
+                       if r["cal"] == calendar), key=lambda r: r["seq"])
+
+    def compact(self):
+        """
+        Atomically rewrite our file with only the unfinished intents.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for seq in sorted(self.pending):
+                    f.write(json.dumps(self.pending[seq],
+                                       separators=(",", ":"),
+                                       sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+        except Exception:
+            os.remove(tmp)
+            raise
+        self.file.close()
+        self.file = open(self.path, "a")
+        logging.debug("Compacted journal %s from %d to %d lines", self.path,
+                      self.lines, len(self.pending))
+        self.lines = len(self.pending)
+        self.unsynced = False
+
+    def close(self):
+        self.file.close()
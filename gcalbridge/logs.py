@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""
+Logging setup.
+
+By default we log everything down to debug level, as text, from whichever
+thread is logging. That's what you want while setting up or chasing a bug,
+but under load formatting and writing all of it costs more than the syncing.
+The top-level "logging" setting picks something else:
+
+    "logging": {"level": "info", "format": "json", "async": true,
+                "debug_rate": 10, "debug_calendars": ["foo.com_1@..."]}
+
+or just "logging": "production" for the first four of those. Records are
+formatted (as one JSON object per line with "json") and written by a
+background thread when "async" is set, so the sync threads only queue them.
+Debug records are limited to `debug_rate` a second per calendar. Calendars
+in `debug_calendars` log at debug level whatever the level, for
+troubleshooting one of them without drowning in the rest; the setting is
+picked up when the configuration is reloaded.
+"""
+
+import json
+import logging
+import sys
+import threading
+import time
+from Queue import Queue, Full
+
+from .metrics import registry as metrics
+
+DEFAULT_FORMAT = "[%(levelname)-8s:%(filename)-15s:%(lineno)4s: " \
+                 "%(funcName)20.20s ] %(message)s"
+# Records waiting for the writer thread, beyond which they're dropped.
+DEFAULT_LOG_BUFFER = 10000
+
+PRESETS = {
+    "debug": {},
+    "production": {"level": "info", "format": "json", "async": True,
+                   "debug_rate": 10},
+}
+
+
+class lazy:
+    """
+    `f(*args)`, computed only if it's logged: logging.debug("%s",
+    lazy(pformat, event)).
+    """
+
+    def __init__(self, f, *args):
+        self.f = f
+        self.args = args
+
+    def __str__(self):
+        return str(self.f(*self.args))
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as JSON objects, with the calendar they're about if
+    they say.
+    """
+
+    def format(self, record):
+        r = {"time": record.created, "level": record.levelname,
+             "file": record.filename, "line": record.lineno,
+             "func": record.funcName, "thread": record.threadName,
+             "msg": record.getMessage()}
+        calendar = getattr(record, 'calendar', None)
+        if calendar is not None:
+            r["calendar"] = calendar
+        if record.exc_info:
+            r["exc"] = self.formatException(record.exc_info)
+        return json.dumps(r, sort_keys=True, default=repr)
+
+
+class DebugFilter(logging.Filter):
+    """
+    Lets through records at `level` or above, and debug records of the
+    calendars in `verbose`. Debug records are limited to `rate` a second
+    per calendar, if given; the calendars in `verbose` excepted.
+    """
+
+    def __init__(self, level=logging.DEBUG, rate=None, verbose=(),
+                 clock=time.time):
+        logging.Filter.__init__(self)
+        self.level = level
+        self.rate = rate
+        self.verbose = set(verbose)
+        self.clock = clock
+        # Calendar -> [second, records logged in it]
+        self.counts = {}
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return record.levelno >= self.level
+        calendar = getattr(record, 'calendar', None)
+        if calendar in self.verbose:
+            return True
+        if self.level > logging.DEBUG:
+            return False
+        if self.rate is None:
+            return True
+        second = int(self.clock())
+        count = self.counts.get(calendar)
+        if count is None or count[0] != second:
+            count = self.counts[calendar] = [second, 0]
+        if count[1] >= self.rate:
+            self.dropped += 1
+            metrics.incr("log_dropped", reason="rate")
+            return False
+        count[1] += 1
+        return True
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Hands records to `target`, another handler, from a background thread;
+    records that don't fit in a buffer of `buffer` are dropped.
+
+    Records are formatted when they're written, so objects passed as
+    arguments should not be modified after logging them.
+    """
+
+    def __init__(self, target, buffer=DEFAULT_LOG_BUFFER):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = Queue(buffer)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            metrics.incr("log_dropped", reason="full")
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is not None:
+                    self.target.handle(record)
+            finally:
+                self.queue.task_done()
+            if record is None:
+                break
+
+    def flush(self):
+        """
+        Wait until everything queued has been written.
+        """
+        self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+def configure(settings=None, stream=None):
+    """
+    Replace the root logger's handlers with what the "logging" setting
+    asks for (see above). Returns the new handler.
+    """
+    if settings is None or isinstance(settings, basestring):
+        if (settings or "debug") not in PRESETS:
+            raise ValueError("Unknown logging preset %s" % settings)
+        settings = PRESETS[settings or "debug"]
+    level = logging.getLevelName(settings.get('level', "debug").upper())
+    if not isinstance(level, int):
+        raise ValueError("Unknown log level %s" % settings['level'])
+    verbose = settings.get('debug_calendars', [])
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if settings.get('format') == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(DEFAULT_FORMAT))
+    if settings.get('async'):
+        handler = AsyncHandler(handler, settings.get('buffer',
+                                                     DEFAULT_LOG_BUFFER))
+    handler.addFilter(DebugFilter(level, settings.get('debug_rate'),
+                                  verbose))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(handler)
+    # Records below the level are only made at all if some calendar wants
+    # them.
+    root.setLevel(logging.DEBUG if verbose else level)
+    return handler
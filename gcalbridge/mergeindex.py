@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""
+An index of every event's versions across a group's calendars.
+
+Most of the events a group merges are already the same everywhere: they're
+our own writes, coming back in the next listing. Rather than gather every
+version of an event and compare them all again to find that out, a
+SyncedCalendar keeps a MergeIndex, which its calendars' event stores update
+as events are stored. For every event ID it knows the fingerprint, sequence
+and status of each calendar's version, which version wins, and which
+calendars don't have it yet; so whether an event needs writing anywhere is
+a lookup.
+
+The index costs a few hundred bytes per event per calendar: a Version is a
+tuple of the event's fingerprint, sequence, update time and two flags, and
+no more of the event is kept. Groups with a calendar whose events are kept
+on disk (see SqliteEventStore) don't have one, as it would hold an entry
+for every event on disk in memory after all; they compare every version of
+an event whenever it changes instead.
+"""
+
+from collections import namedtuple
+
+
+class Version(namedtuple('Version', 'hash sequence updated active master')):
+    """
+    What the index keeps of one calendar's copy of an event.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, event):
+        return cls(event.ehash(), event.get('sequence', 0),
+                   event.get('updated'), event.active(),
+                   bool(event.master_id()))
+
+    def same(self, other):
+        return self.hash == other.hash and self.sequence == other.sequence
+
+    def newer(self, other):
+        """
+        Whether we'd win over `other`; see Event.__cmp__.
+        """
+        return self.hash != other.hash and self.updated > other.updated
+
+
+class Entry:
+    """
+    The versions of one event, and what they add up to.
+    """
+
+    def __init__(self):
+        # Calendar -> Version
+        self.versions = {}
+        self.winner = None
+        self.source = None
+        self.sequence = 0
+        self.cancelled = False
+        self.master = False
+        # Calendars whose version isn't the winning one, or that have none.
+        self.stale = set()
+
+
+class MergeIndex:
+    """
+    Versions of every event in `calendars`, kept up to date by their event
+    stores. `listener`, if given, is called with (ID, Entry) whenever an
+    event's entry changes, and (ID, None) when it's gone.
+    """
+
+    def __init__(self, calendars, listener=None):
+        self.calendars = calendars
+        self.listener = listener
+        self.entries = {}
+        for cal in calendars:
+            cal.events.listener = self._listener(cal)
+            for id, event in cal.events.iteritems():
+                self.entries.setdefault(id, Entry()).versions[cal] = \
+                    Version.of(event)
+        for id in self.entries:
+            self._update(id)
+
+    def _listener(self, cal):
+        def stored(id, event):
+            self.stored(cal, id, event)
+        return stored
+
+    def stored(self, cal, id, event):
+        """
+        Note that `cal` now has `event` as event `id` (None if it has been
+        discarded).
+        """
+        entry = self.entries.get(id)
+        if event is None:
+            if entry is None:
+                return
+            entry.versions.pop(cal, None)
+        else:
+            if entry is None:
+                entry = self.entries[id] = Entry()
+            entry.versions[cal] = Version.of(event)
+        self._update(id)
+
+    def refresh(self, id):
+        """
+        Read event `id` from every calendar again, after it was modified in
+        place.
+        """
+        for cal in self.calendars:
+            event = cal.events.get(id)
+            self.stored(cal, id, event)
+
+    def _update(self, id):
+        entry = self.entries[id]
+        if not entry.versions:
+            del self.entries[id]
+            if self.listener is not None:
+                self.listener(id, None)
+            return
+        winner = source = None
+        for cal in self.calendars:
+            version = entry.versions.get(cal)
+            if version is not None and (winner is None or
+                                        version.newer(winner)):
+                winner, source = version, cal
+        entry.winner, entry.source = winner, source
+        entry.sequence = max(v.sequence for v in entry.versions.values())
+        entry.cancelled = not all(v.active for v in entry.versions.values())
+        entry.master = winner.master
+        entry.stale = set(c for c in self.calendars
+                          if c not in entry.versions or
+                          not entry.versions[c].same(winner))
+        if self.listener is not None:
+            self.listener(id, entry)
+
+    def get(self, id):
+        return self.entries.get(id)
+
+    def current(self, id):
+        """
+        Whether every calendar already has the winning version of event
+        `id`, so that there's nothing to write.
+        """
+        entry = self.entries.get(id)
+        return entry is not None and not entry.stale
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+"""
+Lightweight in-process metrics.
+"""
+
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+HISTORY_LENGTH = 1000
+
+# Histogram bucket upper bounds, in seconds.
+DEFAULT_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600,
+                   12 * 3600, 24 * 3600]
+
+
+def metric_key(name, labels=None):
+    """
+    Build the key a metric is stored under, e.g. `batch_size{domain=foo.com}`.
+    """
+    if not labels:
+        return name
+    return "%s{%s}" % (name, ",".join("%s=%s" % (k, labels[k])
+                                      for k in sorted(labels)))
+
+
+class Histogram:
+    """
+    Counts observations into buckets with fixed upper bounds.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        The upper bound of the bucket holding the `q` quantile (None if it's
+        past the last bucket, or nothing was observed).
+        """
+        if not self.count:
+            return None
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= q * self.count:
+                return self.buckets[i] if i < len(self.buckets) else None
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"],
+                                self.counts)),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    A registry of counters, gauges and histograms. Every gauge also keeps a
+    bounded history of (timestamp, value) pairs so values can be followed
+    over time.
+    """
+
+    def __init__(self, history=HISTORY_LENGTH):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.histograms = {}
+        self.series = defaultdict(lambda: deque(maxlen=history))
+
+    def incr(self, name, n=1, **labels):
+        self.counters[metric_key(name, labels)] += n
+
+    def gauge(self, name, value, **labels):
+        key = metric_key(name, labels)
+        self.gauges[key] = value
+        self.series[key].append((time.time(), value))
+
+    def observe(self, name, value, **labels):
+        key = metric_key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def histogram(self, name, **labels):
+        return self.histograms.get(metric_key(name, labels))
+
+    def history(self, name, **labels):
+        return list(self.series.get(metric_key(name, labels), []))
+
+    def snapshot(self):
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms": dict((k, h.summary())
+                               for k, h in self.histograms.items()),
+        }
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+        self.series.clear()
+
+
+registry = Metrics()
+
+
+class Timeline:
+    """
+    How long each phase of something (say, startup) took. Every phase is
+    also exported as a `<name>_seconds{phase=...}` gauge.
+    """
+
+    def __init__(self, name, clock=time.time):
+        self.name = name
+        self.clock = clock
+        self.started = clock()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            duration = self.clock() - start
+            self.phases.append((name, duration))
+            registry.gauge(self.name + "_seconds", duration, phase=name)
+
+    def total(self):
+        return self.clock() - self.started
+
+    def report(self):
+        """
+        Log the phases, and return them as a list of (phase, seconds).
+        """
+        logging.info("%s took %.1fs: %s", self.name, self.total(),
+                     ", ".join("%s %.1fs" % p for p in self.phases))
+        return list(self.phases)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+Field profiles: which event fields a group of calendars keeps in sync.
+
+By default every field in Event.props and Event.special_props is compared,
+fingerprinted and written. A group that only needs some of them (a room
+mirror might only care about times, status and summary) can use a narrower
+profile, in config.json:
+
+    "profiles": {
+        "rooms": {"fields": ["summary"]}
+    },
+    "calendars": {
+        "bob-office": {"profile": "rooms", "calendars": [...]},
+        "lobby": {"fields": ["summary", "location"], "calendars": [...]}
+    }
+
+A profile's events only compare and fingerprint its fields; listings ask the
+API for just those fields, and writes only carry them (updates become
+patches, so fields outside the profile are left alone).
+"""
+
+from .errors import BadConfigError
+
+# Fields every profile needs to identify, order and merge events.
+REQUIRED_FIELDS = [
+    "id",
+    "status",
+    "start",
+    "end",
+    "recurrence",
+    "recurringEventId",
+    "originalStartTime",
+]
+# Fields we read or send without comparing them.
+BOOKKEEPING_FIELDS = ["updated", "sequence", "iCalUID"]
+# Fields compared by their attendees' email addresses rather than verbatim.
+SPECIAL_FIELDS = ["attendees"]
+
+FULL = "full"
+
+
+class FieldProfile:
+    """
+    A named set of fields, and an Event class that compares only those.
+    `fields` of None means everything Event compares by default.
+    """
+
+    def __init__(self, name, fields=None):
+        from .calendar import Event
+
+        self.name = name
+        self.partial = fields is not None
+        if fields is None:
+            self.event_class = Event
+            self.list_fields = None
+            return
+        props = list(REQUIRED_FIELDS)
+        special_props = []
+        for f in fields:
+            if f in SPECIAL_FIELDS:
+                special_props.append(f)
+            elif f not in props:
+                props.append(f)
+        self.event_class = type("ProfileEvent", (Event,), {
+            "props": props,
+            "special_props": special_props,
+        })
+        self.fields = props + special_props + BOOKKEEPING_FIELDS
+        self.list_fields = "nextPageToken,nextSyncToken,items(%s)" % \
+            ",".join(self.fields)
+
+    def same_fields(self, other):
+        """
+        Whether `other` syncs the same fields as we do.
+        """
+        return self.partial == other.partial and \
+            getattr(self, 'fields', None) == getattr(other, 'fields', None)
+
+    def event(self, event):
+        """
+        Wrap a resource from the API in our Event class.
+        """
+        return self.event_class(event)
+
+    def payload(self, event):
+        """
+        The body to write `event` with: only our fields.
+        """
+        if not self.partial:
+            return event
+        return self.event_class(dict((k, v) for k, v in event.iteritems()
+                                     if k in self.fields))
+
+
+DEFAULT_PROFILE = None
+
+
+def default_profile():
+    """
+    The profile that syncs everything Event compares by default.
+    """
+    global DEFAULT_PROFILE
+    if DEFAULT_PROFILE is None:
+        DEFAULT_PROFILE = FieldProfile(FULL)
+    return DEFAULT_PROFILE
+
+
+def profiles_from_config(config):
+    """
+    Build the profiles defined in the top-level "profiles" setting.
+    """
+    profiles = {FULL: default_profile()}
+    for name, profile_config in (config or {}).iteritems():
+        if 'fields' not in profile_config:
+            raise BadConfigError("Profile %s doesn't have 'fields' set!" %
+                                 name)
+        profiles[name] = FieldProfile(name, profile_config['fields'])
+    return profiles
+
+
+def group_profile(name, group_config, profiles=None):
+    """
+    The profile a group uses: inline "fields", a named "profile", or the
+    full default.
+    """
+    if 'fields' in group_config:
+        return FieldProfile(name, group_config['fields'])
+    profile = group_config.get('profile')
+    if profile is None or profile == FULL:
+        return default_profile()
+    if not profiles or profile not in profiles:
+        raise BadConfigError("Profile %s referenced by %s not defined." % (
+            profile, name))
+    return profiles[profile]
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""
+Quota accounting.
+
+Google limits Calendar API requests per project per day, and per user per
+100 seconds. A QuotaAccountant counts the requests made against one of
+those budgets (every listing page, write and batched sub-request) and
+projects the day's usage from the rate so far. When the projection runs
+into the budget, work that can wait (merging events far in the future or
+long past, seeding new calendars) is put off so the budget that's left goes
+to what's happening now.
+
+Each Domain has its own accountant, which also counts against the project's.
+Counters can be kept in a file so they survive restarts. Accountants may be
+used from several threads (see Config.setup).
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+
+from .metrics import registry as metrics
+
+# The Calendar API's default per-project daily limit.
+DEFAULT_DAILY_QUOTA = 1000000
+# Window of the per-user rate limit, in seconds.
+QUOTA_WINDOW = 100
+# Fraction of a budget kept for urgent work.
+DEFAULT_QUOTA_RESERVE = 0.2
+# Daily quotas are reset at midnight Pacific time: UTC-8, or UTC-7 while
+# daylight saving time is on.
+PACIFIC_STANDARD_OFFSET = -8 * 3600
+PACIFIC_DAYLIGHT_OFFSET = -7 * 3600
+EPOCH = datetime(1970, 1, 1)
+# Don't project from less than this much of the day, in seconds; a burst
+# right after midnight (or a restart) says little about the rest of it.
+MIN_PROJECTION_PERIOD = 3600
+# Events further than this from now (in seconds) can wait for quota.
+DEFAULT_QUOTA_HORIZON = 7 * 86400
+# Write the state file every so many requests, besides on save().
+SAVE_INTERVAL = 100
+
+
+def _sunday(year, month, n):
+    """
+    The UTC midnight starting the `n`th Sunday of a month, in seconds.
+    """
+    first = date(year, month, 1)
+    day = first.toordinal() + (6 - first.weekday()) % 7 + 7 * (n - 1)
+    return (date.fromordinal(day) - EPOCH.date()).days * 86400
+
+
+def pacific_offset(t):
+    """
+    The offset of Pacific time from UTC at time `t`, in seconds. Daylight
+    saving time runs from 2am on the second Sunday in March to 2am on the
+    first Sunday in November (the US rules since 2007; earlier years and
+    future changes to the rules aren't known).
+    """
+    year = time.gmtime(t).tm_year
+    start = _sunday(year, 3, 2) + 2 * 3600 - PACIFIC_STANDARD_OFFSET
+    end = _sunday(year, 11, 1) + 2 * 3600 - PACIFIC_DAYLIGHT_OFFSET
+    if start <= t < end:
+        return PACIFIC_DAYLIGHT_OFFSET
+    return PACIFIC_STANDARD_OFFSET
+
+
+def quota_day(t):
+    """
+    The number of the quota day time `t` falls in.
+    """
+    return int((t + pacific_offset(t)) // 86400)
+
+
+def quota_day_start(day):
+    """
+    When quota day number `day` starts.
+    """
+    # Midnight Pacific is seven or eight hours into the UTC day, and clocks
+    # change later than that, so the offset seven hours in is midnight's.
+    return day * 86400 - pacific_offset(day * 86400 + 7 * 3600)
+
+
+class QuotaAccountant:
+    """
+    Counts requests against a budget of `daily` a day and `per_window` every
+    QUOTA_WINDOW seconds (None for no limit), keeping a `reserve` fraction
+    of each for urgent work. Requests are also counted against `parent`,
+    if given.
+    """
+
+    def __init__(self, name=None, daily=DEFAULT_DAILY_QUOTA, per_window=None,
+                 reserve=DEFAULT_QUOTA_RESERVE, state_file=None, parent=None,
+                 clock=time.time):
+        self.name = name
+        self.daily = daily
+        self.per_window = per_window
+        self.reserve = reserve
+        self.state_file = state_file
+        self.parent = parent
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.window = deque()
+        self.day = self.today()
+        self.used = 0
+        self.saved = 0
+        # When we started counting today.
+        self.since = self.clock()
+        self.load()
+
+    @classmethod
+    def from_config(cls, name, config, parent=None, daily=None):
+        """
+        Build an accountant from a domain's config (or the top-level "quota"
+        setting), which may set `quota_daily` (default `daily`),
+        `quota_per_100s`, `quota_reserve` and `quota_state`.
+        """
+        return cls(name,
+                   daily=config.get('quota_daily', daily),
+                   per_window=config.get('quota_per_100s'),
+                   reserve=config.get('quota_reserve', DEFAULT_QUOTA_RESERVE),
+                   state_file=config.get('quota_state'),
+                   parent=parent)
+
+    def today(self):
+        return quota_day(self.clock())
+
+    def _roll(self):
+        day = self.today()
+        if day != self.day:
+            self.day = day
+            self.used = self.saved = 0
+            self.since = quota_day_start(day)
+        now = self.clock()
+        while self.window and now - self.window[0][0] >= QUOTA_WINDOW:
+            self.window.popleft()
+
+    def spend(self, n=1, kind="request"):
+        """
+        Count `n` requests of some `kind` (list, write, import...).
+        """
+        if not n:
+            return
+        with self.lock:
+            self._roll()
+            self.used += n
+            self.window.append((self.clock(), n))
+            metrics.incr("quota_used", n, quota=self.name, kind=kind)
+            metrics.gauge("quota_projected", self.projected(),
+                          quota=self.name)
+            if self.used - self.saved >= SAVE_INTERVAL:
+                self.save()
+        if self.parent is not None:
+            self.parent.spend(n, kind)
+
+    def window_used(self):
+        with self.lock:
+            self._roll()
+            return sum(n for t, n in self.window)
+
+    def projected(self):
+        """
+        How many requests we'll have made by the end of the day, at the rate
+        we've been making them.
+        """
+        with self.lock:
+            self._roll()
+            now = self.clock()
+            end = quota_day_start(self.day + 1)
+            elapsed = max(now - self.since, MIN_PROJECTION_PERIOD)
+            return self.used + self.used * max(end - now, 0) / float(elapsed)
+
+    def tight(self):
+        """
+        Whether we (or our parent) are running into our reserve, so that
+        work that can wait should.
+        """
+        if self.parent is not None and self.parent.tight():
+            return True
+        if self.daily and self.projected() > self.daily * (1 - self.reserve):
+            return True
+        return bool(self.per_window and self.window_used() >
+                    self.per_window * (1 - self.reserve))
+
+    def load(self):
+        """
+        Pick up today's count from our state file.
+        """
+        if not self.state_file or not os.path.isfile(self.state_file):
+            return
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (IOError, ValueError) as e:
+            logging.warn("Ignoring quota state %s: %r", self.state_file, e)
+            return
+        if state.get("day") == self.day:
+            self.used = self.saved = state.get("used", 0)
+            self.since = state.get("since", self.since)
+
+    def save(self):
+        """
+        Atomically write today's count to our state file.
+        """
+        if not self.state_file:
+            return
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        with self.lock:
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"day": self.day, "used": self.used,
+                               "since": self.since}, f)
+                os.rename(tmp, self.state_file)
+            except Exception:
+                os.remove(tmp)
+                raise
+            self.saved = self.used
+        if self.parent is not None:
+            self.parent.save()
+
+    def status(self):
+        return {
+            "used": self.used,
+            "projected": int(self.projected()),
+            "daily": self.daily,
+            "tight": self.tight(),
+        }
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+Recovery from expired sync tokens.
+
+When Google expires a sync token, listing events with it fails with 410 Gone
+and the only way forward is to list the whole calendar again. Tokens tend to
+expire in bunches, so a RecoveryThrottle per Domain spreads those relists
+out: only a few calendars may start one in any interval, the others keep
+their events and try again on a later sync.
+"""
+
+import logging
+import time
+from collections import deque
+
+from .metrics import registry as metrics
+
+DEFAULT_MAX_RECOVERIES = 1
+DEFAULT_RECOVERY_INTERVAL = 60
+DEFAULT_RECOVERY_PAGE_SIZE = 250
+DEFAULT_RECOVERY_PAGE_DELAY = 0.5
+
+
+def is_sync_token_expired(exception):
+    """
+    Whether `exception` is a 410 Gone from listing with a stale sync token.
+    """
+    resp = getattr(exception, 'resp', None)
+    return resp is not None and getattr(resp, 'status', None) == 410
+
+
+class RecoveryThrottle:
+    """
+    Allows at most `max_recoveries` full relists to start every `interval`
+    seconds. Relists list `page_size` events at a time, pausing `page_delay`
+    seconds between pages.
+    """
+
+    def __init__(self, name=None, max_recoveries=DEFAULT_MAX_RECOVERIES,
+                 interval=DEFAULT_RECOVERY_INTERVAL,
+                 page_size=DEFAULT_RECOVERY_PAGE_SIZE,
+                 page_delay=DEFAULT_RECOVERY_PAGE_DELAY, clock=time.time):
+        self.name = name
+        self.max_recoveries = max_recoveries
+        self.interval = interval
+        self.page_size = page_size
+        self.page_delay = page_delay
+        self.clock = clock
+        self.sleep = time.sleep
+        self.started = deque()
+
+    @classmethod
+    def from_config(cls, name, config):
+        """
+        Build a throttle from a domain's config, which may set
+        `max_recoveries`, `recovery_interval`, `recovery_page_size` and
+        `recovery_page_delay`.
+        """
+        return cls(name,
+                   max_recoveries=config.get('max_recoveries',
+                                             DEFAULT_MAX_RECOVERIES),
+                   interval=config.get('recovery_interval',
+                                       DEFAULT_RECOVERY_INTERVAL),
+                   page_size=config.get('recovery_page_size',
+                                        DEFAULT_RECOVERY_PAGE_SIZE),
+                   page_delay=config.get('recovery_page_delay',
+                                         DEFAULT_RECOVERY_PAGE_DELAY))
+
+    def acquire(self, calendar):
+        """
+        Whether `calendar` may start a relist now.
+        """
+        now = self.clock()
+        while self.started and now - self.started[0] >= self.interval:
+            self.started.popleft()
+        if len(self.started) >= self.max_recoveries:
+            logging.info("Deferring relist of %s: %d already started in the "
+                         "last %ds", calendar.name, len(self.started),
+                         self.interval)
+            metrics.incr("recoveries_deferred", domain=self.name)
+            return False
+        self.started.append(now)
+        metrics.incr("recoveries", domain=self.name)
+        return True
+
+    def pause(self):
+        """
+        Wait between two pages of a relist.
+        """
+        if self.page_delay:
+            self.sleep(self.page_delay)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+"""
+Record and replay Calendar API traffic.
+
+RecordingHttp wraps the http object a Domain talks to and appends every
+calendarList, events and batch exchange to a cassette: a gzipped file with
+one JSON record per line. Personal data (names, summaries, descriptions,
+locations, email addresses and calendar IDs) is replaced by stable
+pseudonyms, so identical values stay identical and the traffic keeps its
+shape.
+
+ReplayHttp serves a cassette back, so SyncedCalendar.sync can be driven
+offline, deterministically and without any waiting.
+
+    python -m gcalbridge.replay record config.json traffic.cassette
+    python -m gcalbridge.replay replay traffic.cassette
+"""
+
+from __future__ import print_function
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import defaultdict, deque
+from urllib import unquote
+from urlparse import urlparse
+
+import httplib2
+
+from .errors import ReplayError
+
+CASSETTE_VERSION = 1
+
+# Fields whose values are free text or identify people.
+PERSONAL_FIELDS = ["summary", "description", "location", "displayName",
+                   "summaryOverride", "comment"]
+# Fields that only make sense against the real service.
+DROPPED_FIELDS = ["htmlLink", "hangoutLink", "conferenceData", "attachments"]
+# Domains that don't identify anyone.
+PUBLIC_DOMAINS = ["google.com", "googleapis.com"]
+
+EMAIL_RE = re.compile(r"[\w.+%-]+@[\w-]+(?:\.[\w-]+)+")
+BLANK_LINE_RE = re.compile(r"\r?\n\r?\n")
+
+
+class Scrubber:
+    """
+    Replaces personal data with pseudonyms derived from a salted hash.
+    """
+
+    def __init__(self, salt=None):
+        if salt is None:
+            salt = os.urandom(16).encode('hex')
+        self.salt = salt
+
+    def pseudonym(self, value, length=10):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return hashlib.sha1(self.salt + value).hexdigest()[:length]
+
+    def domain(self, domain):
+        for public in PUBLIC_DOMAINS:
+            if domain == public or domain.endswith("." + public):
+                return domain
+        return "d%s.example" % self.pseudonym(domain, 8)
+
+    def email(self, match):
+        local, domain = match.group(0).rsplit("@", 1)
+        return "u%s@%s" % (self.pseudonym(local), self.domain(domain))
+
+    def text(self, value):
+        return EMAIL_RE.sub(self.email, value)
+
+    def json(self, obj):
+        if isinstance(obj, dict):
+            scrubbed = {}
+            for k, v in obj.iteritems():
+                if k in DROPPED_FIELDS:
+                    continue
+                if k in PERSONAL_FIELDS and isinstance(v, basestring):
+                    scrubbed[k] = "%s %s" % (k, self.pseudonym(v))
+                else:
+                    scrubbed[k] = self.json(v)
+            return scrubbed
+        elif isinstance(obj, list):
+            return [self.json(v) for v in obj]
+        elif isinstance(obj, basestring):
+            return self.text(obj)
+        return obj
+
+    def uri(self, uri):
+        """
+        Scrub the (unquoted) path of `uri`, dropping scheme, host and query.
+        """
+        return self.text(unquote(urlparse(uri).path))
+
+    def body(self, content, content_type):
+        """
+        Scrub a response body, either JSON or a multipart batch response.
+        """
+        if not content:
+            return content
+        if content_type.startswith("multipart/"):
+            return self.multipart(content)
+        try:
+            return json.dumps(self.json(json.loads(content)),
+                              separators=(",", ":"))
+        except ValueError:
+            return self.text(content)
+
+    def multipart(self, content):
+        parts = []
+        for part in content.split("\n--"):
+            # Outer part headers, inner status line and headers, then body.
+            sections = BLANK_LINE_RE.split(part, 2)
+            if len(sections) == 3 and sections[2].strip():
+                inner = "\r\n".join(
+                    l for l in sections[1].splitlines()
+                    if not l.lower().startswith("content-length"))
+                body = sections[2].rstrip()
+                try:
+                    body = json.dumps(self.json(json.loads(body)),
+                                      separators=(",", ":"))
+                except ValueError:
+                    body = self.text(body)
+                part = "\r\n\r\n".join([sections[0], inner, body]) + "\r"
+            parts.append(part)
+        return "\n--".join(parts)
+
+
+def is_api_request(uri):
+    """
+    Discovery documents aren't part of the traffic worth recording.
+    """
+    return "/discovery/" not in uri
+
+
+class CassetteWriter:
+    """
+    Appends records to a gzipped JSON-lines cassette.
+    """
+
+    def __init__(self, path, layout=None, scrubber=None):
+        self.path = path
+        self.scrubber = scrubber or Scrubber()
+        self.f = gzip.open(path, "wb")
+        self.records = 0
+        self._write({"version": CASSETTE_VERSION,
+                     "recorded": time.time(),
+                     "layout": layout or {}})
+
+    def _write(self, record):
+        self.f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def append(self, tag, method, uri, body, resp, content):
+        content_type = resp.get("content-type", "")
+        self._write({
+            "tag": tag,
+            "method": method,
+            "path": self.scrubber.uri(uri),
+            "sent": len(body or ""),
+            "status": resp.status,
+            "type": content_type,
+            "body": self.scrubber.body(content, content_type),
+        })
+        self.records += 1
+
+    def close(self):
+        self.f.close()
+
+
+def read_cassette(path):
+    """
+    Returns (header, records) for the cassette at `path`.
+    """
+    with gzip.open(path, "rb") as f:
+        lines = [json.loads(l) for l in f if l.strip()]
+    if not lines or lines[0].get("version") != CASSETTE_VERSION:
+        raise ValueError("%s is not a version %d cassette" % (
+            path, CASSETTE_VERSION))
+    return lines[0], lines[1:]
+
+
+class RecordingHttp:
+    """
+    Wraps an httplib2.Http-like object and records the API traffic going
+    through it. `tag` identifies the domain the traffic belongs to.
+    """
+
+    def __init__(self, http, cassette, tag=None):
+        self.http = http
+        self.cassette = cassette
+        self.tag = tag
+
+        def request(uri, method="GET", body=None, headers=None, *args,
+                    **kwargs):
+            resp, content = self.http.request(uri, method, body, headers,
+                                              *args, **kwargs)
+            if is_api_request(uri):
+                self.cassette.append(self.tag, method, uri, body, resp,
+                                     content)
+            return resp, content
+
+        # apiclient looks for the credentials of an authorized http object
+        # on its request method.
+        if hasattr(http.request, 'credentials'):
+            request.credentials = http.request.credentials
+        self.request = request
+
+
+class ReplayHttp:
+    """
+    Serves recorded responses. Requests are matched on method and path,
+    in recording order. Discovery documents are fetched with `fallback`.
+    """
+
+    def __init__(self, records, tag=None, fallback=None):
+        self.tag = tag
+        self.fallback = fallback
+        self.queues = defaultdict(deque)
+        self.requests = 0
+        for r in records:
+            if r.get("tag") == tag:
+                self.queues[(r["method"], r["path"])].append(r)
+
+    @classmethod
+    def from_cassette(cls, path, tag=None):
+        header, records = read_cassette(path)
+        return cls(records, tag=tag)
+
+    def remaining(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def request(self, uri, method="GET", body=None, headers=None, *args,
+                **kwargs):
+        if not is_api_request(uri):
+            if self.fallback is None:
+                self.fallback = httplib2.Http()
+            return self.fallback.request(uri, method, body, headers)
+        key = (method, unquote(urlparse(uri).path))
+        if not self.queues.get(key):
+            raise ReplayError("No recorded response left for %s %s" % key)
+        record = self.queues[key].popleft()
+        self.requests += 1
+        resp = httplib2.Response({"status": record["status"],
+                                  "content-type": record["type"]})
+        return resp, record["body"].encode("utf-8")
+
+
+def record(config_file, path):
+    """
+    Run one sync of every group in `config_file`, recording all API
+    traffic to the cassette at `path`.
+    """
+    from .config import Config
+    from .domain import Domain
+    from .calendar import SyncedCalendar
+
+    config = Config(config_file)
+    scrubber = Scrubber()
+    layout = {}
+    for group, group_config in config.calendars.iteritems():
+        layout[scrubber.pseudonym(group)] = {"calendars": [
+            {"url": scrubber.text(c['url']),
+             "domain": scrubber.domain(c['domain'])}
+            for c in group_config['calendars']]}
+    cassette = CassetteWriter(path, layout=layout, scrubber=scrubber)
+    domains = {}
+    for name, domain_config in config.domains.iteritems():
+        d = Domain(name, domain_config)
+        d.http = RecordingHttp(d.credentials.authorize(httplib2.Http()),
+                               cassette, tag=scrubber.domain(name))
+        domains[name] = d
+    try:
+        for group, group_config in config.calendars.iteritems():
+            SyncedCalendar(group, group_config, domains=domains).sync()
+    finally:
+        cassette.close()
+    return cassette.records
+
+
+def replay(path, cycles=1):
+    """
+    Rebuild the recorded groups and sync them against the cassette at
+    `path`. Returns (changes, api requests, seconds).
+    """
+    from .domain import Domain
+    from .calendar import SyncedCalendar
+
+    header, records = read_cassette(path)
+    layout = header["layout"]
+    domains = {}
+    for group_config in layout.values():
+        for c in group_config['calendars']:
+            if c['domain'] not in domains:
+                d = Domain(c['domain'], {"account": c['domain']},
+                           authorize=False,
+                           http=ReplayHttp(records, tag=c['domain']))
+                d.batcher.sleep = lambda seconds: None
+                domains[c['domain']] = d
+    start = time.time()
+    groups = [SyncedCalendar(name, group_config, domains=domains)
+              for name, group_config in sorted(layout.iteritems())]
+    changes = 0
+    for i in range(cycles):
+        for group in groups:
+            changes += group.sync()
+    requests = sum(d.http.requests for d in domains.values())
+    return changes, requests, time.time() - start
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 3 and argv[0] == "record":
+        print("Recorded %d exchanges to %s" % (record(argv[1], argv[2]),
+                                               argv[2]))
+    elif len(argv) == 2 and argv[0] == "replay":
+        changes, requests, seconds = replay(argv[1])
+        print("Replayed %d requests (%d changes) in %.2fs" % (
+            requests, changes, seconds))
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+"""
+Bulk seeding of calendars that join an existing group.
+
+A new member calendar would otherwise receive every existing event through
+a separate events().insert, one merge at a time, which is slow and may send
+invitations. A Seeder instead copies the group's events into it with
+events().import, in batches sized by the domain's BatchSizeController and
+sent by several workers at once. Imported IDs are appended to a checkpoint
+file as they're acknowledged, so an interrupted seeding picks up where it
+left off.
+"""
+
+import logging
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from .batch import is_throttle_error
+from .metrics import registry as metrics
+
+DEFAULT_SEED_WORKERS = 4
+
+# Fields the API sets by itself and won't take in an import.
+SEED_DROPPED_FIELDS = ["etag", "htmlLink", "hangoutLink", "creator"]
+
+
+def import_body(event):
+    """
+    The body to import `event` with.
+    """
+    return dict((k, v) for k, v in event.iteritems()
+                if k not in SEED_DROPPED_FIELDS)
+
+
+class Checkpoint:
+    """
+    The IDs already imported into a calendar, kept in a file with one ID
+    per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ids = set()
+        if path and os.path.isfile(path):
+            with open(path) as f:
+                self.ids.update(l.strip() for l in f if l.strip())
+        self.f = open(path, "a") if path else None
+
+    def __contains__(self, id):
+        return id in self.ids
+
+    def add(self, ids):
+        self.ids.update(ids)
+        if self.f:
+            self.f.writelines(id + "\n" for id in ids)
+            self.f.flush()
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+    def remove(self):
+        """
+        Delete the checkpoint, once seeding is complete.
+        """
+        self.close()
+        if self.path and os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class Seeder:
+    """
+    Imports the active events of `sources` (a list of Calendars, whose
+    events have been loaded) that `target` doesn't have yet.
+    """
+
+    def __init__(self, target, sources, workers=DEFAULT_SEED_WORKERS,
+                 checkpoint=None, clock=time.time):
+        self.target = target
+        self.sources = sources
+        self.workers = workers
+        self.checkpoint = Checkpoint(checkpoint)
+        self.clock = clock
+        self.controller = target.domain.batcher.controller
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.imported = 0
+        self.failed = 0
+
+    def pending(self):
+        """
+        The winning version of every active event missing from the target.
+        """
+        winners = {}
+        for cal in self.sources:
+            for id, event in cal.events.iteritems():
+                if id in winners:
+                    winners[id] = max(winners[id], event)
+                else:
+                    winners[id] = event
+        return [e for id, e in sorted(winners.iteritems())
+                if e.active() and id not in self.target.events and
+                id not in self.checkpoint]
+
+    def _service(self):
+        # httplib2 connections can't be shared between threads.
+        if not hasattr(self.local, 'service'):
+            self.local.service = self.target.domain.get_service()
+        return self.local.service
+
+    def _import_batch(self, events):
+        """
+        Import `events` in one batch request. Returns a list of
+        (id, response, exception).
+        """
+        service = self._service()
+        batch = service.new_batch_http_request()
+        results = []
+
+        def callback(id):
+            def done(request_id, response, exception):
+                results.append((id, response, exception))
+            return done
+
+        for e in events:
+            body = import_body(self.target.profile.payload(e))
+            batch.add(service.events().import_(calendarId=self.target.url,
+                                               body=body),
+                      callback=callback(e['id']))
+        start = self.clock()
+        try:
+            batch.execute()
+        except Exception as exception:
+            results = [(e['id'], None, exception) for e in events]
+        with self.lock:
+            self.target.domain.quota.spend(len(events), "import")
+            self.controller.observe(len(events), self.clock() - start,
+                                    len([r for r in results
+                                         if r[2] is not None and
+                                         is_throttle_error(r[2])]))
+        return results
+
+    def _apply(self, results):
+        imported = []
+        for id, response, exception in results:
+            status = getattr(getattr(exception, 'resp', None), 'status', None)
+            if exception is None:
+                self.target.update_events_from_result(response)
+                imported.append(id)
+            elif status == 409:
+                # Already there, e.g. imported by an earlier, interrupted run.
+                imported.append(id)
+            else:
+                logging.warn("Failed to import %s into %s: %r", id,
+                             self.target.name, exception)
+                self.failed += 1
+        self.checkpoint.add(imported)
+        self.imported += len(imported)
+
+    def run(self):
+        """
+        Seed the target. Returns the number of events imported; any that
+        failed are left to the regular sync to insert.
+        """
+        events = self.pending()
+        total = len(events)
+        if not total:
+            self.checkpoint.remove()
+            return 0
+        size = self.controller.size
+        batches = [events[i:i + size] for i in range(0, total, size)]
+        logging.info("Seeding %d events into %s in %d batches of up to %d, "
+                     "%d at a time", total, self.target.name, len(batches),
+                     size, self.workers)
+        start = self.clock()
+        pool = ThreadPool(self.workers)
+        try:
+            for results in pool.imap_unordered(self._import_batch, batches):
+                self._apply(results)
+                elapsed = max(self.clock() - start, 1e-6)
+                metrics.gauge("seed_rate", self.imported / elapsed,
+                              calendar=self.target.url)
+                logging.info("Seeded %d/%d events into %s (%.1f events/s)",
+                             self.imported, total, self.target.name,
+                             self.imported / elapsed)
+        finally:
+            pool.close()
+            pool.join()
+        if self.failed:
+            self.checkpoint.close()
+        else:
+            self.checkpoint.remove()
+        return self.imported
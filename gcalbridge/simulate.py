@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+"""
+Convergence simulation.
+
+A sync keeps going until an iteration changes nothing, and gives up with a
+RuntimeError after ITERATION_LIMIT; merges that never settle only show up
+that way, in production. This module runs a group of calendars, each in a
+domain of its own, against a FakeCalendarAPI in-process, makes random edits
+between syncs (new events, edits, the same event edited on two sides at
+once, cancellations and reschedulings, which bump the sequence number), and
+measures, for each group size:
+
+* how many iterations each sync needed,
+* how many API requests (batched ones counted one by one, like the quota
+  does) each edit cost, per calendar in the group,
+* how much CPU the bridge spent per edit, not counting the fake API's,
+
+and whether every calendar ended up with the same events. Runs with the same
+seed make the same edits in the same order.
+
+    python -m gcalbridge.simulate --sizes 2,5,10,20 --rounds 10 --seed 1
+
+exits with 1 if a group didn't converge or went over the thresholds given
+(see --help).
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import random
+import sys
+import time
+
+from .calendar import SyncedCalendar, ITERATION_LIMIT
+from .domain import Domain
+from .fakeapi import FakeCalendarAPI, FakeHttp
+
+DEFAULT_SIZES = [2, 5, 10, 20]
+DEFAULT_ROUNDS = 10
+# Edits between two syncs.
+DEFAULT_EDITS = 10
+# Events in each calendar before the first sync.
+DEFAULT_EVENTS = 20
+# Simulated seconds between syncs.
+POLL_INTERVAL = 5
+
+# Thresholds for main(); CPU depends on the machine, so has none by default.
+DEFAULT_MAX_ITERATIONS = 3
+DEFAULT_MAX_CALLS = 2.0
+
+# Kinds of edit, and how often they're made relative to each other.
+OPERATIONS = [("create", 3), ("edit", 3), ("concurrent", 2), ("cancel", 1),
+              ("reschedule", 2)]
+
+
+class SimClock:
+    """
+    The fake API's clock, moved on by hand between syncs.
+    """
+
+    def __init__(self, start=None):
+        self.now = time.time() if start is None else start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class Simulation:
+    """
+    A group of `size` calendars holding `events` random events each, synced
+    by a SyncedCalendar and edited at random.
+    """
+
+    def __init__(self, size, events=DEFAULT_EVENTS, seed=0):
+        self.clock = SimClock()
+        self.random = random.Random(seed)
+        self.api = FakeCalendarAPI(seed=seed, clock=self.clock,
+                                   sleep=lambda seconds: None)
+        # CPU spent serving requests, to leave out of the bridge's.
+        self.api_cpu = 0.0
+        handle = self.api.handle
+
+        def timed(*args, **kwargs):
+            start = time.clock()
+            try:
+                return handle(*args, **kwargs)
+            finally:
+                self.api_cpu += time.clock() - start
+        self.api.handle = timed
+
+        self.urls = []
+        domains = {}
+        for i in range(size):
+            d = "d%d.example.com" % i
+            url = "%s_1@resource.calendar.google.com" % d
+            self.api.add_calendar(url, "room@" + d, summary="Room")
+            domains[d] = Domain(d, {"account": "room@" + d},
+                                authorize=False,
+                                http=FakeHttp(self.api, "room@" + d))
+            # Nothing to pace; the API is ours.
+            domains[d].batcher.sleep = lambda seconds: None
+            self.urls.append(url)
+            for j in range(events):
+                self.create(url)
+        self.group = SyncedCalendar("simulation", {
+            "detect_conflicts": False,
+            "calendars": [{"url": url, "domain": url.partition("_")[0]}
+                          for url in self.urls]}, domains=domains)
+
+    def _calendar(self, url=None):
+        return self.api.calendars[url or self.random.choice(self.urls)]
+
+    def _active(self, cal):
+        return sorted(id for id, e in cal.events.iteritems()
+                      if e['status'] != 'cancelled')
+
+    def _change(self, cal, id, **fields):
+        old = cal.events[id]
+        event = dict(old)
+        event.update(fields)
+        self.api._finish(cal, event, previous=old)
+
+    def _summary(self):
+        return "Edited %d" % self.random.randint(0, 10 ** 6)
+
+    def create(self, url=None):
+        event = self.api.random_event()
+        event['id'] = self.api.new_id()
+        self.api._finish(self._calendar(url), event)
+        return 1
+
+    def edit(self):
+        """
+        Make a random edit. Returns the number of events changed.
+        """
+        r = self.random.uniform(0, sum(w for op, w in OPERATIONS))
+        for op, weight in OPERATIONS:
+            r -= weight
+            if r <= 0:
+                break
+        if op == "create":
+            return self.create()
+        cal = self._calendar()
+        active = self._active(cal)
+        if not active:
+            return self.create()
+        id = self.random.choice(active)
+        if op == "edit":
+            self._change(cal, id, summary=self._summary())
+        elif op == "concurrent":
+            others = [self.api.calendars[u] for u in self.urls
+                      if self.api.calendars[u] is not cal and
+                      id in self._active(self.api.calendars[u])]
+            self._change(cal, id, summary=self._summary())
+            if not others:
+                return 1
+            self._change(self.random.choice(others), id,
+                         summary=self._summary())
+            return 2
+        elif op == "cancel":
+            self._change(cal, id, status="cancelled")
+        else:
+            event = cal.events[id]
+            shifted = self.api.random_event()
+            self._change(cal, id, start=shifted['start'], end=shifted['end'],
+                         sequence=event['sequence'] + 1)
+        return 1
+
+    def requests(self):
+        return sum(self.api.requests.values())
+
+    def sync(self):
+        """
+        Sync the group. Returns the iterations it took (ITERATION_LIMIT + 1
+        if it gave up), the API requests it made, and the CPU seconds the
+        bridge spent.
+        """
+        requests = self.requests()
+        cpu, api_cpu = time.clock(), self.api_cpu
+        try:
+            self.group.sync()
+            iterations = self.group.iterations
+        except RuntimeError:
+            iterations = ITERATION_LIMIT + 1
+        cpu = (time.clock() - cpu) - (self.api_cpu - api_cpu)
+        return iterations, self.requests() - requests, cpu
+
+    def divergent(self):
+        """
+        IDs of the events that aren't the same in every calendar.
+        """
+        ids = set()
+        for url in self.urls:
+            ids.update(self.api.calendars[url].events)
+        divergent = []
+        for id in sorted(ids):
+            versions = set()
+            for url in self.urls:
+                event = self.api.calendars[url].events.get(id)
+                if event is None or event['status'] == 'cancelled':
+                    versions.add(None)
+                else:
+                    versions.add(self.group.profile.event(event).ehash())
+            if len(versions) > 1:
+                divergent.append(id)
+        return divergent
+
+
+def simulate(size, rounds=DEFAULT_ROUNDS, edits=DEFAULT_EDITS,
+             events=DEFAULT_EVENTS, seed=0):
+    """
+    Simulate a group of `size` calendars for `rounds` rounds of `edits`
+    edits and a sync. Returns the measurements, as a dict.
+    """
+    sim = Simulation(size, events=events, seed=seed)
+    first, requests, cpu = sim.sync()
+    iterations = []
+    made = 0
+    requests = 0
+    cpu = 0.0
+    unconverged = 0
+    for i in range(rounds):
+        for j in range(edits):
+            made += sim.edit()
+        sim.clock.advance(POLL_INTERVAL)
+        n, r, c = sim.sync()
+        iterations.append(n)
+        requests += r
+        cpu += c
+        if n > ITERATION_LIMIT or sim.divergent():
+            unconverged += 1
+    return {
+        "size": size,
+        "edits": made,
+        "first_iterations": first,
+        "max_iterations": max(iterations) if iterations else first,
+        "mean_iterations": (sum(iterations) / float(len(iterations))
+                            if iterations else first),
+        "calls_per_edit": (requests / float(made * size) if made else 0),
+        "cpu_per_edit": cpu / made if made else 0,
+        "unconverged": unconverged + bool(sim.divergent()),
+    }
+
+
+def regressions(result, max_iterations=DEFAULT_MAX_ITERATIONS,
+                max_calls=DEFAULT_MAX_CALLS, max_cpu=None):
+    """
+    What's wrong with a simulate() result, as a list of messages.
+    """
+    problems = []
+    if result["unconverged"]:
+        problems.append("%d rounds didn't converge" % result["unconverged"])
+    if max_iterations is not None and \
+            result["max_iterations"] > max_iterations:
+        problems.append("%d iterations (at most %d)" % (
+            result["max_iterations"], max_iterations))
+    if max_calls is not None and result["calls_per_edit"] > max_calls:
+        problems.append("%.2f requests per edit per calendar (at most %.2f)"
+                        % (result["calls_per_edit"], max_calls))
+    if max_cpu is not None and result["cpu_per_edit"] > max_cpu:
+        problems.append("%.2fms CPU per edit (at most %.2fms)" % (
+            result["cpu_per_edit"] * 1000, max_cpu * 1000))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Simulate syncing groups of calendars under random "
+        "edits, and check that they converge cheaply.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Group sizes to simulate, comma-separated.")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--edits", type=int, default=DEFAULT_EDITS,
+                        help="Edits between two syncs.")
+    parser.add_argument("--events", type=int, default=DEFAULT_EVENTS,
+                        help="Events in each calendar to start with.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-iterations", type=int,
+                        default=DEFAULT_MAX_ITERATIONS,
+                        help="Most iterations a sync may take.")
+    parser.add_argument("--max-calls", type=float, default=DEFAULT_MAX_CALLS,
+                        help="Most API requests per edit per calendar.")
+    parser.add_argument("--max-cpu", type=float, default=None,
+                        help="Most CPU milliseconds per edit.")
+    args = parser.parse_args(argv)
+
+    failed = False
+    print("%5s %6s %6s %6s %9s %9s %11s" % (
+        "size", "edits", "first", "iters", "max iters", "req/edit",
+        "cpu ms/edit"))
+    for size in [int(s) for s in args.sizes.split(",")]:
+        result = simulate(size, rounds=args.rounds, edits=args.edits,
+                          events=args.events, seed=args.seed)
+        print("%5d %6d %6d %6.2f %9d %9.2f %11.2f" % (
+            size, result["edits"], result["first_iterations"],
+            result["mean_iterations"], result["max_iterations"],
+            result["calls_per_edit"], result["cpu_per_edit"] * 1000))
+        for problem in regressions(
+                result, max_iterations=args.max_iterations,
+                max_calls=args.max_calls,
+                max_cpu=args.max_cpu / 1000.0 if args.max_cpu else None):
+            print("  size %d: %s" % (size, problem))
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARN)
+    sys.exit(main())
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+"""
+Storage engines for a Calendar's events.
+
+Both engines behave like the plain dict Calendar.events used to be, and
+additionally remember the cycle in which each event was last stored so that
+merges only have to look at events that changed.
+"""
+
+import json
+import logging
+import sqlite3
+from collections import defaultdict, OrderedDict
+
+DEFAULT_CACHE_SIZE = 1024
+MIN_CACHE_SIZE = 128
+
+
+class EventStore(dict):
+    """
+    Keeps every event in memory.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(EventStore, self).__init__(*args, **kwargs)
+        self.cycle = 0
+        # Called with (id, event) whenever an event is stored, and with
+        # (id, None) when one is discarded; see mergeindex.py.
+        self.listener = None
+        self._cycle_of = dict((k, 0) for k in self)
+        self._by_cycle = defaultdict(set)
+        self._by_cycle[0].update(self)
+        # Discarded ID -> cycle in which it was discarded, once someone keeps
+        # track; see keep_discarded.
+        self._discarded = None
+
+    def __setitem__(self, k, v):
+        dict.__setitem__(self, k, v)
+        old = self._cycle_of.get(k)
+        if old is not None and old != self.cycle:
+            self._by_cycle[old].discard(k)
+            if not self._by_cycle[old]:
+                del self._by_cycle[old]
+        self._cycle_of[k] = self.cycle
+        self._by_cycle[self.cycle].add(k)
+        if self._discarded:
+            self._discarded.pop(k, None)
+        if self.listener:
+            self.listener(k, v)
+
+    def discard(self, k):
+        """
+        Forget event `k`, if we have it.
+        """
+        if dict.pop(self, k, None) is None:
+            return
+        old = self._cycle_of.pop(k)
+        self._by_cycle[old].discard(k)
+        if not self._by_cycle[old]:
+            del self._by_cycle[old]
+        if self._discarded is not None:
+            self._discarded[k] = self.cycle
+        if self.listener:
+            self.listener(k, None)
+
+    def new_cycle(self):
+        """
+        Start a new cycle; everything stored from now on is considered
+        changed since the returned cycle number.
+        """
+        self.cycle += 1
+        return self.cycle
+
+    def changed_since(self, cycle):
+        """
+        IDs of the events stored during or after `cycle`.
+        """
+        ids = set()
+        for c, changed in self._by_cycle.items():
+            if c >= cycle:
+                ids.update(changed)
+        return ids
+
+    def keep_discarded(self, since):
+        """
+        Keep track of the events discarded from cycle `since` on, for
+        discarded_since, and forget those discarded before.
+        """
+        if self._discarded is None:
+            self._discarded = {}
+        for k, c in self._discarded.items():
+            if c < since:
+                del self._discarded[k]
+
+    def discarded_since(self, cycle):
+        """
+        IDs of the events discarded during or after `cycle`, and not stored
+        again since, as far as we've kept track.
+        """
+        return [k for k, c in (self._discarded or {}).iteritems()
+                if c >= cycle]
+
+    def dirty_items(self):
+        """
+        (id, event) pairs for events with local modifications.
+        """
+        return [(k, v) for k, v in self.iteritems() if v.dirty]
+
+    def close(self):
+        pass
+
+
+class SqliteEventStore:
+    """
+    Keeps events in a SQLite database, indexed by ID and by the cycle in
+    which they last changed, with the most recently used events cached in
+    memory.
+
+    Events handed out by indexing stay cached until evicted, and are written
+    back on eviction if they were modified in place. Events produced while
+    iterating over the whole store are read-only copies.
+    """
+
+    def __init__(self, path, cache_size=DEFAULT_CACHE_SIZE, event_class=None):
+        if event_class is None:
+            from .calendar import Event
+            event_class = Event
+        self.path = path
+        self.event_class = event_class
+        self.cache_size = max(cache_size, MIN_CACHE_SIZE)
+        self.cache = OrderedDict()
+        self._unsynced = set()
+        self.listener = None
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS events ("
+                        "id TEXT PRIMARY KEY, body TEXT NOT NULL, "
+                        "dirty INTEGER NOT NULL DEFAULT 0, "
+                        "cycle INTEGER NOT NULL DEFAULT 0)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS events_cycle "
+                        "ON events (cycle)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS events_dirty "
+                        "ON events (dirty)")
+        self.cycle = self.db.execute(
+            "SELECT COALESCE(MAX(cycle), 0) FROM events").fetchone()[0]
+        logging.debug("Opened event store %s at cycle %d", path, self.cycle)
+
+    def _load(self, row):
+        event = self.event_class(json.loads(row[0]))
+        event.dirty = bool(row[1])
+        return event
+
+    def _write(self, k, v, cycle=None):
+        if cycle is None:
+            self.db.execute("UPDATE events SET body = ?, dirty = ? "
+                            "WHERE id = ?", (json.dumps(v), int(v.dirty), k))
+        else:
+            self.db.execute("INSERT OR REPLACE INTO events "
+                            "(id, body, dirty, cycle) VALUES (?, ?, ?, ?)",
+                            (k, json.dumps(v), int(v.dirty), cycle))
+
+    def _cache(self, k, v):
+        self.cache.pop(k, None)
+        self.cache[k] = v
+        while len(self.cache) > self.cache_size:
+            old_k, old_v = self.cache.popitem(last=False)
+            if old_v.dirty or old_k in self._unsynced:
+                self._write(old_k, old_v)
+                self._unsynced.discard(old_k)
+
+    def __getitem__(self, k):
+        if k in self.cache:
+            v = self.cache.pop(k)
+            self.cache[k] = v
+            return v
+        row = self.db.execute("SELECT body, dirty FROM events WHERE id = ?",
+                              (k,)).fetchone()
+        if row is None:
+            raise KeyError(k)
+        v = self._load(row)
+        if v.dirty:
+            self._unsynced.add(k)
+        self._cache(k, v)
+        return v
+
+    def __setitem__(self, k, v):
+        self._write(k, v, cycle=self.cycle)
+        self._unsynced.discard(k)
+        self._cache(k, v)
+        if self.listener:
+            self.listener(k, v)
+
+    def __contains__(self, k):
+        if k in self.cache:
+            return True
+        return self.db.execute("SELECT 1 FROM events WHERE id = ?",
+                               (k,)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def discard(self, k):
+        """
+        Forget event `k`, if we have it.
+        """
+        self.cache.pop(k, None)
+        self._unsynced.discard(k)
+        self.db.execute("DELETE FROM events WHERE id = ?", (k,))
+        if self.listener:
+            self.listener(k, None)
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def iterkeys(self):
+        for row in self.db.execute("SELECT id FROM events"):
+            yield row[0]
+
+    def iteritems(self):
+        for row in self.db.execute("SELECT id, body, dirty FROM events"):
+            if row[0] in self.cache:
+                yield row[0], self.cache[row[0]]
+            else:
+                yield row[0], self._load(row[1:])
+
+    def itervalues(self):
+        for k, v in self.iteritems():
+            yield v
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def new_cycle(self):
+        """
+        Write back cached modifications and start a new cycle.
+        """
+        self.flush()
+        self.cycle += 1
+        return self.cycle
+
+    def changed_since(self, cycle):
+        """
+        IDs of the events stored during or after `cycle`.
+        """
+        return set(row[0] for row in self.db.execute(
+            "SELECT id FROM events WHERE cycle >= ?", (cycle,)))
+
+    def dirty_items(self):
+        """
+        (id, event) pairs for events with local modifications. The events
+        are cached, so changes made to them are kept.
+        """
+        ids = set(k for k, v in self.cache.iteritems() if v.dirty)
+        ids.update(row[0] for row in self.db.execute(
+            "SELECT id FROM events WHERE dirty = 1"))
+        items = []
+        for k in ids:
+            v = self[k]
+            if v.dirty:
+                self._unsynced.add(k)
+                items.append((k, v))
+        return items
+
+    def flush(self):
+        """
+        Write back every cached event that was modified in place.
+        """
+        for k, v in self.cache.iteritems():
+            if v.dirty or k in self._unsynced:
+                self._write(k, v)
+        self._unsynced.clear()
+        self.db.commit()
+
+    def close(self):
+        self.flush()
+        self.db.close()
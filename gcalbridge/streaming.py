@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""
+Listing pages parsed one event at a time.
+
+apiclient parses a whole page of events into a list of dicts before we see
+any of it, and we then copy every one of them into an Event. For a large
+calendar's first sync that's several copies of every page alive at once.
+A StreamedPage instead keeps the page's text, as the bytes it came in, and
+parses its items one at a time, as they're iterated over, straight into the
+Event class in use, so only the text and the event being stored are in
+memory at any moment. The text is let go of once the items have been read.
+"""
+
+import json
+import re
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+decoder = json.JSONDecoder()
+
+
+class StreamedPage:
+    """
+    A page of a list response. Behaves like the parsed response for the
+    few things we ask of it: `get("items")` returns a generator of items
+    wrapped with `wrap`, which can be read once; other members are looked
+    up as usual.
+    """
+
+    def __init__(self, content, wrap=None):
+        # Left as it is: the decoder reads UTF-8 as well as unicode, and a
+        # decoded copy would take up to four times the space.
+        self.content = content
+        self.wrap = wrap
+        self.meta = {}
+        self.done = False
+        i = self._skip(0)
+        if content[i] != "{":
+            raise ValueError("Expected an object at %d" % i)
+        # Where the items array starts, if there is one.
+        self.items_at = self._members(i + 1)
+
+    def _skip(self, i):
+        return WHITESPACE.match(self.content, i).end()
+
+    def _members(self, i):
+        """
+        Parse members from `i` on, up to the items (whose position is
+        returned) or the end of the object.
+        """
+        s = self.content
+        while True:
+            i = self._skip(i)
+            if s[i] == "}":
+                self.done = True
+                return None
+            if s[i] == ",":
+                i = self._skip(i + 1)
+            key, i = decoder.raw_decode(s, i)
+            i = self._skip(i)
+            if s[i] != ":":
+                raise ValueError("Expected ':' at %d" % i)
+            i = self._skip(i + 1)
+            if key == "items":
+                return i
+            self.meta[key], i = decoder.raw_decode(s, i)
+
+    def _items(self, read=True):
+        """
+        The items, wrapped, if `read`; otherwise just parse past them.
+        """
+        if self.items_at is None:
+            return
+        s = self.content
+        if s is None:
+            raise RuntimeError("Items of a streamed page can only be read "
+                               "once")
+        i = self._skip(self.items_at)
+        if s[i] != "[":
+            raise ValueError("Expected an array at %d" % i)
+        i = self._skip(i + 1)
+        if s[i] == "]":
+            i += 1
+        else:
+            while True:
+                item, i = decoder.raw_decode(s, i)
+                if read:
+                    yield self.wrap(item) if self.wrap else item
+                i = self._skip(i)
+                if s[i] == "]":
+                    i += 1
+                    break
+                if s[i] != ",":
+                    raise ValueError("Expected ',' at %d" % i)
+                i = self._skip(i + 1)
+        if not self.done:
+            # Whatever comes after the items, e.g. nextSyncToken.
+            self._members(i)
+        if read:
+            self.content = None
+
+    def _parse_all(self):
+        """
+        Parse the members after the items without reading the items, for
+        someone asking for one before they've been read.
+        """
+        for item in self._items(read=False):
+            pass
+
+    def get(self, key, default=None):
+        if key == "items":
+            return self._items() if self.items_at is not None else default
+        if key not in self.meta and not self.done:
+            self._parse_all()
+        return self.meta.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        if key == "items":
+            return self.items_at is not None
+        return self.get(key, self) is not self
+
+
+def stream(request, wrap=None):
+    """
+    Make `request`, a list request, return a StreamedPage when executed.
+    """
+    request.postproc = lambda resp, content: StreamedPage(content, wrap)
+    return request
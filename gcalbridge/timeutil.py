@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""
+Helpers for the timestamps found in Calendar API resources.
+"""
+
+from __future__ import absolute_import
+
+import calendar
+import re
+import time
+
+RFC3339_RE = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[Tt ](\d{2}):(\d{2}):(\d{2})(\.\d+)?(Z|z|[+-]\d{2}:?\d{2})?)?$")
+
+
+def parse_rfc3339(value):
+    """
+    Convert an RFC 3339 timestamp (or a bare date, taken as midnight UTC) to
+    seconds since the epoch. Returns None if `value` can't be parsed.
+    """
+    m = RFC3339_RE.match(value or "")
+    if not m:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = m.groups()
+    t = calendar.timegm((int(year), int(month), int(day), int(hour or 0),
+                         int(minute or 0), int(second or 0), 0, 0, 0))
+    if fraction:
+        t += float(fraction)
+    if offset and offset not in "Zz":
+        sign = -1 if offset[0] == "-" else 1
+        digits = offset[1:].replace(":", "")
+        t -= sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+    return t
+
+
+def event_time(when):
+    """
+    Seconds since the epoch for an event's `start` or `end`, which holds
+    either a `dateTime` or an all-day `date`.
+    """
+    if not when:
+        return None
+    return parse_rfc3339(when.get('dateTime') or when.get('date'))
+
+
+def format_rfc3339(t):
+    """
+    Format seconds since the epoch as an RFC 3339 UTC timestamp.
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) + \
+        ".%03dZ" % (int(t * 1000) % 1000)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+Trace how long changes take to propagate from one calendar to another.
+
+For each change we see, we note the source event's `updated` time, when we
+asked for it and when we got it. When a merge picks it as the winning
+version and writes it to other calendars, we note when each write was
+queued, sent and acknowledged. That gives the end-to-end latency per
+(source, target) pair, split into phases:
+
+    poll wait   updated -> the fetch that returned the change started
+    fetch       fetch started -> change seen
+    merge       change seen -> merge decided to write it
+    queue       write queued -> batch sent
+    write       batch sent -> write acknowledged
+"""
+
+import logging
+import time
+
+from .metrics import registry as metrics
+from .timeutil import parse_rfc3339
+
+DEFAULT_SLOW_PROPAGATION = 300
+PHASES = ["poll_wait", "fetch", "merge", "queue", "write"]
+
+
+class Trace:
+    def __init__(self, source, updated, fetched, seen):
+        self.source = source
+        self.updated = updated
+        self.fetched = fetched
+        self.seen = seen
+        self.merged = None
+        self.outstanding = 0
+
+
+class PropagationTracer:
+    """
+    Follows changes through a SyncedCalendar. Calendars report what they
+    see and write; completed propagations go into the
+    `propagation_latency{source,target}` histogram, and ones slower than
+    `slow` seconds are logged with their phase breakdown.
+    """
+
+    def __init__(self, group=None, slow=DEFAULT_SLOW_PROPAGATION,
+                 clock=time.time):
+        self.group = group
+        self.slow = slow
+        self.clock = clock
+        self.traces = {}
+
+    def seen(self, calendar, event, fetched):
+        """
+        `calendar` fetched a changed `event`, in a request started at
+        `fetched`.
+        """
+        updated = parse_rfc3339(event.get('updated'))
+        if updated is None:
+            return
+        self.traces[event['id']] = Trace(calendar.name, updated, fetched,
+                                         self.clock())
+
+    def merged(self, id, source):
+        """
+        A merge picked `source`'s version of event `id`, and is about to
+        write it wherever it's out of date.
+        """
+        trace = self.traces.get(id)
+        if trace is None:
+            return
+        if source is None or trace.source != source.name:
+            # Nothing will propagate from the change we saw.
+            del self.traces[id]
+            return
+        trace.merged = self.clock()
+
+    def queued(self, id):
+        """
+        A write of event `id` was queued.
+        """
+        trace = self.traces.get(id)
+        if trace is not None and trace.merged is not None:
+            trace.outstanding += 1
+
+    def settle(self, id):
+        """
+        The merge of event `id` is done; forget it if it wrote nothing.
+        """
+        trace = self.traces.get(id)
+        if trace is not None and trace.outstanding <= 0:
+            del self.traces[id]
+
+    def acked(self, calendar, id, queued, sent):
+        """
+        `calendar` acknowledged a write of event `id` that was queued at
+        `queued` and sent at `sent`.
+        """
+        trace = self.traces.get(id)
+        if trace is None or trace.merged is None:
+            return
+        now = self.clock()
+        phases = dict(zip(PHASES, [
+            trace.fetched - trace.updated,
+            trace.seen - trace.fetched,
+            trace.merged - trace.seen,
+            sent - queued,
+            now - sent,
+        ]))
+        latency = now - trace.updated
+        metrics.observe("propagation_latency", latency, source=trace.source,
+                        target=calendar.name)
+        if latency > self.slow:
+            logging.warn("Slow propagation of %s from %s to %s: %.1fs (%s)",
+                         id, trace.source, calendar.name, latency,
+                         ", ".join("%s %.1fs" % (p, phases[p])
+                                   for p in PHASES))
+        trace.outstanding -= 1
+        if trace.outstanding <= 0:
+            del self.traces[id]
+        return latency
+
+    def failed(self, id):
+        """
+        A write of event `id` failed; it'll be retried by a later merge.
+        """
+        self.traces.pop(id, None)
+
+    def reset(self):
+        """
+        Forget everything in flight, e.g. after a failed sync.
+        """
+        self.traces.clear()
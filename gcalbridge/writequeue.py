@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Outbound writes of a single Calendar.
+
+Within a sync, the same event can be written more than once: by a merge,
+and again by push_events if the merge modified it. While a batch is open, a
+Calendar therefore queues its writes here. Writes to the same event are
+coalesced into one, and when the batch is committed the queue is drained
+into the domain's BatchCoordinator (and with it, its rate limiting) most
+urgent first: events that are about to happen or are happening now, then
+later ones, then those already over; among equals, the most recently
+changed first.
+"""
+
+import time
+
+from .timeutil import event_time, parse_rfc3339
+
+INSERT = "insert"
+UPDATE = "update"
+PATCH = "patch"
+
+# Added to the priority of events that are already over, so they go after
+# everything that's still to come.
+PAST_PENALTY = 10 * 365 * 24 * 3600
+
+
+def newer(old, new):
+    """
+    The newer of two versions of an event. Events know how to compare (see
+    Event.__cmp__); otherwise the later write wins.
+    """
+    if hasattr(old, 'ehash') and hasattr(new, 'ehash') and new < old:
+        return old
+    return new
+
+
+def priority(event, now):
+    """
+    Sort key for a write of `event`; lower goes first.
+    """
+    start = event_time(event.get('start'))
+    end = event_time(event.get('end')) or start
+    if start is None:
+        distance = PAST_PENALTY * 2
+    elif end >= now:
+        distance = max(0, start - now)
+    else:
+        distance = PAST_PENALTY + now - end
+    return (distance, -(parse_rfc3339(event.get('updated')) or 0))
+
+
+class Write:
+    def __init__(self, kind, event_id, body, queued):
+        self.kind = kind
+        self.event_id = event_id
+        self.body = body
+        self.queued = queued
+
+
+class WriteQueue:
+    """
+    Pending writes, at most one per event ID.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.writes = {}
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.writes)
+
+    def put(self, kind, event_id, body):
+        """
+        Queue a write. Returns False if it was folded into a write already
+        queued for the same event.
+        """
+        if event_id is None:
+            # Inserts that leave the ID to the server can't be coalesced.
+            self.writes[object()] = Write(kind, event_id, body, self.clock())
+            return True
+        old = self.writes.get(event_id)
+        if old is None:
+            self.writes[event_id] = Write(kind, event_id, body, self.clock())
+            return True
+        self.coalesced += 1
+        if kind == PATCH:
+            merged = dict(old.body)
+            merged.update(body)
+            old.body = type(old.body)(merged)
+        else:
+            old.body = newer(old.body, body)
+            if old.kind != INSERT:
+                # An event that isn't there yet has to be inserted, whatever
+                # came after; otherwise a full update supersedes a patch.
+                old.kind = kind
+        return False
+
+    def drain(self):
+        """
+        Remove and return every queued write, most urgent first.
+        """
+        now = self.clock()
+        writes = sorted(self.writes.values(),
+                        key=lambda w: priority(w.body, now))
+        self.writes = {}
+        return writes
+
+    def clear(self):
+        """
+        Forget every queued write. Returns the writes that were dropped.
+        """
+        writes, self.writes = self.writes.values(), {}
+        return writes
@@ -11,32 +11,72 @@ import json
 import time
 import logging
 import os
+import signal
 
 import gcalbridge
+from gcalbridge.health import HealthServer
+from gcalbridge.ha import HighAvailability
+from gcalbridge.errors import BadConfigError
+from gcalbridge.logs import configure, DEFAULT_FORMAT
 
-FORMAT = "[%(levelname)-8s:%(filename)-15s:%(lineno)4s: %(funcName)20.20s ] %(message)s"
-logging.basicConfig(format=FORMAT, level=logging.DEBUG)
+logging.basicConfig(format=DEFAULT_FORMAT, level=logging.DEBUG)
 
 def main():
 
     config = gcalbridge.config.Config("config.json")
+    configure(config.logging)
     calendars = config.setup()
 
+    if config.health_port:
+        HealthServer(lambda: calendars,
+                     (config.health_address, config.health_port),
+                     slo=config.health_slo).start()
+
+    ha = None
+    if config.ha is not None:
+        # Wait on standby until no other process is syncing.
+        ha = HighAvailability(config.ha, calendars)
+        ha.become_active()
+
     sleep_time = config.poll_time
     exception_count = 0
 
+    # Reload config.json on SIGHUP, or whenever it changes.
+    reload_requested = []
+    signal.signal(signal.SIGHUP, lambda signum, frame:
+                  reload_requested.append(signum))
+
     while True:
-        try:
-            for cal in calendars:
+        if reload_requested or config.changed():
+            del reload_requested[:]
+            try:
+                settings = config.logging
+                calendars = config.reload()
+                if ha:
+                    ha.groups = calendars
+                if config.logging != settings:
+                    configure(config.logging)
+            except (BadConfigError, RuntimeError, ValueError, HttpError) as e:
+                logging.error("Not reloading %s: %r", config.filename, e)
+        # Failing domains are quarantined by their circuit breakers inside
+        # sync(), so errors that get here are unusual. Keep going with the
+        # other groups regardless.
+        for cal in calendars:
+            try:
                 calendars[cal].sync()
                 exception_count = 0
-        except HttpError as e:
-            if e.resp.reason in ['userRateLimitExceeded', 'quotaExceeded',
-                                'internalServerError', 'backendError']:
-                exception_count += 1
-                logging.error(repr(e))
-                if exception_count >= config.max_exceptions:
-                    break
+                if ha:
+                    ha.checkpoint(calendars[cal])
+            except HttpError as e:
+                if e.resp.reason in ['userRateLimitExceeded', 'quotaExceeded',
+                                    'internalServerError', 'backendError']:
+                    exception_count += 1
+                    logging.error(repr(e))
+        # Keep quota counters across restarts.
+        for domain in config.running_domains.values():
+            domain.quota.save()
+        if exception_count >= config.max_exceptions:
+            break
         logging.debug("---------- %d %d", config.poll_time, exception_count)
         time.sleep(config.poll_time * 2 ** exception_count)
 
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+""" Batch tests
+
+Unit tests for batch module"""
+
+import json
+import unittest
+from apiclient.errors import HttpError
+from httplib2 import Response
+from gcalbridge import batch
+from gcalbridge.metrics import registry
+
+
+class FakeBatch:
+    def __init__(self, log):
+        self.log = log
+        self.requests = []
+
+    def add(self, action, callback=None):
+        self.requests.append((action, callback))
+
+    def execute(self):
+        self.log.append([a for a, _ in self.requests])
+        for i, (action, callback) in enumerate(self.requests):
+            if isinstance(action, Exception):
+                callback(str(i), None, action)
+            else:
+                callback(str(i), {"items": [action]}, None)
+
+
+class FakeService:
+    def __init__(self, log):
+        self.log = log
+
+    def new_batch_http_request(self):
+        return FakeBatch(self.log)
+
+
+class FakeCalendar:
+    def __init__(self, log):
+        self.service = FakeService(log)
+        self.ratelimit = 0
+        self.results = []
+
+    def callback(self, request_id, response, exception):
+        if exception is not None:
+            # As Calendar's does.
+            raise exception
+        self.results.extend(response['items'])
+
+
+class BatchCoordinatorTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        controller = batch.BatchSizeController("foo.com", min_size=1,
+                                               max_size=5, initial=5)
+        self.coordinator = batch.BatchCoordinator("foo.com", controller)
+        self.cals = [FakeCalendar(self.sent) for i in range(3)]
+
+    def test_packs_calendars_together(self):
+        for c in self.cals:
+            self.coordinator.begin(c)
+        for i, c in enumerate(self.cals):
+            self.coordinator.add(c, "action-%d" % i, c.callback)
+        for c in self.cals[:-1]:
+            self.coordinator.commit(c)
+            self.assertEqual(self.sent, [])
+        self.coordinator.commit(self.cals[-1])
+        self.assertEqual(self.sent, [["action-0", "action-1", "action-2"]])
+
+    def test_callbacks_routed(self):
+        for c in self.cals:
+            self.coordinator.begin(c)
+            self.coordinator.add(c, c, c.callback)
+        for c in self.cals:
+            self.coordinator.commit(c)
+        for c in self.cals:
+            self.assertEqual(c.results, [c])
+
+    def test_full_batch_sent_early(self):
+        c = self.cals[0]
+        self.coordinator.begin(c)
+        for i in range(7):
+            self.coordinator.add(c, i, c.callback)
+        self.assertEqual(self.sent, [[0, 1, 2, 3, 4]])
+        self.coordinator.commit(c)
+        self.assertEqual(self.sent, [[0, 1, 2, 3, 4], [5, 6]])
+        self.assertEqual(self.coordinator.actions_sent, 7)
+        self.assertEqual(c.results, list(range(7)))
+
+    def test_one_part_throttled(self):
+        controller = batch.BatchSizeController("foo.com", max_size=100,
+                                               initial=50, step=10)
+        coordinator = batch.BatchCoordinator("foo.com", controller)
+        c = self.cals[0]
+        error = throttle_error()
+        coordinator.begin(c)
+        for i in range(50):
+            coordinator.add(c, error if i == 10 else i, c.callback)
+        coordinator.commit(c)
+        # Everything else was delivered, and 1 in 50 is few enough to grow.
+        self.assertEqual(len(c.results), 49)
+        self.assertEqual(coordinator.failures(c), [error])
+        self.assertEqual(coordinator.failures(c), [])
+        self.assertEqual(controller.size, 60)
+
+    def test_commit_without_actions(self):
+        c = self.cals[0]
+        self.coordinator.begin(c)
+        self.coordinator.commit(c)
+        self.assertEqual(self.sent, [])
+
+
+def throttle_error(status=403, reason="rateLimitExceeded"):
+    content = json.dumps({"error": {"errors": [{"reason": reason}]}})
+    return HttpError(Response({"status": status}), content)
+
+
+class BatchSizeControllerTest(unittest.TestCase):
+    def setUp(self):
+        registry.reset()
+        self.controller = batch.BatchSizeController(
+            "foo.com", min_size=10, max_size=100, initial=50, step=10)
+
+    def test_additive_increase(self):
+        self.controller.observe(50, 1.0, 0)
+        self.assertEqual(self.controller.size, 60)
+        for i in range(10):
+            self.controller.observe(50, 1.0, 0)
+        self.assertEqual(self.controller.size, 100)
+
+    def test_multiplicative_decrease_on_errors(self):
+        self.controller.observe(50, 1.0, 10)
+        self.assertEqual(self.controller.size, 25)
+        for i in range(5):
+            self.controller.observe(50, 1.0, 10)
+        self.assertEqual(self.controller.size, 10)
+
+    def test_decrease_on_latency(self):
+        self.controller.observe(50, 60.0, 0)
+        self.assertEqual(self.controller.size, 25)
+
+    def test_size_history(self):
+        self.controller.observe(50, 1.0, 0)
+        self.controller.observe(50, 1.0, 10)
+        self.assertEqual([v for t, v in
+                          registry.history("batch_size", domain="foo.com")],
+                         [50, 60, 30])
+
+    def test_from_config(self):
+        c = batch.BatchSizeController.from_config("foo.com", {
+            "min_batch_size": 5, "max_batch_size": 20})
+        self.assertEqual((c.min_size, c.max_size, c.size), (5, 20, 20))
+
+    def test_is_throttle_error(self):
+        self.assertTrue(batch.is_throttle_error(throttle_error()))
+        self.assertTrue(batch.is_throttle_error(throttle_error(status=503)))
+        self.assertFalse(batch.is_throttle_error(
+            throttle_error(reason="forbidden")))
+        self.assertFalse(batch.is_throttle_error(
+            throttle_error(status=404, reason="notFound")))
+        self.assertFalse(batch.is_throttle_error(RuntimeError()))
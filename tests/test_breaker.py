@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+""" Breaker tests
+
+Unit tests for breaker module"""
+
+import json
+import unittest
+import gcalbridge
+import httplib2
+from apiclient.discovery import build
+from gcalbridge import breaker, fakeapi
+
+
+class FakeClock:
+    def __init__(self, now=1470000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Error(Exception):
+    def __init__(self, status, reason=None):
+        self.resp = httplib2.Response({"status": status})
+        self.content = json.dumps({"error": {"errors": [{"reason": reason}]}})
+
+
+class FlakyHttp(fakeapi.FakeHttp):
+    """
+    Fails every API request with a 503 while `down` is set.
+    """
+    down = False
+
+    def request(self, uri, *args, **kwargs):
+        if self.down and "/discovery/" not in uri:
+            resp = httplib2.Response({"status": 503,
+                                      "content-type": "application/json"})
+            return resp, json.dumps({"error": {"code": 503,
+                                               "message": "Backend Error"}})
+        return fakeapi.FakeHttp.request(self, uri, *args, **kwargs)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = breaker.CircuitBreaker("foo.com", threshold=2,
+                                              timeout=60, clock=self.clock)
+
+    def test_domain_failures(self):
+        self.assertTrue(breaker.is_domain_failure(Error(503)))
+        self.assertTrue(breaker.is_domain_failure(Error(401)))
+        self.assertFalse(breaker.is_domain_failure(Error(404)))
+        self.assertTrue(breaker.is_domain_failure(
+            Error(403, "dailyLimitExceeded")))
+        self.assertFalse(breaker.is_domain_failure(Error(403, "forbidden")))
+        self.assertFalse(breaker.is_domain_failure(Error(429)))
+        self.assertTrue(breaker.is_domain_failure(
+            httplib2.ServerNotFoundError()))
+        self.assertFalse(breaker.is_domain_failure(ValueError()))
+
+    def test_opens_after_threshold(self):
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.success()
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.state, breaker.OPEN)
+
+    def test_half_open_probe(self):
+        self.breaker.failure()
+        self.breaker.failure()
+
+        def fail():
+            raise Error(503)
+        self.assertFalse(self.breaker.probe(fail))
+        self.clock.now += 60
+        self.assertFalse(self.breaker.probe(fail))
+        # Failed probes keep us open for longer.
+        self.assertEqual(self.breaker.timeout, 120)
+        self.clock.now += 60
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 60
+        self.assertTrue(self.breaker.probe(lambda: None))
+        self.assertEqual(self.breaker.state, breaker.CLOSED)
+        self.assertEqual(self.breaker.timeout, 60)
+
+
+class QuarantineTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        self.clock = FakeClock()
+        self.urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                     "bar.com": "bar.com_1@resource.calendar.google.com",
+                     "baz.com": "baz.com_1@resource.calendar.google.com"}
+        self.domains = {}
+        for d, url in self.urls.items():
+            self.api.add_calendar(url, "room@" + d, summary="Room")
+            domain = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d, "breaker_threshold": 1},
+                authorize=False, http=FlakyHttp(self.api, "room@" + d))
+            domain.breaker.clock = self.clock
+            self.domains[d] = domain
+        self.group = gcalbridge.calendar.SyncedCalendar("room", {
+            "calendars": [{"url": url, "domain": d}
+                          for d, url in sorted(self.urls.items())]},
+            domains=self.domains)
+
+    def add_event(self, domain):
+        event = self.api.random_event()
+        event['id'] = self.api.new_id()
+        self.api._finish(self.api.calendars[self.urls[domain]], event)
+        return event['id']
+
+    def test_failing_domain_quarantined(self):
+        self.group.sync()
+        self.domains["bar.com"].http.down = True
+        eid = self.add_event("foo.com")
+        self.group.sync()
+        self.assertEqual([c.domain_id for c in self.group.quarantined],
+                         ["bar.com"])
+        self.assertIn(eid, self.api.calendars[self.urls["baz.com"]].events)
+        self.assertNotIn(eid, self.api.calendars[self.urls["bar.com"]].events)
+
+        # Still open: bar.com isn't even asked.
+        self.domains["bar.com"].http.down = False
+        self.group.sync()
+        self.assertEqual(len(self.group.quarantined), 1)
+
+        # Once the breaker times out, a probe lets it back in and it
+        # catches up.
+        self.clock.now += breaker.DEFAULT_TIMEOUT
+        self.group.sync()
+        self.assertEqual(self.group.quarantined, set())
+        self.assertEqual(self.domains["bar.com"].breaker.state,
+                         breaker.CLOSED)
+        self.assertIn(eid, self.api.calendars[self.urls["bar.com"]].events)
+
+    def test_forbidden_event_not_a_domain_failure(self):
+        self.group.sync()
+        eid = self.add_event("foo.com")
+        insert = self.api.insert_event
+
+        def insert_event(cal, body, params):
+            if cal.id == self.urls["bar.com"] and body.get('id') == eid:
+                raise fakeapi.APIError(403, "forbidden", "Forbidden")
+            return insert(cal, body, params)
+        self.api.insert_event = insert_event
+        self.group.sync()
+        self.assertEqual(self.group.quarantined, set())
+        self.assertEqual(self.domains["bar.com"].breaker.state,
+                         breaker.CLOSED)
+        self.assertIn(eid, self.api.calendars[self.urls["baz.com"]].events)
+        self.assertNotIn(eid, self.api.calendars[self.urls["bar.com"]].events)
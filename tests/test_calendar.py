@@ -65,3 +65,145 @@ class CalendarTest(unittest.TestCase):
         self.assertEqual(c.update_events(), 5)
         # A second call should be idempotent
         self.assertEqual(c.update_events(), 0)
+
+    def test_calendar_sqlite_store(self):
+        self.domain.http = HttpMockSequence([
+            ({'status': '200'}, dataread("calendarList.json")),
+            ({'status': '200'}, dataread("calendar-events.json")),
+            ({'status': '200'}, dataread("calendar-events-empty.json")),
+              ])
+        self.calendar_conf['event_store'] = ':memory:'
+        c = gcalbridge.calendar.Calendar(self.calendar_conf, self.domains)
+        self.assertIsInstance(c.events, gcalbridge.store.SqliteEventStore)
+        self.assertEqual(c.update_events(), 5)
+        self.assertEqual(len(c.events), 5)
+        self.assertEqual(len(c.events.changed_since(0)), 5)
+
+
+class RecurrenceTest(unittest.TestCase):
+    def setUp(self):
+        from gcalbridge import fakeapi
+        build('calendar', 'v3')
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        self.urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                     "bar.com": "bar.com_1@resource.calendar.google.com"}
+        domains = {}
+        for d, url in self.urls.items():
+            self.api.add_calendar(url, "room@" + d, summary="Room")
+            domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d}, authorize=False,
+                http=fakeapi.FakeHttp(self.api, "room@" + d))
+        self.group = gcalbridge.calendar.SyncedCalendar("room", {
+            "calendars": [{"url": url, "domain": d}
+                          for d, url in sorted(self.urls.items())]},
+            domains=domains)
+        self.foo = self.api.calendars[self.urls["foo.com"]]
+        self.bar = self.api.calendars[self.urls["bar.com"]]
+
+    def add(self, cal, **kwargs):
+        event = self.api.random_event()
+        event.update(kwargs)
+        return self.api._finish(cal, event)
+
+    def series(self):
+        master = self.add(self.foo, id="series1",
+                          recurrence=["RRULE:FREQ=WEEKLY;COUNT=10"])
+        instance = self.add(self.foo, id="series1_20160801T100000Z",
+                            recurringEventId="series1",
+                            originalStartTime=master['start'],
+                            summary="Moved this week")
+        return master, instance
+
+    def test_master_before_exception(self):
+        master, instance = self.series()
+        self.group.sync()
+        self.assertEqual(self.bar.events["series1"]['recurrence'],
+                         master['recurrence'])
+        self.assertEqual(self.bar.events[instance['id']]['summary'],
+                         "Moved this week")
+        self.assertEqual(self.group.deferred, set())
+        self.assertEqual(self.group.sync(), 0)
+
+    def test_cancelled_occurrence(self):
+        master, instance = self.series()
+        self.group.sync()
+        occurrence = self.add(self.foo, id="series1_20160808T100000Z",
+                              recurringEventId="series1",
+                              originalStartTime=master['start'],
+                              status="cancelled")
+        self.group.sync()
+        self.assertEqual(self.bar.events[occurrence['id']]['status'],
+                         "cancelled")
+        self.assertEqual(self.group.sync(), 0)
+
+    def test_cancelled_series(self):
+        master, instance = self.series()
+        self.group.sync()
+        self.api._finish(self.foo, dict(master, status="cancelled"))
+        self.api._finish(self.foo, dict(instance, summary="Moved again"))
+        self.group.sync()
+        self.assertEqual(self.bar.events["series1"]['status'], "cancelled")
+        self.assertEqual(self.bar.events[instance['id']]['summary'],
+                         "Moved this week")
+
+    def test_unknown_series(self):
+        instance = self.add(self.foo, id="nothing_20160801T100000Z",
+                            recurringEventId="nothing")
+        self.group.sync()
+        self.assertNotIn(instance['id'], self.bar.events)
+        self.assertEqual(self.group.deferred, set())
+
+
+class BatchFailureTest(unittest.TestCase):
+    def setUp(self):
+        from gcalbridge import fakeapi
+        build('calendar', 'v3')
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        # Two calendars in foo.com, whose writes share batches.
+        self.urls = ["bar.com_1@resource.calendar.google.com",
+                     "foo.com_1@resource.calendar.google.com",
+                     "foo.com_2@resource.calendar.google.com"]
+        domains = {}
+        for url in self.urls:
+            d = url.partition("_")[0]
+            self.api.add_calendar(url, "room@" + d, summary="Room")
+            domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d}, authorize=False,
+                http=fakeapi.FakeHttp(self.api, "room@" + d))
+        self.group = gcalbridge.calendar.SyncedCalendar("room", {
+            "calendars": [{"url": url, "domain": url.partition("_")[0]}
+                          for url in self.urls]},
+            domains=domains)
+        self.forbidden = None
+        insert = self.api.insert_event
+
+        def insert_event(cal, body, params):
+            if cal.id == self.forbidden:
+                raise fakeapi.APIError(403, "forbidden", "Forbidden")
+            return insert(cal, body, params)
+        self.api.insert_event = insert_event
+
+    def test_failure_stays_with_its_calendar(self):
+        self.group.sync()
+        self.forbidden = self.urls[2]
+        event = self.api.random_event()
+        event['id'] = self.api.new_id()
+        self.api._finish(self.api.calendars[self.urls[0]], event)
+        self.group.sync()
+        ok, failed = self.group.calendars[1], self.group.calendars[2]
+        written = self.api.calendars[self.urls[1]].events[event['id']]
+        # The other calendar's write went through, and its response was
+        # stored.
+        self.assertEqual(ok.events[event['id']]['etag'], written['etag'])
+        self.assertEqual(ok.inserting, set())
+        self.assertEqual(ok.pending_writes, 0)
+        self.assertNotIn(event['id'], self.api.calendars[self.urls[2]].events)
+        self.assertNotIn(event['id'], failed.events)
+        self.assertEqual(self.group.quarantined, set())
+        self.assertIn(event['id'], self.group.postponed)
+
+        # Tried again next sync.
+        self.forbidden = None
+        self.group.sync()
+        self.assertIn(event['id'], self.api.calendars[self.urls[2]].events)
+        self.assertEqual(self.group.postponed, set())
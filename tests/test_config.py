@@ -5,10 +5,12 @@
 Unit tests for config module"""
 
 import unittest
-from gcalbridge import config
+from apiclient.discovery import build
+from gcalbridge import config, fakeapi
 from gcalbridge.errors import BadConfigError
 import tempfile
 import os
+import shutil
 from copy import deepcopy
 from .utils import datafile
 import json
@@ -53,3 +55,128 @@ class ConfigTests(unittest.TestCase):
         self.fake_config_file.flush()
         with self.assertRaises(RuntimeError):
             config.Config(self.fake_config_name)
+
+
+class ReloadTests(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        self.server = fakeapi.FakeAPIServer(self.api, ("127.0.0.1", 0))
+        self.server.start()
+        self.conf = json.loads(open(datafile("config-test.json")).read())
+        self.conf['api_root'] = self.server.root
+        self.conf['calendars']['room_2'] = {"calendars": [
+            {"url": "foo.com_2@resource.calendar.google.com",
+             "domain": "foo.com"},
+            {"url": "bar.com_2@resource.calendar.google.com",
+             "domain": "bar.com"}]}
+        fd, self.name = tempfile.mkstemp()
+        os.close(fd)
+        self.write()
+        self.config = config.Config(self.name)
+        self.api.seed(self.config, events=2)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.unlink(self.name)
+
+    def write(self):
+        with open(self.name, 'w') as f:
+            f.write(json.dumps(self.conf))
+        # Make sure the change is noticed whatever the mtime resolution.
+        mtime = os.path.getmtime(self.name) + 1
+        os.utime(self.name, (mtime, mtime))
+
+    def test_startup(self):
+        self.config.setup()
+        self.assertEqual([p for p, t in self.config.timeline.phases],
+                         ["credentials", "calendar_lists", "groups"])
+        # One calendar list per domain, however many calendars it has.
+        self.assertEqual(self.api.requests["foo@foo.com"], 1)
+        self.assertEqual(self.api.requests["foo@bar.com"], 1)
+
+    def test_reload_keeps_unchanged_state(self):
+        groups = self.config.setup()
+        for g in groups.values():
+            g.sync()
+        room_1, room_2 = groups['room_1'], groups['room_2']
+        kept = room_2.calendars[0]
+        token = kept.sync_token
+        self.assertFalse(self.config.changed())
+
+        self.conf['poll_time'] = 30
+        self.conf['calendars']['room_2']['calendars'].pop()
+        self.conf['calendars']['room_3'] = {"calendars": [
+            {"url": "foo.com_3@resource.calendar.google.com",
+             "domain": "foo.com"}]}
+        self.api.add_calendar("foo.com_3@resource.calendar.google.com",
+                              "foo@foo.com")
+        self.write()
+        self.assertTrue(self.config.changed())
+        groups = self.config.reload()
+        self.assertFalse(self.config.changed())
+        self.assertEqual(self.config.poll_time, 30)
+        self.assertEqual(sorted(groups), ["room_1", "room_2", "room_3"])
+        self.assertIs(groups['room_1'], room_1)
+        self.assertIsNot(groups['room_2'], room_2)
+        self.assertEqual(groups['room_2'].calendars, [kept])
+        self.assertEqual(kept.sync_token, token)
+        self.assertEqual(len(kept.events), 4)
+        # Nothing to merge again, nothing to write.
+        self.assertEqual(groups['room_2'].sync(), 0)
+
+    def test_reload_bad_file(self):
+        groups = self.config.setup()
+        with open(self.name, 'w') as f:
+            f.write("{{{")
+        with self.assertRaises(ValueError):
+            self.config.reload()
+        self.assertFalse(self.config.changed())
+        self.assertIs(self.config.running_groups, groups)
+
+    def test_reload_malformed_group(self):
+        groups = self.config.setup()
+        for broken in ({"calendars": [{"url": "foo.com_1"}]},
+                       {"calendar": []},
+                       {"calendars": [{"url": "foo.com_1",
+                                       "domain": "baz.com"}]}):
+            self.conf['calendars']['room_2'] = broken
+            self.write()
+            with self.assertRaises(BadConfigError):
+                self.config.reload()
+            self.assertFalse(self.config.changed())
+            self.assertIs(self.config.running_groups, groups)
+
+    def test_reload_failure_keeps_journal(self):
+        dir = tempfile.mkdtemp()
+        try:
+            self.conf['journal'] = os.path.join(dir, "journal")
+            self.write()
+            self.config = config.Config(self.name)
+            groups = self.config.setup()
+            journal = self.config.write_journal
+            self.conf['journal'] = os.path.join(dir, "journal2")
+            # Not in the API, so setting it up fails.
+            self.conf['calendars']['room_3'] = {"calendars": [
+                {"url": "foo.com_9@resource.calendar.google.com",
+                 "domain": "foo.com"}]}
+            self.write()
+            with self.assertRaises(BadConfigError):
+                self.config.reload()
+            self.assertIs(self.config.write_journal, journal)
+            for cal in groups['room_1'].calendars:
+                self.assertIs(cal.journal, journal)
+            journal.sync()
+            self.assertFalse(journal.file.closed)
+
+            del self.conf['calendars']['room_3']
+            self.write()
+            groups = self.config.reload()
+            self.assertTrue(journal.file.closed)
+            self.assertIsNot(self.config.write_journal, journal)
+            for cal in groups['room_1'].calendars:
+                self.assertIs(cal.journal, self.config.write_journal)
+            self.config.write_journal.close()
+        finally:
+            shutil.rmtree(dir)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+""" Conflicts tests
+
+Unit tests for conflicts module"""
+
+import random
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi
+from gcalbridge.conflicts import IntervalIndex
+
+
+class IntervalIndexTest(unittest.TestCase):
+    def test_against_brute_force(self):
+        r = random.Random(1)
+        index = IntervalIndex()
+        intervals = {}
+        for i in range(2000):
+            id = "e%d" % r.randint(0, 300)
+            if r.random() < 0.2:
+                index.remove(id)
+                intervals.pop(id, None)
+            else:
+                start = r.randint(0, 10000)
+                end = start + r.randint(1, 200)
+                index.add(id, start, end)
+                intervals[id] = (start, end)
+            start = r.randint(0, 10000)
+            end = start + r.randint(1, 200)
+            self.assertEqual(
+                sorted(index.overlapping(start, end)),
+                sorted(k for k, (s, e) in intervals.items()
+                       if s < end and e > start))
+        self.assertEqual(len(index), len(intervals))
+
+    def test_touching_intervals_dont_overlap(self):
+        index = IntervalIndex()
+        index.add("a", 10, 20)
+        self.assertEqual(index.overlapping(20, 30), [])
+        self.assertEqual(index.overlapping(0, 10), [])
+        self.assertEqual(index.overlapping(19, 30), ["a"])
+
+
+class DoubleBookingTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        self.urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                     "bar.com": "bar.com_1@resource.calendar.google.com"}
+        domains = {}
+        for d, url in self.urls.items():
+            self.api.add_calendar(url, "room@" + d, summary="Room")
+            domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d}, authorize=False,
+                http=fakeapi.FakeHttp(self.api, "room@" + d))
+        self.domains = domains
+        self.group = self.synced()
+        self.foo = self.api.calendars[self.urls["foo.com"]]
+        self.bar = self.api.calendars[self.urls["bar.com"]]
+
+    def synced(self, **config):
+        self.reported = []
+        group = gcalbridge.calendar.SyncedCalendar("room", {
+            "calendars": [dict(config, url=url, domain=d)
+                          for d, url in sorted(self.urls.items())]},
+            domains=self.domains)
+        group.conflicts.hook = lambda *args: self.reported.append(args)
+        return group
+
+    def book(self, cal, id, start, end, **kwargs):
+        event = {"id": id, "summary": "Meeting",
+                 "start": {"dateTime": "2016-08-01T%s:00Z" % start},
+                 "end": {"dateTime": "2016-08-01T%s:00Z" % end}}
+        event.update(kwargs)
+        return self.api._finish(cal, event)
+
+    def test_same_slot_booked_on_both_sides(self):
+        self.book(self.foo, "booking1", "10:00", "11:00")
+        self.book(self.bar, "booking2", "10:30", "11:30")
+        self.book(self.bar, "booking3", "11:30", "12:00")
+        self.book(self.bar, "free", "10:00", "12:00",
+                  transparency="transparent")
+        self.group.sync()
+        self.assertEqual(self.group.status()["conflicts"], 1)
+        self.assertEqual(len(self.reported), 1)
+        self.assertEqual(set([self.reported[0][1]] + self.reported[0][2]),
+                         set(["booking1", "booking2"]))
+        # Cancelling one of them resolves it.
+        booking = dict(self.bar.events["booking2"], status="cancelled")
+        self.api._finish(self.bar, booking, self.bar.events["booking2"])
+        self.group.sync()
+        self.assertEqual(self.group.status()["conflicts"], 0)
+        self.assertEqual(len(self.reported), 1)
+
+    def test_events_on_disk(self):
+        # Without a MergeIndex, merges update the conflicts themselves.
+        self.group = self.synced(event_store=":memory:")
+        self.assertIsNone(self.group.index)
+        self.test_same_slot_booked_on_both_sides()
+
+    def test_not_for_people(self):
+        group = gcalbridge.calendar.SyncedCalendar("room", {
+            "detect_conflicts": False,
+            "calendars": [{"url": url, "domain": d}
+                          for d, url in sorted(self.urls.items())]},
+            domains=dict((c.domain_id, c.domain)
+                         for c in self.group.calendars))
+        self.assertIsNone(group.conflicts)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+""" Credentials tests
+
+Unit tests for credentials module"""
+
+import datetime
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from oauth2client.client import OAuth2Credentials
+from gcalbridge import credentials
+
+
+class FakeCredentials:
+    """
+    Just enough of OAuth2Credentials, with a slow refresh.
+    """
+
+    def __init__(self, expiry):
+        self.access_token = "token0"
+        self.token_expiry = expiry
+        self.refreshes = 0
+        self.lock = threading.Lock()
+
+    def _refresh(self, http_request):
+        time.sleep(0.05)
+        with self.lock:
+            self.refreshes += 1
+            self.access_token = "token%d" % self.refreshes
+        self.token_expiry = datetime.datetime.utcnow() + \
+            datetime.timedelta(hours=1)
+
+
+class AtomicStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_put_get(self):
+        path = os.path.join(self.dir, "creds_foo@foo.com.json")
+        creds = OAuth2Credentials("token", "client", "secret", "refresh",
+                                  None, "https://example.com/token", "test")
+        storage = credentials.AtomicStorage(path)
+        storage.put(creds)
+        storage.put(creds)
+        self.assertEqual(os.listdir(self.dir), ["creds_foo@foo.com.json"])
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+        self.assertEqual(storage.get().refresh_token, "refresh")
+
+
+class CredentialManagerTest(unittest.TestCase):
+    def test_single_flight(self):
+        creds = FakeCredentials(datetime.datetime.utcnow() +
+                                datetime.timedelta(hours=1))
+        manager = credentials.CredentialManager("foo.com", creds)
+
+        def refused():
+            # Sent the old token, which was refused.
+            manager.apply({})
+            barrier.wait()
+            manager._refresh(None)
+
+        barrier = threading.Event()
+        threads = [threading.Thread(target=refused) for i in range(8)]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        barrier.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(creds.refreshes, 1)
+        headers = {}
+        manager.apply(headers)
+        self.assertEqual(headers['Authorization'], "Bearer token1")
+
+    def test_proactive(self):
+        creds = FakeCredentials(datetime.datetime.utcnow() +
+                                datetime.timedelta(seconds=60))
+        manager = credentials.CredentialManager("foo.com", creds, margin=300)
+        threads = [threading.Thread(target=manager.apply, args=({},))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(creds.refreshes, 1)
+        self.assertFalse(manager.expiring())
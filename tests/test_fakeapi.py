@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+""" Fake API tests
+
+Unit tests for fakeapi module, which also exercise a full sync against it"""
+
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from apiclient.errors import HttpError
+from gcalbridge import fakeapi
+
+
+class FakeClock:
+    def __init__(self, now=1470000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeAPITest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.clock = FakeClock()
+        self.api = fakeapi.FakeCalendarAPI(seed=1, clock=self.clock)
+        self.urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                     "bar.com": "bar.com_1@resource.calendar.google.com"}
+        self.domains = {}
+        for d, url in self.urls.items():
+            self.api.add_calendar(url, "room@" + d, summary="Room")
+            self.domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d}, authorize=False,
+                http=fakeapi.FakeHttp(self.api, "room@" + d))
+
+    def calendar(self, domain="foo.com"):
+        return gcalbridge.calendar.Calendar(
+            {"url": self.urls[domain], "domain": domain}, self.domains)
+
+    def test_calendar_list_per_user(self):
+        c = self.calendar()
+        self.assertEqual(c.calendar_metadata['id'], self.urls['foo.com'])
+        self.assertEqual(len(self.domains['foo.com'].get_calendars()['items']),
+                         1)
+
+    def test_insert_and_sync_token(self):
+        c = self.calendar()
+        self.assertEqual(c.update_events(), 0)
+        c.add_event(self.api.random_event())
+        self.assertEqual(len(c.events), 1)
+        self.assertEqual(c.update_events(), 0)
+        eid = list(c.events.keys())[0]
+        c.service.events().patch(calendarId=c.url, eventId=eid,
+                                 body={"summary": "changed"}).execute()
+        self.assertEqual(c.update_events(), 1)
+        self.assertEqual(c.events[eid]['summary'], "changed")
+
+    def test_paging(self):
+        cal = self.api.calendars[self.urls['foo.com']]
+        for i in range(fakeapi.DEFAULT_PAGE_SIZE + 10):
+            event = self.api.random_event()
+            event['id'] = self.api.new_id()
+            self.api._finish(cal, event)
+        c = self.calendar()
+        self.assertEqual(c.update_events(), fakeapi.DEFAULT_PAGE_SIZE + 10)
+
+    def test_token_expiry(self):
+        self.api.token_ttl = 60
+        c = self.calendar()
+        c.update_events()
+        self.clock.now += 120
+        with self.assertRaises(HttpError) as cm:
+            c.service.events().list(calendarId=c.url,
+                                    syncToken=c.sync_token).execute()
+        self.assertEqual(cm.exception.resp.status, 410)
+        # The calendar relists instead.
+        c.update_events()
+        self.assertFalse(c.needs_relist)
+
+    def test_quota(self):
+        self.api.quota = 2
+        c = self.calendar()
+        c.update_events()
+        with self.assertRaises(HttpError) as cm:
+            c.update_events()
+        self.assertEqual(cm.exception.resp.status, 403)
+        self.clock.now += fakeapi.QUOTA_WINDOW
+        c.update_events()
+
+    def test_stale_sequence_rejected(self):
+        c = self.calendar()
+        c.add_event(self.api.random_event())
+        event = dict(list(c.events.values())[0])
+        c.service.events().patch(calendarId=c.url, eventId=event['id'],
+                                 body={"sequence": 3}).execute()
+        with self.assertRaises(HttpError) as cm:
+            c.update_event(event['id'], event)
+        self.assertEqual(cm.exception.resp.status, 400)
+
+    def test_synced_calendar_converges(self):
+        group = gcalbridge.calendar.SyncedCalendar("room", {"calendars": [
+            {"url": url, "domain": d} for d, url in self.urls.items()]},
+            domains=self.domains)
+        for url in self.urls.values():
+            cal = self.api.calendars[url]
+            for i in range(3):
+                event = self.api.random_event()
+                event['id'] = self.api.new_id()
+                self.api._finish(cal, event)
+        self.assertGreater(group.sync(), 0)
+        ids = [set(cal.events) for cal in self.api.calendars.values()]
+        self.assertEqual(len(ids[0]), 6)
+        self.assertEqual(ids[0], ids[1])
+        self.assertEqual(group.sync(), 0)
+
+
+class FakeAPIServerTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        self.api.add_calendar("foo.com_1@resource.calendar.google.com",
+                              "room@foo.com")
+        self.server = fakeapi.FakeAPIServer(self.api, ("127.0.0.1", 0))
+        self.server.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_domain_api_root(self):
+        domain = gcalbridge.domain.Domain("foo.com", {
+            "account": "room@foo.com", "api_root": self.server.root})
+        c = gcalbridge.calendar.Calendar({
+            "url": "foo.com_1@resource.calendar.google.com",
+            "domain": "foo.com"}, {"foo.com": domain})
+        c.begin_batch()
+        c.add_event(self.api.random_event())
+        c.add_event(self.api.random_event())
+        c.commit_batch()
+        self.assertEqual(len(c.events), 2)
+        self.assertEqual(self.api.requests["room@foo.com"], 3)
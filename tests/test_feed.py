@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+""" Feed tests
+
+Unit tests for feed module"""
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi, feed
+from gcalbridge.calendar import Event
+
+
+class ChangeFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "feed.jsonl")
+        self.event = Event({"id": "a", "status": "confirmed",
+                            "summary": "Standup", "sequence": 0,
+                            "updated": "2016-08-01T00:00:00.000Z"})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self):
+        with open(self.path) as f:
+            return [json.loads(l) for l in f]
+
+    def test_file(self):
+        f = feed.ChangeFeed(self.path)
+        self.assertTrue(f.emit("room", self.event, "foo.com_1"))
+        # Nothing new to say about it.
+        self.assertFalse(f.emit("room", Event(self.event)))
+        self.assertTrue(f.emit("room", Event(self.event, summary="Retro")))
+        f.close()
+        records = self.read()
+        self.assertEqual([r['summary'] for r in records],
+                         ["Standup", "Retro"])
+        self.assertEqual(records[0]['source'], "foo.com_1")
+        self.assertEqual(records[0]['group'], "room")
+
+    def test_drop_when_full(self):
+        f = feed.ChangeFeed(self.path, buffer=2, on_full=feed.DROP)
+        stalled = threading.Event()
+        write = f._write
+
+        def stall(lines):
+            stalled.wait()
+            write(lines)
+        f._write = stall
+        emitted = [f.emit("room", Event(self.event, summary=str(i)))
+                   for i in range(5)]
+        self.assertGreaterEqual(f.dropped, 2)
+        self.assertEqual(emitted.count(True), f.emitted)
+        stalled.set()
+        f.close()
+        self.assertEqual(len(self.read()), f.emitted)
+
+    def test_unix_socket(self):
+        path = os.path.join(self.dir, "feed.sock")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        f = feed.ChangeFeed(feed.UNIX_PREFIX + path)
+        f.emit("room", self.event)
+        conn, _ = server.accept()
+        line = conn.makefile().readline()
+        self.assertEqual(json.loads(line)['id'], "a")
+        f.close()
+        conn.close()
+        server.close()
+
+    def test_sink_down(self):
+        for path in (feed.UNIX_PREFIX + os.path.join(self.dir, "none.sock"),
+                     os.path.join(self.dir, "fifo")):
+            if not path.startswith(feed.UNIX_PREFIX):
+                # A named pipe nobody reads.
+                os.mkfifo(path)
+            f = feed.ChangeFeed(path, buffer=1, block_timeout=0.1)
+            f.sleep = lambda seconds: None
+            start = time.time()
+            for i in range(20):
+                f.emit("room", Event(self.event, summary=str(i)))
+            f.close()
+            self.assertLess(time.time() - start, feed.CLOSE_TIMEOUT)
+            self.assertFalse(f.thread.is_alive())
+            self.assertTrue(f.down)
+            self.assertEqual(f.dropped, 20)
+
+    def test_sent_bounded(self):
+        f = feed.ChangeFeed(self.path)
+        f.sent_size = 2
+        for id in "abc":
+            f.emit("room", Event(self.event, id=id))
+        self.assertEqual(list(f.sent), [("room", "b"), ("room", "c")])
+        # Forgotten, so sent again.
+        self.assertTrue(f.emit("room", Event(self.event, id="a")))
+        f.close()
+
+
+class FeedSyncTest(unittest.TestCase):
+    def test_sync_emits_changes(self):
+        build('calendar', 'v3')
+        api = fakeapi.FakeCalendarAPI(seed=1)
+        urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                "bar.com": "bar.com_1@resource.calendar.google.com"}
+        domains = {}
+        for d, url in urls.items():
+            api.add_calendar(url, "room@" + d, summary="Room")
+            domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d}, authorize=False,
+                http=fakeapi.FakeHttp(api, "room@" + d))
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, "feed.jsonl")
+            f = feed.ChangeFeed(path)
+            group = gcalbridge.calendar.SyncedCalendar("room", {
+                "calendars": [{"url": url, "domain": d}
+                              for d, url in sorted(urls.items())]},
+                domains=domains, feed=f)
+            foo = api.calendars[urls["foo.com"]]
+            event = api.random_event()
+            event['id'] = api.new_id()
+            api._finish(foo, event)
+            group.sync()
+            group.sync()
+            f.close()
+            with open(path) as lines:
+                records = [json.loads(l) for l in lines]
+            self.assertEqual(len(records), 1)
+            self.assertEqual(records[0]['id'], event['id'])
+            self.assertEqual(records[0]['source'], urls["foo.com"])
+        finally:
+            shutil.rmtree(dir)
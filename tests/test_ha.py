@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+""" HA tests
+
+Unit tests for ha module"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi, ha
+
+
+class LeaseTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "lease")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_exclusive(self):
+        first, second = ha.Lease(self.path), ha.Lease(self.path)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        self.assertEqual(second.holder()["pid"], os.getpid())
+        first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+
+
+class HighAvailabilityTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.dir = tempfile.mkdtemp()
+        self.config = {"lease": os.path.join(self.dir, "lease"),
+                       "checkpoint_dir": os.path.join(self.dir, "state")}
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        self.urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                     "bar.com": "bar.com_1@resource.calendar.google.com"}
+        for d, url in self.urls.items():
+            cal = self.api.add_calendar(url, "room@" + d, summary="Room")
+            for i in range(3):
+                event = self.api.random_event()
+                event['id'] = self.api.new_id()
+                self.api._finish(cal, event)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def groups(self):
+        domains = {}
+        for d in self.urls:
+            domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d}, authorize=False,
+                http=fakeapi.FakeHttp(self.api, "room@" + d))
+        return {"room": gcalbridge.calendar.SyncedCalendar("room", {
+            "calendars": [{"url": url, "domain": d}
+                          for d, url in sorted(self.urls.items())]},
+            domains=domains)}
+
+    def test_standby_takes_over(self):
+        active = ha.HighAvailability(self.config, self.groups())
+        active.become_active()
+        self.assertGreater(active.groups["room"].sync(), 0)
+        active.checkpoint()
+
+        sleeps = []
+        standby = ha.HighAvailability(self.config, self.groups(),
+                                      sleep=sleeps.append)
+        # Follows the checkpoints while the active process holds the lease.
+        self.assertFalse(standby.lease.acquire())
+        self.assertEqual(standby.tail(), 1)
+        self.assertEqual(standby.tail(), 0)
+
+        active.lease.release()
+        standby.become_active()
+        self.assertTrue(standby.active)
+        group = standby.groups["room"]
+        for cal in group.calendars:
+            self.assertEqual(len(cal.events), 6)
+        # Nothing to list again from scratch, nothing to write again.
+        requests = dict(self.api.requests)
+        self.assertEqual(group.sync(), 0)
+        for user, n in self.api.requests.items():
+            self.assertEqual(n, requests[user] + 1)
+        standby.lease.release()
+
+    def test_saves_only_changes(self):
+        active = ha.HighAvailability(self.config, self.groups())
+        active.become_active()
+        group = active.groups["room"]
+        group.sync()
+        active.checkpoint()
+        snapshot = os.stat(active.checkpointer.path(group))
+        log = active.checkpointer.log_path(group)
+        standby = ha.HighAvailability(self.config, self.groups())
+        self.assertEqual(standby.tail(), 1)
+
+        # Nothing but the sync tokens changed.
+        group.sync()
+        active.checkpoint()
+        with open(log) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(len(entries), 1)
+        for state in entries[0]["calendars"].values():
+            self.assertNotIn("events", state)
+
+        # Only the edited event is written, to the log.
+        cal = self.api.calendars[self.urls["foo.com"]]
+        id = sorted(cal.events)[0]
+        self.api._finish(cal, dict(cal.events[id], summary="Moved"),
+                         previous=cal.events[id])
+        group.sync()
+        active.checkpoint()
+        with open(log) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(sorted(e for entry in entries[1:]
+                                for state in entry["calendars"].values()
+                                for e in state.get("events", {})),
+                         [id, id])
+        self.assertEqual(os.stat(active.checkpointer.path(group)).st_mtime,
+                         snapshot.st_mtime)
+
+        self.assertEqual(standby.tail(), 1)
+        self.assertEqual(standby.tail(), 0)
+        tokens = dict((cal.url, cal.sync_token) for cal in group.calendars)
+        for cal in standby.groups["room"].calendars:
+            self.assertEqual(cal.events[id]["summary"], "Moved")
+            self.assertEqual(cal.sync_token, tokens[cal.url])
+        active.lease.release()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+""" Health tests
+
+Unit tests for health module"""
+
+import json
+import time
+import unittest
+import urllib2
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi, health
+
+
+class HealthServerTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        url = "foo.com_1@resource.calendar.google.com"
+        self.api.add_calendar(url, "room@foo.com")
+        domain = gcalbridge.domain.Domain(
+            "foo.com", {"account": "room@foo.com"}, authorize=False,
+            http=fakeapi.FakeHttp(self.api, "room@foo.com"))
+        self.group = gcalbridge.calendar.SyncedCalendar("room", {
+            "calendars": [{"url": url, "domain": "foo.com"}]},
+            domains={"foo.com": domain})
+        self.groups = {"room": self.group}
+        self.server = health.HealthServer(lambda: self.groups,
+                                          ("127.0.0.1", 0), slo=60)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path):
+        try:
+            r = urllib2.urlopen("http://127.0.0.1:%d%s" % (
+                self.server.server_address[1], path))
+            return r.getcode(), json.loads(r.read())
+        except urllib2.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_not_ready_before_sync(self):
+        code, body = self.get("/ready")
+        self.assertEqual(code, 503)
+        self.assertEqual(body["lagging"], ["room"])
+
+    def test_ready_after_sync(self):
+        self.group.sync()
+        code, body = self.get("/ready")
+        self.assertEqual(code, 200)
+        self.group.last_converged = time.time() - 120
+        code, body = self.get("/ready")
+        self.assertEqual(code, 503)
+
+    def test_status(self):
+        self.group.sync()
+        code, body = self.get("/status")
+        self.assertEqual(code, 200)
+        room = body["groups"]["room"]
+        self.assertEqual(room["backoff"], 0)
+        self.assertIsNotNone(room["cycle_duration"])
+        cal = room["calendars"][0]
+        self.assertEqual(cal["domain"], "foo.com")
+        self.assertEqual(cal["pending_writes"], 0)
+        self.assertIsNotNone(cal["last_update"])
+        self.assertGreaterEqual(cal["sync_token_age"], 0)
+
+    def test_status_published_between_iterations(self):
+        self.group.sync()
+        cal = self.group.calendars[0]
+        # A sync going on meanwhile doesn't show (or get in the way).
+        self.group.quarantined.add(cal)
+        code, body = self.get("/status")
+        self.assertEqual(body["groups"]["room"]["quarantined"], [])
+        self.group.publish()
+        code, body = self.get("/status")
+        self.assertEqual(body["groups"]["room"]["quarantined"], [cal.name])
+
+    def test_metrics(self):
+        self.group.sync()
+        code, body = self.get("/metrics")
+        self.assertEqual(code, 200)
+        self.assertIn("histograms", body)
+
+    def test_not_found(self):
+        self.assertEqual(self.get("/nope")[0], 404)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+""" Journal tests
+
+Unit tests for journal module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi
+from gcalbridge.journal import Journal
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_unfinished_survive_restart(self):
+        journal = Journal(self.path)
+        a = journal.intend("cal1", "a", "insert", 1)
+        b = journal.intend("cal1", "b", "update", 2)
+        journal.intend("cal2", "c", "patch", 3)
+        journal.sync()
+        journal.done(a)
+        journal.close()
+        journal = Journal(self.path)
+        self.assertEqual([r["id"] for r in journal.unfinished("cal1")], ["b"])
+        self.assertEqual(journal.unfinished("cal1")[0]["hash"], 2)
+        self.assertEqual(len(journal.unfinished("cal2")), 1)
+        # New intents don't reuse sequence numbers.
+        self.assertGreater(journal.intend("cal1", "d", "insert", 4), b)
+
+    def test_torn_line(self):
+        journal = Journal(self.path)
+        journal.intend("cal1", "a", "insert", 1)
+        journal.close()
+        with open(self.path, "a") as f:
+            f.write('{"cal":"cal1","has')
+        journal = Journal(self.path)
+        self.assertEqual(len(journal.pending), 1)
+
+    def test_compaction(self):
+        journal = Journal(self.path, compact_threshold=10)
+        for i in range(6):
+            journal.done(journal.intend("cal1", str(i), "insert", i))
+        keep = journal.intend("cal1", "keep", "update", 0)
+        with open(self.path) as f:
+            self.assertLess(len(f.readlines()), 13)
+        journal.close()
+        journal = Journal(self.path)
+        self.assertEqual(list(journal.pending), [keep])
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+
+class VerifyTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.dir = tempfile.mkdtemp()
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        self.url = "foo.com_1@resource.calendar.google.com"
+        self.cal = self.api.add_calendar(self.url, "room@foo.com")
+        domain = gcalbridge.domain.Domain(
+            "foo.com", {"account": "room@foo.com"}, authorize=False,
+            http=fakeapi.FakeHttp(self.api, "room@foo.com"))
+        self.calendar = gcalbridge.calendar.Calendar(
+            {"url": self.url, "domain": "foo.com"}, {"foo.com": domain})
+        self.calendar.journal = Journal(os.path.join(self.dir, "journal"))
+
+    def tearDown(self):
+        self.calendar.journal.close()
+        shutil.rmtree(self.dir)
+
+    def test_writes_finish(self):
+        event = self.api.random_event()
+        event['id'] = self.api.new_id()
+        self.calendar.begin_batch()
+        self.calendar.add_event(self.calendar.profile.event(event))
+        self.calendar.commit_batch()
+        self.assertIn(event['id'], self.cal.events)
+        self.assertEqual(self.calendar.journal.pending, {})
+
+    def test_unfinished_writes_fetched(self):
+        event = self.api.random_event()
+        event['id'] = self.api.new_id()
+        landed = self.api._finish(self.cal, event)
+        journal = self.calendar.journal
+        journal.intend(self.url, landed['id'], "insert",
+                       self.calendar.profile.event(landed).ehash())
+        journal.intend(self.url, "missing", "insert", 0)
+        journal.intend("elsewhere", "other", "insert", 0)
+        requests = self.api.requests["room@foo.com"]
+        self.assertEqual(self.calendar.verify_journal(), 2)
+        self.assertEqual(self.api.requests["room@foo.com"] - requests, 2)
+        self.assertIn(landed['id'], self.calendar.events)
+        self.assertEqual([r["id"] for r in journal.pending.values()],
+                         ["other"])
+        # Nothing left to look up.
+        self.assertEqual(self.calendar.verify_journal(), 0)
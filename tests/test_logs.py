@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+""" Logs tests
+
+Unit tests for logs module"""
+
+import json
+import logging
+import unittest
+from StringIO import StringIO
+from gcalbridge import logs
+
+
+def record(level, calendar=None):
+    r = logging.LogRecord("root", level, __file__, 1, "hello %s", ("x",),
+                          None)
+    if calendar is not None:
+        r.calendar = calendar
+    return r
+
+
+class DebugFilterTest(unittest.TestCase):
+    def test_level_and_verbose_calendars(self):
+        f = logs.DebugFilter(logging.INFO, verbose=["cal1"])
+        self.assertTrue(f.filter(record(logging.WARN)))
+        self.assertTrue(f.filter(record(logging.INFO, "cal2")))
+        self.assertTrue(f.filter(record(logging.DEBUG, "cal1")))
+        self.assertFalse(f.filter(record(logging.DEBUG, "cal2")))
+        self.assertFalse(f.filter(record(logging.DEBUG)))
+
+    def test_rate_per_calendar(self):
+        now = [100.0]
+        f = logs.DebugFilter(rate=2, verbose=["cal3"], clock=lambda: now[0])
+        passed = [f.filter(record(logging.DEBUG, "cal1")) for i in range(3)]
+        self.assertEqual(passed, [True, True, False])
+        self.assertTrue(f.filter(record(logging.DEBUG, "cal2")))
+        self.assertTrue(all(f.filter(record(logging.DEBUG, "cal3"))
+                            for i in range(3)))
+        self.assertTrue(f.filter(record(logging.INFO, "cal1")))
+        now[0] += 1
+        self.assertTrue(f.filter(record(logging.DEBUG, "cal1")))
+        self.assertEqual(f.dropped, 1)
+
+
+class ConfigureTest(unittest.TestCase):
+    def setUp(self):
+        root = logging.getLogger()
+        self.handlers = root.handlers[:]
+        self.level = root.level
+        self.stream = StringIO()
+
+    def tearDown(self):
+        root = logging.getLogger()
+        for h in root.handlers[:]:
+            root.removeHandler(h)
+            h.close()
+        for h in self.handlers:
+            root.addHandler(h)
+        root.setLevel(self.level)
+
+    def test_production(self):
+        handler = logs.configure("production", stream=self.stream)
+        self.assertIsInstance(handler, logs.AsyncHandler)
+        self.assertEqual(logging.getLogger().level, logging.INFO)
+        log = logging.LoggerAdapter(logging.getLogger(), {"calendar": "cal1"})
+        log.debug("not %s", logs.lazy(self.fail, "formatted"))
+        log.info("Updated %d events", 3)
+        handler.flush()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        r = json.loads(lines[0])
+        self.assertEqual(r["msg"], "Updated 3 events")
+        self.assertEqual(r["calendar"], "cal1")
+        self.assertEqual(r["level"], "INFO")
+
+    def test_debug_calendars(self):
+        logs.configure({"level": "warning", "debug_calendars": ["cal1"]},
+                       stream=self.stream)
+        self.assertEqual(logging.getLogger().level, logging.DEBUG)
+        logging.LoggerAdapter(logging.getLogger(),
+                              {"calendar": "cal1"}).debug("one")
+        logging.LoggerAdapter(logging.getLogger(),
+                              {"calendar": "cal2"}).debug("two")
+        logging.info("three")
+        self.assertEqual(len(self.stream.getvalue().splitlines()), 1)
+        self.assertIn("one", self.stream.getvalue())
+
+    def test_bad_settings(self):
+        self.assertRaises(ValueError, logs.configure, "loud")
+        self.assertRaises(ValueError, logs.configure, {"level": "loud"})
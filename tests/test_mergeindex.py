@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+""" Merge index tests
+
+Unit tests for mergeindex module"""
+
+import unittest
+from gcalbridge.calendar import Event
+from gcalbridge.mergeindex import MergeIndex
+from gcalbridge.store import EventStore
+
+
+class Cal:
+    def __init__(self, name):
+        self.name = name
+        self.events = EventStore()
+
+
+def event(**kwargs):
+    e = {"id": "a", "status": "confirmed", "summary": "Standup",
+         "sequence": 0, "updated": "2016-08-01T00:00:00.000Z"}
+    e.update(kwargs)
+    return Event(e)
+
+
+class MergeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.foo, self.bar = Cal("foo"), Cal("bar")
+        self.foo.events["a"] = event()
+        self.index = MergeIndex([self.foo, self.bar])
+
+    def test_built_from_stores(self):
+        entry = self.index.get("a")
+        self.assertIs(entry.source, self.foo)
+        self.assertEqual(entry.stale, set([self.bar]))
+        self.assertFalse(self.index.current("a"))
+
+    def test_follows_stores(self):
+        self.bar.events["a"] = event(updated="2016-08-02T00:00:00.000Z")
+        # Same fingerprint, whenever it was updated.
+        self.assertTrue(self.index.current("a"))
+        self.bar.events["a"] = event(summary="Retro",
+                                     updated="2016-08-03T00:00:00.000Z")
+        entry = self.index.get("a")
+        self.assertIs(entry.source, self.bar)
+        self.assertEqual(entry.stale, set([self.foo]))
+        self.foo.events["a"] = event(status="cancelled", sequence=2)
+        entry = self.index.get("a")
+        self.assertTrue(entry.cancelled)
+        self.assertEqual(entry.sequence, 2)
+        self.foo.events.discard("a")
+        self.bar.events.discard("a")
+        self.assertIsNone(self.index.get("a"))
+
+    def test_keeps_no_events(self):
+        version = self.index.get("a").versions[self.foo]
+        self.assertEqual(tuple(version), (event().ehash(), 0,
+                                          "2016-08-01T00:00:00.000Z", True,
+                                          False))
+
+    def test_refresh_after_change_in_place(self):
+        self.bar.events["a"] = event()
+        self.assertTrue(self.index.current("a"))
+        self.bar.events["a"]['sequence'] = 1
+        self.assertTrue(self.index.current("a"))
+        self.index.refresh("a")
+        # The sequences differ, so it needs merging again.
+        self.assertFalse(self.index.current("a"))
+        self.assertEqual(self.index.get("a").sequence, 1)
+
+
+class EhashCacheTest(unittest.TestCase):
+    def test_invalidated(self):
+        e = event()
+        h = e.ehash()
+        self.assertEqual(e.ehash(), h)
+        e['summary'] = "Retro"
+        self.assertNotEqual(e.ehash(), h)
+        e.update(summary="Standup")
+        self.assertEqual(e.ehash(), h)
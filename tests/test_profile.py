@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+""" Profile tests
+
+Unit tests for profile module"""
+
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi, profile
+from gcalbridge.calendar import Event
+from gcalbridge.errors import BadConfigError
+
+
+class FieldProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.profile = profile.FieldProfile("rooms", ["summary", "attendees"])
+        self.event = {"id": "a", "status": "confirmed", "summary": "Standup",
+                      "description": "Daily", "updated": "2016-08-01T00:00Z",
+                      "sequence": 0, "attendees": [{"email": "x@foo.com"}]}
+
+    def test_compares_only_profile_fields(self):
+        a = self.profile.event(self.event)
+        b = self.profile.event(dict(self.event, description="Weekly",
+                                    updated="2016-08-02T00:00Z"))
+        self.assertEqual(cmp(a, b), 0)
+        self.assertEqual(a.ehash(), b.ehash())
+        self.assertNotEqual(cmp(Event(self.event), Event(b)), 0)
+        c = self.profile.event(dict(self.event, summary="Retro",
+                                    updated="2016-08-02T00:00Z"))
+        self.assertLess(a, c)
+
+    def test_attendees_special(self):
+        self.assertEqual(self.profile.event_class.special_props,
+                         ["attendees"])
+        self.assertNotIn("attendees", self.profile.event_class.props)
+
+    def test_payload_and_list_fields(self):
+        body = self.profile.payload(self.event)
+        self.assertNotIn("description", body)
+        self.assertEqual(body['summary'], "Standup")
+        self.assertIn("items(id,status,", self.profile.list_fields)
+        self.assertIn("summary", self.profile.list_fields)
+        self.assertNotIn("description", self.profile.list_fields)
+
+    def test_full_profile(self):
+        full = profile.default_profile()
+        self.assertIs(full.event_class, Event)
+        self.assertIsNone(full.list_fields)
+        self.assertIs(full.payload(self.event), self.event)
+
+    def test_group_profile(self):
+        profiles = profile.profiles_from_config({
+            "rooms": {"fields": ["summary"]}})
+        self.assertIs(profile.group_profile("g", {"profile": "rooms"},
+                                            profiles), profiles["rooms"])
+        self.assertIs(profile.group_profile("g", {}, profiles),
+                      profile.default_profile())
+        self.assertTrue(profile.group_profile(
+            "g", {"fields": ["location"]}).partial)
+        self.assertRaises(BadConfigError, profile.group_profile, "g",
+                          {"profile": "nope"}, profiles)
+        self.assertRaises(BadConfigError, profile.profiles_from_config,
+                          {"rooms": {}})
+
+
+class ProfileSyncTest(unittest.TestCase):
+    def test_sync_only_profile_fields(self):
+        build('calendar', 'v3')
+        api = fakeapi.FakeCalendarAPI(seed=1)
+        urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                "bar.com": "bar.com_1@resource.calendar.google.com"}
+        domains = {}
+        for d, url in urls.items():
+            api.add_calendar(url, "room@" + d, summary="Room")
+            domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d}, authorize=False,
+                http=fakeapi.FakeHttp(api, "room@" + d))
+        group = gcalbridge.calendar.SyncedCalendar("room", {
+            "fields": ["summary"],
+            "calendars": [{"url": url, "domain": d}
+                          for d, url in sorted(urls.items())]},
+            domains=domains)
+        foo = api.calendars[urls["foo.com"]]
+        bar = api.calendars[urls["bar.com"]]
+        event = api.random_event()
+        event.update(id=api.new_id(), description="Secret")
+        api._finish(foo, event)
+        group.sync()
+        self.assertNotIn("description", bar.events[event['id']])
+        for cal in group.calendars:
+            self.assertNotIn("description", cal.events[event['id']])
+
+        # Changes outside the profile aren't synced...
+        updated = bar.events[event['id']]['updated']
+        api._finish(foo, dict(foo.events[event['id']], description="New"))
+        group.sync()
+        self.assertEqual(bar.events[event['id']]['updated'], updated)
+        # ...changes inside it are, and leave other fields alone.
+        api._finish(bar, dict(bar.events[event['id']], location="Here"))
+        api._finish(foo, dict(foo.events[event['id']], summary="Renamed"))
+        self.assertGreater(group.sync(), 0)
+        self.assertEqual(bar.events[event['id']]['summary'], "Renamed")
+        self.assertEqual(bar.events[event['id']]['location'], "Here")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+""" Quota tests
+
+Unit tests for quota module"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi, quota
+from gcalbridge.timeutil import format_rfc3339
+
+
+class FakeClock:
+    def __init__(self, now=1470038400.0):
+        # 2016-08-01 08:00 UTC, an hour into the quota day (which starts at
+        # midnight Pacific daylight time).
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class QuotaAccountantTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_projection(self):
+        project = quota.QuotaAccountant("project", daily=10000,
+                                        clock=self.clock)
+        domain = quota.QuotaAccountant("foo.com", parent=project,
+                                       clock=self.clock)
+        domain.spend(100)
+        self.assertEqual(project.used, 100)
+        # 100 in the first hour makes 2400 by the end of the day.
+        self.assertEqual(int(project.projected()), 2400)
+        self.assertFalse(domain.tight())
+        domain.spend(300)
+        self.assertTrue(project.tight())
+        self.assertTrue(domain.tight())
+        # A new day starts from scratch.
+        self.clock.now += 86400
+        self.assertFalse(domain.tight())
+        self.assertEqual(project.projected(), 0)
+
+    def test_day_follows_daylight_saving(self):
+        # Midnight Pacific is 07:00 UTC in summer and 08:00 UTC in winter.
+        self.assertEqual(quota.quota_day(1467356340.0),  # 2016-07-01 06:59
+                         quota.quota_day(1467356460.0) - 1)  # 07:01
+        self.assertEqual(quota.quota_day(1452844740.0),  # 2016-01-15 07:59
+                         quota.quota_day(1452844860.0) - 1)  # 08:01
+        self.assertEqual(quota.quota_day_start(quota.quota_day(1467356460.0)),
+                         1467356400.0)
+        q = quota.QuotaAccountant("foo.com", clock=self.clock)
+        q.spend(10)
+        self.clock.now += 23 * 3600 - 1
+        self.assertEqual(q.window_used(), 0)
+        q._roll()
+        self.assertEqual(q.used, 10)
+        self.clock.now += 1
+        q._roll()
+        self.assertEqual(q.used, 0)
+
+    def test_window(self):
+        q = quota.QuotaAccountant("foo.com", per_window=100, reserve=0,
+                                  clock=self.clock)
+        q.spend(101)
+        self.assertTrue(q.tight())
+        self.clock.now += quota.QUOTA_WINDOW
+        self.assertFalse(q.tight())
+
+    def test_threads(self):
+        project = quota.QuotaAccountant("project", clock=self.clock)
+        domains = [quota.QuotaAccountant("d%d" % i, parent=project,
+                                         clock=self.clock) for i in range(4)]
+
+        def spend(q):
+            for i in range(2000):
+                q.spend(1)
+        threads = [threading.Thread(target=spend, args=(q,))
+                   for q in domains + domains]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(project.used, 16000)
+        self.assertEqual(project.window_used(), 16000)
+
+    def test_persistence(self):
+        path = os.path.join(self.dir, "quota.json")
+        q = quota.QuotaAccountant("foo.com", state_file=path, clock=self.clock)
+        q.spend(quota.SAVE_INTERVAL - 1)
+        self.assertFalse(os.path.isfile(path))
+        q.spend(1)
+        q.spend(5)
+        q.save()
+        again = quota.QuotaAccountant("foo.com", state_file=path,
+                                      clock=self.clock)
+        self.assertEqual(again.used, quota.SAVE_INTERVAL + 5)
+        self.clock.now += 86400
+        tomorrow = quota.QuotaAccountant("foo.com", state_file=path,
+                                         clock=self.clock)
+        self.assertEqual(tomorrow.used, 0)
+
+
+class PostponeTest(unittest.TestCase):
+    def test_far_events_wait(self):
+        build('calendar', 'v3')
+        api = fakeapi.FakeCalendarAPI(seed=1)
+        urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                "bar.com": "bar.com_1@resource.calendar.google.com"}
+        domains = {}
+        for d, url in urls.items():
+            api.add_calendar(url, "room@" + d, summary="Room")
+            domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d, "quota_daily": 10},
+                authorize=False, http=fakeapi.FakeHttp(api, "room@" + d))
+        group = gcalbridge.calendar.SyncedCalendar("room", {
+            "calendars": [{"url": url, "domain": d}
+                          for d, url in sorted(urls.items())]},
+            domains=domains)
+        foo = api.calendars[urls["foo.com"]]
+        bar = api.calendars[urls["bar.com"]]
+        ids = {}
+        for name, days in [("soon", 1), ("later", 60)]:
+            start = time.time() + days * 86400
+            event = api.random_event()
+            event.update(id=api.new_id(),
+                         start={"dateTime": format_rfc3339(start)},
+                         end={"dateTime": format_rfc3339(start + 3600)})
+            api._finish(foo, event)
+            ids[name] = event['id']
+
+        group.sync()
+        self.assertIn(ids["soon"], bar.events)
+        self.assertNotIn(ids["later"], bar.events)
+        self.assertEqual(group.postponed, set([ids["later"]]))
+
+        for d in domains.values():
+            d.quota.daily = None
+        group.sync()
+        self.assertIn(ids["later"], bar.events)
+        self.assertEqual(group.postponed, set())
+
+
+class RelistQuotaTest(unittest.TestCase):
+    def test_relist_waits_for_quota(self):
+        build('calendar', 'v3')
+        clock = FakeClock()
+        api = fakeapi.FakeCalendarAPI(seed=1, clock=clock, token_ttl=60)
+        url = "foo.com_1@resource.calendar.google.com"
+        api.add_calendar(url, "room@foo.com")
+        domain = gcalbridge.domain.Domain(
+            "foo.com", {"account": "room@foo.com"}, authorize=False,
+            http=fakeapi.FakeHttp(api, "room@foo.com"))
+        calendar = gcalbridge.calendar.Calendar(
+            {"url": url, "domain": "foo.com"}, {"foo.com": domain})
+        calendar.update_events()
+        clock.now += 120
+        domain.quota.daily = 1
+        requests = api.requests["room@foo.com"]
+        calendar.update_events()
+        self.assertTrue(calendar.needs_relist)
+        # Only the listing that found our token expired.
+        self.assertEqual(api.requests["room@foo.com"] - requests, 1)
+        self.assertEqual(calendar.update_events(), 0)
+        self.assertEqual(api.requests["room@foo.com"] - requests, 1)
+        domain.quota.daily = None
+        calendar.update_events()
+        self.assertFalse(calendar.needs_relist)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+""" Recovery tests
+
+Unit tests for recovery module"""
+
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi, recovery
+
+
+class FakeClock:
+    def __init__(self, now=1470000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Cal:
+    name = "cal"
+
+
+class RecoveryThrottleTest(unittest.TestCase):
+    def test_staggered(self):
+        clock = FakeClock()
+        throttle = recovery.RecoveryThrottle("foo.com", max_recoveries=2,
+                                             interval=60, clock=clock)
+        self.assertTrue(throttle.acquire(Cal()))
+        self.assertTrue(throttle.acquire(Cal()))
+        self.assertFalse(throttle.acquire(Cal()))
+        clock.now += 30
+        self.assertFalse(throttle.acquire(Cal()))
+        clock.now += 30
+        self.assertTrue(throttle.acquire(Cal()))
+
+    def test_from_config(self):
+        throttle = recovery.RecoveryThrottle.from_config("foo.com", {
+            "max_recoveries": 3, "recovery_page_size": 50})
+        self.assertEqual(throttle.max_recoveries, 3)
+        self.assertEqual(throttle.page_size, 50)
+        self.assertEqual(throttle.interval,
+                         recovery.DEFAULT_RECOVERY_INTERVAL)
+
+
+class RelistTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.clock = FakeClock()
+        self.api = fakeapi.FakeCalendarAPI(seed=1, clock=self.clock,
+                                           token_ttl=60)
+        self.urls = ["foo.com_%d@resource.calendar.google.com" % i
+                     for i in range(2)]
+        for url in self.urls:
+            self.api.add_calendar(url, "room@foo.com")
+            for i in range(5):
+                event = self.api.random_event()
+                event['id'] = self.api.new_id()
+                self.api._finish(self.api.calendars[url], event)
+        self.domain = gcalbridge.domain.Domain(
+            "foo.com", {"account": "room@foo.com", "recovery_page_size": 2},
+            authorize=False, http=fakeapi.FakeHttp(self.api, "room@foo.com"))
+        self.pauses = []
+        self.domain.recoveries.sleep = self.pauses.append
+        self.domain.recoveries.clock = self.clock
+        self.calendars = [gcalbridge.calendar.Calendar(
+            {"url": url, "domain": "foo.com"}, {"foo.com": self.domain})
+            for url in self.urls]
+        for c in self.calendars:
+            c.update_events()
+
+    def test_relist_reconciles(self):
+        c = self.calendars[0]
+        cal = self.api.calendars[c.url]
+        gone = sorted(cal.events)[0]
+        # Purged while our token was stale.
+        del cal.events[gone]
+        del cal.versions[gone]
+        self.clock.now += 120
+        self.assertEqual(c.update_events(), 1)
+        self.assertFalse(c.events[gone].active())
+        self.assertFalse(c.events[gone].dirty)
+        self.assertFalse(c.needs_relist)
+        # Four events left, two per page.
+        self.assertEqual(len(self.pauses), 1)
+        self.assertEqual(c.update_events(), 0)
+
+    def test_recoveries_staggered(self):
+        self.clock.now += 120
+        first, second = self.calendars
+        first.update_events()
+        self.assertEqual(second.update_events(), 0)
+        self.assertTrue(second.needs_relist)
+        self.clock.now += recovery.DEFAULT_RECOVERY_INTERVAL
+        second.update_events()
+        self.assertFalse(second.needs_relist)
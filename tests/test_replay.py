@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+""" Replay tests
+
+Unit tests for replay module"""
+
+import json
+import os
+import tempfile
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from apiclient.http import HttpMockSequence
+from gcalbridge import replay
+from .utils import dataread
+
+
+BATCH_RESPONSE = """--batch_abc\r
+Content-Type: application/http\r
+Content-ID: <response-1234+1>\r
+\r
+HTTP/1.1 200 OK\r
+Content-Type: application/json; charset=UTF-8\r
+Content-Length: 58\r
+\r
+{"id": "abc", "summary": "Secret meeting", "status": "confirmed"}\r
+--batch_abc--\r
+"""
+
+
+class ScrubberTest(unittest.TestCase):
+    def setUp(self):
+        self.scrubber = replay.Scrubber(salt="test")
+
+    def test_stable_pseudonyms(self):
+        a = self.scrubber.json({"summary": "Lunch", "email": "bob@bar.com"})
+        b = self.scrubber.json({"summary": "Lunch", "email": "bob@bar.com"})
+        c = self.scrubber.json({"summary": "Dinner", "email": "al@bar.com"})
+        self.assertEqual(a, b)
+        self.assertNotEqual(a["summary"], c["summary"])
+        self.assertNotIn("Lunch", a["summary"])
+        self.assertNotIn("bob", a["email"])
+        self.assertNotIn("bar.com", a["email"])
+        self.assertEqual(a["email"].split("@")[1], c["email"].split("@")[1])
+
+    def test_resource_domain_kept(self):
+        url = "foo.com_1@resource.calendar.google.com"
+        self.assertTrue(self.scrubber.text(url).endswith(
+            "@resource.calendar.google.com"))
+        self.assertNotIn("foo.com", self.scrubber.uri(
+            "https://www.googleapis.com/calendar/v3/calendars/"
+            "foo.com_1%40resource.calendar.google.com/events?syncToken=x"))
+
+    def test_dropped_fields(self):
+        e = self.scrubber.json({"htmlLink": "https://x", "id": "abc"})
+        self.assertEqual(e, {"id": "abc"})
+
+    def test_multipart(self):
+        body = self.scrubber.body(BATCH_RESPONSE,
+                                  "multipart/mixed; boundary=batch_abc")
+        self.assertNotIn("Secret", body)
+        self.assertNotIn("Content-Length", body)
+        self.assertIn("Content-ID: <response-1234+1>", body)
+        self.assertIn('"id":"abc"', body)
+        self.assertTrue(body.endswith("--batch_abc--\r\n"))
+
+
+class RecordReplayTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.scrubber = replay.Scrubber(salt="test")
+        self.calendar_conf = {
+            "url": "foo.com_1@resource.calendar.google.com",
+            "domain": "foo.com"
+        }
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def record(self):
+        cassette = replay.CassetteWriter(self.path, scrubber=self.scrubber)
+        domain = gcalbridge.domain.Domain("foo.com", {"account": "foo@foo.com"},
+                                          authorize=False)
+        domain.http = replay.RecordingHttp(HttpMockSequence([
+            ({'status': '200'}, dataread("calendarList.json")),
+            ({'status': '200'}, dataread("calendar-events.json")),
+        ]), cassette, tag="foo.com")
+        c = gcalbridge.calendar.Calendar(self.calendar_conf,
+                                         {"foo.com": domain})
+        updated = c.update_events()
+        cassette.close()
+        return updated
+
+    def test_record(self):
+        self.record()
+        header, records = replay.read_cassette(self.path)
+        self.assertEqual(header["version"], replay.CASSETTE_VERSION)
+        self.assertEqual(len(records), 2)
+        self.assertTrue(records[0]["path"].endswith("/calendarList"))
+        for r in records:
+            self.assertNotIn("foo@foo.com", r["body"])
+            self.assertNotIn("foo.com", r["path"])
+            json.loads(r["body"])
+
+    def test_replay(self):
+        recorded = self.record()
+        header, records = replay.read_cassette(self.path)
+        http = replay.ReplayHttp(records, tag="foo.com")
+        domain = gcalbridge.domain.Domain("foo.com", {"account": "foo@foo.com"},
+                                          authorize=False, http=http)
+        conf = dict(self.calendar_conf,
+                    url=self.scrubber.text(self.calendar_conf["url"]))
+        c = gcalbridge.calendar.Calendar(conf, {"foo.com": domain})
+        self.assertEqual(c.update_events(), recorded)
+        self.assertEqual(http.remaining(), 0)
+        with self.assertRaises(gcalbridge.errors.ReplayError):
+            c.update_events()
+
+    def test_replay_sync(self):
+        tag = self.scrubber.domain("foo.com")
+        urls = ["foo.com_1@resource.calendar.google.com",
+                "foo.com_2@resource.calendar.google.com"]
+        layout = {"room": {"calendars": [
+            {"url": self.scrubber.text(u), "domain": tag} for u in urls]}}
+        cassette = replay.CassetteWriter(self.path, layout=layout,
+                                         scrubber=self.scrubber)
+        domain = gcalbridge.domain.Domain("foo.com", {"account": "foo@foo.com"},
+                                          authorize=False)
+        domain.http = replay.RecordingHttp(HttpMockSequence([
+            ({'status': '200'}, dataread("calendarList.json")),
+            ({'status': '200'}, dataread("calendar-events.json")),
+            ({'status': '200'}, dataread("calendar-events.json")),
+            ({'status': '200'}, dataread("calendar-events-empty.json")),
+            ({'status': '200'}, dataread("calendar-events-empty.json")),
+        ]), cassette, tag=tag)
+        group = gcalbridge.calendar.SyncedCalendar("room", {"calendars": [
+            {"url": u, "domain": "foo.com"} for u in urls]},
+            domains={"foo.com": domain})
+        recorded = group.sync()
+        cassette.close()
+
+        changes, requests, seconds = replay.replay(self.path)
+        self.assertEqual(changes, recorded)
+        self.assertEqual(requests, 5)
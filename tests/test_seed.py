@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+""" Seed tests
+
+Unit tests for seed module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi, seed
+
+
+class CountingHttp(fakeapi.FakeHttp):
+    """
+    Remembers the method and path of every API request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fakeapi.FakeHttp.__init__(self, *args, **kwargs)
+        self.log = []
+
+    def request(self, uri, method="GET", body=None, *args, **kwargs):
+        if "/discovery/" not in uri:
+            self.log.append((method, uri.split("?")[0], body or ""))
+        return fakeapi.FakeHttp.request(self, uri, method, body, *args,
+                                        **kwargs)
+
+
+class SeederTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+        self.dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.dir, "bar.checkpoint")
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        self.urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                     "bar.com": "bar.com_1@resource.calendar.google.com"}
+        self.domains = {}
+        for d, url in self.urls.items():
+            self.api.add_calendar(url, "room@" + d, summary="Room")
+            self.domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d, "initial_batch_size": 10},
+                authorize=False, http=CountingHttp(self.api, "room@" + d))
+        self.ids = []
+        foo = self.api.calendars[self.urls["foo.com"]]
+        for i in range(25):
+            event = self.api.random_event()
+            event['id'] = self.api.new_id()
+            self.api._finish(foo, event)
+            self.ids.append(event['id'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def group(self):
+        return gcalbridge.calendar.SyncedCalendar("room", {"calendars": [
+            {"url": self.urls["foo.com"], "domain": "foo.com"},
+            {"url": self.urls["bar.com"], "domain": "bar.com", "seed": True,
+             "seed_workers": 2, "seed_checkpoint": self.checkpoint}]},
+            domains=self.domains)
+
+    def test_seed_with_import(self):
+        group = self.group()
+        group.sync()
+        bar = self.api.calendars[self.urls["bar.com"]]
+        self.assertEqual(sorted(bar.events), sorted(self.ids))
+        log = self.domains["bar.com"].http.log
+        # Three batches of imports, and no inserts at all.
+        batches = [r[2] for r in log if "/batch" in r[1]]
+        self.assertEqual(len(batches), 3)
+        self.assertTrue(all("/events/import?" in b for b in batches))
+        self.assertFalse([b for b in batches if "/events?" in b])
+        self.assertFalse(group.calendars[1].seed)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume_from_checkpoint(self):
+        with open(self.checkpoint, "w") as f:
+            f.writelines(id + "\n" for id in self.ids[:20])
+        group = self.group()
+        for cal in group.calendars:
+            cal.update_events()
+        seeder = seed.Seeder(group.calendars[1], group.calendars[:1],
+                             checkpoint=self.checkpoint)
+        self.assertEqual(len(seeder.pending()), 5)
+        self.assertEqual(seeder.run(), 5)
+
+    def test_import_body(self):
+        body = seed.import_body({"id": "x", "etag": "1", "summary": "s"})
+        self.assertEqual(body, {"id": "x", "summary": "s"})
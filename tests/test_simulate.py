@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+""" Simulate tests
+
+Unit tests for simulate module"""
+
+import unittest
+from apiclient.discovery import build
+from gcalbridge.simulate import simulate, regressions
+
+
+class SimulateTest(unittest.TestCase):
+    def setUp(self):
+        build('calendar', 'v3')
+
+    def test_groups_converge(self):
+        for size in (2, 4):
+            result = simulate(size, rounds=3, edits=8, events=5, seed=1)
+            self.assertEqual(regressions(result), [])
+            self.assertEqual(result["unconverged"], 0)
+            self.assertGreater(result["edits"], 0)
+
+    def test_repeatable(self):
+        a = simulate(3, rounds=2, edits=5, events=3, seed=7)
+        b = simulate(3, rounds=2, edits=5, events=3, seed=7)
+        for k in ("edits", "max_iterations", "calls_per_edit"):
+            self.assertEqual(a[k], b[k])
+
+    def test_thresholds(self):
+        result = {"unconverged": 1, "max_iterations": 5,
+                  "calls_per_edit": 3.0, "cpu_per_edit": 0.01}
+        self.assertEqual(len(regressions(result, max_cpu=0.005)), 4)
+        self.assertEqual(len(regressions(result, max_iterations=None,
+                                         max_calls=None)), 1)
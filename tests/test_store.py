@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+""" Store tests
+
+Unit tests for store module"""
+
+import os
+import tempfile
+import unittest
+from gcalbridge import store
+from gcalbridge.calendar import Event
+
+
+def event(id, summary="x"):
+    return Event({"id": id, "status": "confirmed", "summary": summary,
+                  "updated": "2016-08-01T00:00:00.000Z", "sequence": 0})
+
+
+class EventStoreTest(unittest.TestCase):
+    def make_store(self):
+        return store.EventStore()
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_dict_behaviour(self):
+        self.store["a"] = event("a")
+        self.assertIn("a", self.store)
+        self.assertNotIn("b", self.store)
+        self.assertEqual(self.store["a"]["summary"], "x")
+        self.assertIsNone(self.store.get("b"))
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(list(self.store.keys()), ["a"])
+        with self.assertRaises(KeyError):
+            self.store["b"]
+
+    def test_changed_since(self):
+        self.store["a"] = event("a")
+        self.store["b"] = event("b")
+        c = self.store.new_cycle()
+        self.assertEqual(self.store.changed_since(0), set(["a", "b"]))
+        self.assertEqual(self.store.changed_since(c), set())
+        self.store["b"] = event("b", "y")
+        self.assertEqual(self.store.changed_since(c), set(["b"]))
+        self.assertEqual(self.store.changed_since(0), set(["a", "b"]))
+
+    def test_dirty_items(self):
+        self.store["a"] = event("a")
+        self.store["b"] = event("b")
+        self.store["b"]["summary"] = "y"
+        self.assertEqual([k for k, v in self.store.dirty_items()], ["b"])
+
+
+class DiscardedTest(unittest.TestCase):
+    def test_kept_only_while_needed(self):
+        s = store.EventStore()
+        s["a"] = event("a")
+        s.discard("a")
+        # Nobody asked.
+        self.assertEqual(s.discarded_since(0), [])
+        s["a"] = event("a")
+        s["b"] = event("b")
+        s.keep_discarded(s.new_cycle())
+        s.discard("a")
+        c = s.new_cycle()
+        s.discard("b")
+        self.assertEqual(sorted(s.discarded_since(0)), ["a", "b"])
+        s.keep_discarded(c)
+        self.assertEqual(s.discarded_since(0), ["b"])
+        s["b"] = event("b")
+        self.assertEqual(s.discarded_since(0), [])
+
+
+class SqliteEventStoreTest(EventStoreTest):
+    def make_store(self):
+        return store.SqliteEventStore(":memory:")
+
+    def test_eviction_keeps_changes(self):
+        self.store.cache_size = 1
+        self.store["a"] = event("a")
+        self.store["a"]["summary"] = "y"
+        self.store["b"] = event("b")
+        self.assertNotIn("a", self.store.cache)
+        self.assertEqual(self.store["a"]["summary"], "y")
+        self.assertTrue(self.store["a"].dirty)
+        items = self.store.dirty_items()
+        self.assertEqual([k for k, v in items], ["a"])
+        items[0][1].dirty = False
+        self.store["c"] = event("c")
+        self.assertFalse(self.store["a"].dirty)
+        self.assertEqual(self.store.dirty_items(), [])
+
+    def test_persistence(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            s = store.SqliteEventStore(path)
+            s["a"] = event("a")
+            s.new_cycle()
+            s["b"] = event("b")
+            s.close()
+            s = store.SqliteEventStore(path)
+            self.assertEqual(sorted(s.keys()), ["a", "b"])
+            self.assertEqual(s.changed_since(s.cycle), set(["b"]))
+            self.assertIsInstance(s["a"], Event)
+            s.close()
+        finally:
+            os.unlink(path)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+""" Streaming tests
+
+Unit tests for streaming module"""
+
+import json
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi
+from gcalbridge.calendar import Event
+from gcalbridge.streaming import StreamedPage
+
+
+class StreamedPageTest(unittest.TestCase):
+    def test_items_one_at_a_time(self):
+        content = json.dumps({
+            "kind": "calendar#events", "nextPageToken": "abc",
+            "items": [{"id": "a", "start": {"date": "2016-08-01"}},
+                      {"id": "b", "summary": u"Caf\u00e9 [1, 2]"}],
+            "nextSyncToken": "xyz"}, indent=2, ensure_ascii=False)
+        page = StreamedPage(content.encode('utf-8'), Event)
+        items = page.get("items")
+        first = next(items)
+        self.assertIsInstance(first, Event)
+        self.assertEqual(first['start'], {"date": "2016-08-01"})
+        self.assertEqual([(e['id'], e['summary']) for e in items],
+                         [("b", u"Caf\u00e9 [1, 2]")])
+        self.assertEqual(page['nextPageToken'], "abc")
+        self.assertEqual(page['nextSyncToken'], "xyz")
+        self.assertNotIn("id", page)
+        # The text goes once the items have been read.
+        self.assertIsNone(page.content)
+        self.assertRaises(RuntimeError, list, page.get("items"))
+
+    def test_members_after_items_before_iterating(self):
+        page = StreamedPage('{"items": [{"id": "a"}], "nextSyncToken": "x"}')
+        self.assertIn("nextSyncToken", page)
+        self.assertEqual([e['id'] for e in page.get("items")], ["a"])
+
+    def test_no_items(self):
+        page = StreamedPage('{"items": [], "nextSyncToken": "x"}')
+        self.assertEqual(list(page.get("items")), [])
+        page = StreamedPage('{"nextSyncToken": "x"}')
+        self.assertIsNone(page.get("items"))
+        self.assertRaises(KeyError, lambda: page['nextPageToken'])
+
+
+class StreamedListTest(unittest.TestCase):
+    def test_paged_listing(self):
+        build('calendar', 'v3')
+        api = fakeapi.FakeCalendarAPI(seed=1)
+        url = "foo.com_1@resource.calendar.google.com"
+        cal = api.add_calendar(url, "room@foo.com")
+        for i in range(5):
+            event = api.random_event()
+            event['id'] = api.new_id()
+            api._finish(cal, event)
+        domain = gcalbridge.domain.Domain(
+            "foo.com", {"account": "room@foo.com"}, authorize=False,
+            http=fakeapi.FakeHttp(api, "room@foo.com"))
+        calendar = gcalbridge.calendar.Calendar(
+            {"url": url, "domain": "foo.com", "page_size": 2},
+            {"foo.com": domain})
+        requests = api.requests["room@foo.com"]
+
+        def parse_all(page):
+            self.fail("Page parsed twice")
+        StreamedPage._parse_all, saved = parse_all, StreamedPage._parse_all
+        try:
+            self.assertEqual(calendar.update_events(), 5)
+        finally:
+            StreamedPage._parse_all = saved
+        # Three pages.
+        self.assertEqual(api.requests["room@foo.com"] - requests, 3)
+        self.assertEqual(sorted(calendar.events), sorted(cal.events))
+        self.assertTrue(calendar.sync_token)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+""" Tracing tests
+
+Unit tests for tracing module"""
+
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from testfixtures import LogCapture
+from gcalbridge import fakeapi, tracing
+from gcalbridge.metrics import registry, Histogram
+from gcalbridge.timeutil import parse_rfc3339, format_rfc3339
+
+
+class FakeClock:
+    def __init__(self, now=1470000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Cal:
+    def __init__(self, name):
+        self.name = name
+
+
+class TimeUtilTest(unittest.TestCase):
+    def test_parse_rfc3339(self):
+        self.assertEqual(parse_rfc3339("2016-08-01T00:00:00Z"), 1470009600)
+        self.assertEqual(parse_rfc3339("2016-08-01T02:00:00.500+02:00"),
+                         1470009600.5)
+        self.assertEqual(parse_rfc3339("2016-08-01"), 1470009600)
+        self.assertIsNone(parse_rfc3339("yesterday"))
+        self.assertIsNone(parse_rfc3339(None))
+
+    def test_format_round_trip(self):
+        t = 1470009600.25
+        self.assertEqual(parse_rfc3339(format_rfc3339(t)), t)
+
+
+class PropagationTracerTest(unittest.TestCase):
+    def setUp(self):
+        registry.reset()
+        self.clock = FakeClock()
+        self.tracer = tracing.PropagationTracer("room", slow=60,
+                                                clock=self.clock)
+        self.a, self.b, self.c = Cal("a"), Cal("b"), Cal("c")
+        self.event = {"id": "e1",
+                      "updated": format_rfc3339(self.clock.now - 30)}
+
+    def test_latency_per_pair(self):
+        self.tracer.seen(self.a, self.event, self.clock.now - 2)
+        self.clock.now += 1
+        self.tracer.merged("e1", self.a)
+        self.tracer.queued("e1")
+        self.tracer.queued("e1")
+        self.tracer.settle("e1")
+        self.clock.now += 4
+        self.assertEqual(self.tracer.acked(self.b, "e1", self.clock.now - 4,
+                                           self.clock.now - 1), 35)
+        self.assertIn("e1", self.tracer.traces)
+        self.tracer.acked(self.c, "e1", self.clock.now - 4, self.clock.now)
+        self.assertNotIn("e1", self.tracer.traces)
+        h = registry.histogram("propagation_latency", source="a", target="b")
+        self.assertEqual(h.count, 1)
+        self.assertEqual(h.sum, 35)
+
+    def test_slow_propagation_logged(self):
+        self.tracer.seen(self.a, self.event, self.clock.now)
+        self.tracer.merged("e1", self.a)
+        self.tracer.queued("e1")
+        self.clock.now += 60
+        with LogCapture() as l:
+            self.tracer.acked(self.b, "e1", self.clock.now - 10,
+                              self.clock.now - 5)
+        l.check(("root", "WARNING", "Slow propagation of e1 from a to b: "
+                 "90.0s (poll_wait 30.0s, fetch 0.0s, merge 0.0s, "
+                 "queue 5.0s, write 5.0s)"))
+
+    def test_not_the_winner(self):
+        self.tracer.seen(self.a, self.event, self.clock.now)
+        self.tracer.merged("e1", self.b)
+        self.tracer.queued("e1")
+        self.assertNotIn("e1", self.tracer.traces)
+        self.assertIsNone(self.tracer.acked(self.c, "e1", 0, 0))
+
+    def test_nothing_written(self):
+        self.tracer.seen(self.a, self.event, self.clock.now)
+        self.tracer.merged("e1", self.a)
+        self.tracer.settle("e1")
+        self.assertEqual(self.tracer.traces, {})
+
+    def test_failed_write(self):
+        self.tracer.seen(self.a, self.event, self.clock.now)
+        self.tracer.merged("e1", self.a)
+        self.tracer.queued("e1")
+        self.tracer.failed("e1")
+        self.assertEqual(self.tracer.traces, {})
+
+
+class HistogramTest(unittest.TestCase):
+    def test_quantiles(self):
+        h = Histogram([1, 10, 100])
+        for v in [0.5, 2, 3, 50, 1000]:
+            h.observe(v)
+        self.assertEqual(h.counts, [1, 2, 1, 1])
+        self.assertEqual(h.quantile(0.5), 10)
+        self.assertIsNone(h.quantile(1))
+
+
+class SyncTracingTest(unittest.TestCase):
+    def setUp(self):
+        registry.reset()
+        build('calendar', 'v3')
+        self.api = fakeapi.FakeCalendarAPI(seed=1)
+        self.urls = {"foo.com": "foo.com_1@resource.calendar.google.com",
+                     "bar.com": "bar.com_1@resource.calendar.google.com"}
+        domains = {}
+        for d, url in self.urls.items():
+            self.api.add_calendar(url, "room@" + d, summary="Room")
+            domains[d] = gcalbridge.domain.Domain(
+                d, {"account": "room@" + d}, authorize=False,
+                http=fakeapi.FakeHttp(self.api, "room@" + d))
+        self.group = gcalbridge.calendar.SyncedCalendar("room", {
+            "calendars": [{"url": url, "domain": d}
+                          for d, url in self.urls.items()]},
+            domains=domains)
+
+    def latencies(self):
+        source = [c.name for c in self.group.calendars
+                  if c.domain_id == "foo.com"]
+        target = [c.name for c in self.group.calendars
+                  if c.domain_id == "bar.com"]
+        h = registry.histogram("propagation_latency", source=source[0],
+                               target=target[0])
+        return h.count if h else 0
+
+    def add(self):
+        event = self.api.random_event()
+        event['id'] = self.api.new_id()
+        self.api._finish(self.api.calendars[self.urls["foo.com"]], event)
+
+    def test_sync_records_propagation(self):
+        self.group.sync()
+        self.add()
+        self.group.sync()
+        self.assertEqual(self.latencies(), 1)
+        self.assertEqual(self.group.tracer.traces, {})
+
+    def test_initial_sync_not_traced(self):
+        for i in range(3):
+            self.add()
+        self.group.sync()
+        self.assertEqual(self.latencies(), 0)
+        self.assertEqual(self.group.tracer.traces, {})
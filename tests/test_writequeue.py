@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+""" Write queue tests
+
+Unit tests for writequeue module"""
+
+import unittest
+import gcalbridge
+from apiclient.discovery import build
+from gcalbridge import fakeapi, writequeue
+from gcalbridge.calendar import Event
+from gcalbridge.timeutil import format_rfc3339
+
+NOW = 1470000000.0
+HOUR = 3600
+
+
+def event(id, start, updated=NOW - HOUR, **kwargs):
+    e = Event({"id": id, "status": "confirmed", "sequence": 0,
+               "start": {"dateTime": format_rfc3339(start)},
+               "end": {"dateTime": format_rfc3339(start + HOUR)},
+               "updated": format_rfc3339(updated)})
+    e.update(kwargs)
+    return e
+
+
+class WriteQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = writequeue.WriteQueue(clock=lambda: NOW)
+
+    def test_coalesce_updates(self):
+        old = event("a", NOW, summary="old")
+        new = event("a", NOW, updated=NOW, summary="new")
+        self.assertTrue(self.queue.put(writequeue.UPDATE, "a", new))
+        self.assertFalse(self.queue.put(writequeue.UPDATE, "a", old))
+        writes = self.queue.drain()
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(writes[0].body['summary'], "new")
+        self.assertEqual(self.queue.coalesced, 1)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_insert_stays_insert(self):
+        self.queue.put(writequeue.INSERT, "a", event("a", NOW))
+        self.queue.put(writequeue.UPDATE, "a",
+                       event("a", NOW, updated=NOW, summary="x"))
+        self.queue.put(writequeue.PATCH, "a", {"location": "here"})
+        write, = self.queue.drain()
+        self.assertEqual(write.kind, writequeue.INSERT)
+        self.assertEqual(write.body['summary'], "x")
+        self.assertEqual(write.body['location'], "here")
+
+    def test_update_supersedes_patch(self):
+        self.queue.put(writequeue.PATCH, "a", {"location": "here"})
+        self.queue.put(writequeue.UPDATE, "a", event("a", NOW))
+        write, = self.queue.drain()
+        self.assertEqual(write.kind, writequeue.UPDATE)
+
+    def test_inserts_without_id_kept_apart(self):
+        self.queue.put(writequeue.INSERT, None, {"summary": "a"})
+        self.queue.put(writequeue.INSERT, None, {"summary": "b"})
+        self.assertEqual(len(self.queue.drain()), 2)
+
+    def test_priority(self):
+        for e in [event("later", NOW + 90 * 24 * HOUR),
+                  event("past", NOW - 48 * HOUR),
+                  event("now", NOW - HOUR / 2),
+                  event("soon", NOW + HOUR),
+                  event("soon-fresh", NOW + HOUR, updated=NOW)]:
+            self.queue.put(writequeue.UPDATE, e['id'], e)
+        self.assertEqual([w.event_id for w in self.queue.drain()],
+                         ["now", "soon-fresh", "soon", "later", "past"])
+
+
+class CalendarWriteQueueTest(unittest.TestCase):
+    def test_one_write_per_event(self):
+        build('calendar', 'v3')
+        api = fakeapi.FakeCalendarAPI(seed=1)
+        url = "foo.com_1@resource.calendar.google.com"
+        cal = api.add_calendar(url, "room@foo.com")
+        e = api.random_event()
+        e['id'] = api.new_id()
+        api._finish(cal, e)
+        domain = gcalbridge.domain.Domain(
+            "foo.com", {"account": "room@foo.com"}, authorize=False,
+            http=fakeapi.FakeHttp(api, "room@foo.com"))
+        c = gcalbridge.calendar.Calendar({"url": url, "domain": "foo.com"},
+                                         {"foo.com": domain})
+        c.update_events()
+        requests = api.requests["room@foo.com"]
+        c.begin_batch()
+        mine = c.events[e['id']]
+        c.update_event(mine['id'], mine)
+        mine['summary'] = "Changed"
+        self.assertEqual(c.push_events(), 1)
+        self.assertEqual(len(c.queue), 1)
+        c.commit_batch()
+        self.assertEqual(api.requests["room@foo.com"], requests + 1)
+        self.assertEqual(cal.events[e['id']]['summary'], "Changed")